@@ -1,44 +1,86 @@
-import apriltag
+# usage: python detect_apriltag.py --image apriltag.png
+# usage: python detect_apriltag.py --image frames/ --families tag36h11,tag25h9 --workers 8 --display 0
+# usage: python detect_apriltag.py --video input.mp4 --decimate 2 --quad-blur 0.8
 import argparse
+import sys
+import os
 import cv2
 
+# the shared `pyimagesearch` package lives alongside the video AR lesson
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "AR-6-video_ar_with_aruco"))
+from pyimagesearch.apriltag_backend import get_apriltag_detector, detect_images, detect_stream
+from pyimagesearch.batch_detection import expand_inputs
+
 ap = argparse.ArgumentParser()
-ap.add_argument("-i", "--image", required=True, help="path to input image with AprilTag")
+ap.add_argument("-i", "--image", type=str, default="", help="path to input image with AprilTag, or a directory / glob pattern of images")
+ap.add_argument("-v", "--video", type=str, default="", help="path to input video with AprilTags, instead of --image")
+# To see a list of possible families, refer to `python_apriltag_families.webp`
+ap.add_argument("-f", "--families", type=str, default="tag36h11", help="comma separated AprilTag families to detect in one pass")
+ap.add_argument("-t", "--threads", type=int, default=0, help="threads the detector uses for a single image. default is 0 (every core)")
+ap.add_argument("-w", "--workers", type=int, default=0, help="images detected in parallel for batches and videos. default is 0 (every core)")
+ap.add_argument("--decimate", type=float, default=1.0, help="detect quads on an image decimated by this factor. Faster, but misses small tags")
+ap.add_argument("--quad-blur", type=float, default=0.0, help="sigma of the Gaussian blur applied to the decimated image")
+ap.add_argument("--refine-edges", type=int, default=1, help="whether or not to snap the tag edges to the full resolution image")
+ap.add_argument("-b", "--blur", type=int, default=0, help="size of a Gaussian blur applied to --image inputs first, e.g. 7. default is 0 (none; --quad-blur is cheaper)")
+ap.add_argument("-d", "--display", type=int, default=1, help="whether or not to display the detections")
 args = vars(ap.parse_args())
+if args["image"] == "" and args["video"] == "":
+    ap.error("one of --image or --video is required")
+
+options = {"quadDecimate": args["decimate"], "quadBlur": args["quad_blur"], "refineEdges": args["refine_edges"] > 0}
+
+def preprocess(image):
+    if args["blur"] > 0:
+        return cv2.GaussianBlur(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY), (args["blur"], args["blur"]), 0)
+    return image
+
+def draw(image, corners, ids, families):
+    for (corner, id, family) in zip(corners, ids, families):
+        # extract bounding box coordinates, in the TL, TR, BR, BL order of the ArUCo detector:
+        (a, b, c, d) = [(int(p[0]), int(p[1])) for p in corner]
+
+        # draw lines:
+        cv2.line(image, a, b, (0, 0, 255), 2)
+        cv2.line(image, b, c, (0, 0, 255), 2)
+        cv2.line(image, c, d, (0, 0, 255), 2)
+        cv2.line(image, d, a, (0, 0, 255), 2)
+
+        # draw center of the bounding box:
+        (centerX, centerY) = corner.mean(axis=0).astype(int)
+        cv2.circle(image, (int(centerX), int(centerY)), 4, (255, 0, 0), -1)
+
+        cv2.putText(image, f"{family} {id}", (a[0], a[1] - 15), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
+    return image
+
+if args["video"] != "":
+    # frames are read ahead and detected on a pool of single-threaded detectors
+    vs = cv2.VideoCapture(args["video"])
+    count = 0
+    for (frame, corners, ids, families) in detect_stream(vs, args["families"], args["workers"] or None, **options):
+        count += 1
+        if args["display"] > 0:
+            cv2.imshow("apriltag", draw(frame, corners, ids, families))
+            if cv2.waitKey(1) & 0xFF == ord("q"):
+                break
+        else:
+            print(f"frame {count}: {len(ids)} AprilTags ({', '.join(sorted(set(families)))})")
+    vs.release()
+    sys.exit(0)
+
+paths = expand_inputs([args["image"]])
+if len(paths) == 1:
+    # a single image: the detector spreads its own work over `threads` threads
+    image = cv2.imread(paths[0])
+    detector = get_apriltag_detector(args["families"], nthreads=args["threads"] or None, **options)
+    (corners, ids, families) = detector.detect(preprocess(image))
+    print(f"{len(ids)} number of AprilTags were detected")
+    draw(image, corners, ids, families)
+    if args["display"] > 0:
+        cv2.imshow("apriltag", image)
+        cv2.waitKey(0)
+    sys.exit(0)
 
-image = cv2.imread(args["image"])
-gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-blurred = cv2.GaussianBlur(gray, (7, 7), 0)
-
-# instantiate AprilTags detector
-# Essentially, go through each valid family of tags to see which one yields successful detections
-# Typically, one would use Tag36h11
-# The detection is robust even for rotated images
-options = apriltag.DetectorOptions(families="tag36h11") # To see a list of possible families, refer to `python_apriltag_families.webp`
-detector = apriltag.Detector(options)
-results = detector.detect(blurred)
-print(f"{len(results)} number of AprilTags were detected")
-
-for r in results:
-    # extract bounding box coordinates:
-    (a, b, c, d) = r.corners
-    a = (int(a[0]), int(a[1]))
-    b = (int(b[0]), int(b[1]))
-    c = (int(c[0]), int(c[1]))
-    d = (int(d[0]), int(d[1]))
-
-    # draw lines:
-    cv2.line(image, a, b, (0, 0, 255), 2)
-    cv2.line(image, b, c, (0, 0, 255), 2)
-    cv2.line(image, c, d, (0, 0, 255), 2)
-    cv2.line(image, d, a, (0, 0, 255), 2)
-
-    # draw center of the bounding box:
-    centerX = int( r.center[0] )
-    centerY = int( r.center[1] )
-    cv2.circle(image, (centerX, centerY), 4, (255, 0, 0), -1)
-
-    tag_family = r.tag_family.decode("utf-8")
-    cv2.putText(image, tag_family, (a[0], a[1] - 15), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2 )
-cv2.imshow("apriltag", image)
-cv2.waitKey(0)
\ No newline at end of file
+# a batch: one single-threaded detector per pool thread, one image per detector at a time
+images = (preprocess(cv2.imread(path)) for path in paths)
+for (path, (corners, ids, families)) in zip(paths, detect_images(images, args["families"], args["workers"] or None, **options)):
+    print(f"{path}: {len(ids)} AprilTags {sorted(zip(families, ids.tolist()))}")
@@ -1,57 +1,63 @@
+# usage: python opencv_aruco_generation.py --output tag_923.png --id 923
+# bulk: python opencv_aruco_generation.py --output markers/ --ids all --type DICT_6X6_1000
+# bulk: python opencv_aruco_generation.py --output sheets/ --ids 0-499 --type DICT_6X6_1000 --sheet 5x7 --size 200
 import numpy as np
 import argparse
 import cv2
 import sys
+import os
 
-ap = argparse.ArgumentParser()
-# output path to the ArUCo tage that will be generated
-ap.add_argument("-o", "--output", required=True, help="path to output image containing ArUCo tag")
-# the unique ID of the ArUCo tag generated. The ID must be a valid ID in the ArUCo dictionary used for generation
-ap.add_argument("-i", "--id", type=int, required=True, help="ID of ArUCo tag to generate")
-# the name of the ArUCo dictionary that will be used to generate the tag
-ap.add_argument("-t", "--type", type=str, default="DICT_ARUCO_ORIGINAL", help="type of ArUCo tag to generate")
-args = vars(ap.parse_args())
+# the shared `pyimagesearch` package lives alongside the video AR lesson
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "AR-6-video_ar_with_aruco"))
+from pyimagesearch.marker_sheets import parse_ids, generate_bulk
+from pyimagesearch.aruco_registry import ARUCO_DICT, get_dictionary
 
-ARUCO_DICT = {
-	"DICT_4X4_50": cv2.aruco.DICT_4X4_50,
-	"DICT_4X4_100": cv2.aruco.DICT_4X4_100,
-	"DICT_4X4_250": cv2.aruco.DICT_4X4_250,
-	"DICT_4X4_1000": cv2.aruco.DICT_4X4_1000,
-	"DICT_5X5_50": cv2.aruco.DICT_5X5_50,
-	"DICT_5X5_100": cv2.aruco.DICT_5X5_100,
-	"DICT_5X5_250": cv2.aruco.DICT_5X5_250,
-	"DICT_5X5_1000": cv2.aruco.DICT_5X5_1000,
-	"DICT_6X6_50": cv2.aruco.DICT_6X6_50,
-	"DICT_6X6_100": cv2.aruco.DICT_6X6_100,
-	"DICT_6X6_250": cv2.aruco.DICT_6X6_250,
-	"DICT_6X6_1000": cv2.aruco.DICT_6X6_1000,
-	"DICT_7X7_50": cv2.aruco.DICT_7X7_50,
-	"DICT_7X7_100": cv2.aruco.DICT_7X7_100,
-	"DICT_7X7_250": cv2.aruco.DICT_7X7_250,
-	"DICT_7X7_1000": cv2.aruco.DICT_7X7_1000,
-	"DICT_ARUCO_ORIGINAL": cv2.aruco.DICT_ARUCO_ORIGINAL, # Default dict
-	"DICT_APRILTAG_16h5": cv2.aruco.DICT_APRILTAG_16h5,
-	"DICT_APRILTAG_25h9": cv2.aruco.DICT_APRILTAG_25h9,
-	"DICT_APRILTAG_36h10": cv2.aruco.DICT_APRILTAG_36h10,
-	"DICT_APRILTAG_36h11": cv2.aruco.DICT_APRILTAG_36h11
-}
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    # output path to the ArUCo tage that will be generated
+    ap.add_argument("-o", "--output", required=True, help="path to output image containing ArUCo tag, or output directory in bulk mode")
+    # the unique ID of the ArUCo tag generated. The ID must be a valid ID in the ArUCo dictionary used for generation
+    ap.add_argument("-i", "--id", type=int, help="ID of ArUCo tag to generate")
+    # the name of the ArUCo dictionary that will be used to generate the tag
+    ap.add_argument("-t", "--type", type=str, default="DICT_ARUCO_ORIGINAL", help="type of ArUCo tag to generate")
+    # bulk mode: render many IDs headlessly across worker processes
+    ap.add_argument("--ids", type=str, default=None, help="IDs to generate in bulk, e.g. \"0-99,120\" or \"all\" for the whole dictionary")
+    ap.add_argument("--sheet", type=str, default=None, help="render tiled sheets of COLSxROWS markers instead of one file per marker, e.g. 5x7")
+    ap.add_argument("-s", "--size", type=int, default=300, help="side of every marker in pixels")
+    ap.add_argument("-w", "--workers", type=int, default=os.cpu_count(), help="number of worker processes used in bulk mode")
+    args = vars(ap.parse_args())
+    if args["id"] is None and args["ids"] is None:
+        ap.error("one of --id or --ids is required")
 
-# verify that the supplied ArUCo tag exists:
-if ARUCO_DICT.get(args["type"], None) is None:
-    print(f"ArUCo tage {args['type']} is not supported")
-    sys.exit(0)
+    # verify that the supplied ArUCo tag exists:
+    if ARUCO_DICT.get(args["type"], None) is None:
+        print(f"ArUCo tage {args['type']} is not supported")
+        sys.exit(0)
 
-arucoDict = cv2.aruco.getPredefinedDictionary(ARUCO_DICT[args["type"]])
-print(f"generating ArUCo tag type {args['type']}, with ID {args['id']}")
-tag = np.zeros((300, 300, 1), dtype="uint8")
-# cv2.aruco.drawMarker:
-# Inputs:
-# 1 dictionary: dictionary of markers indicating the type of markers
-# 2 id: ID of the marker that will be returned. Has to be a valid ID in the specified dictionary
-# 3 sidePixels: The size of the image in pixels
-# 4 image: the array where the output marker (image) will be stored
-# 5 border: the width of the padding (border) around the marker
-cv2.aruco.generateImageMarker(arucoDict, args["id"], 300, tag, 1)
-cv2.imwrite(args["output"], tag)
-cv2.imshow("ArUCo tag", tag)
-cv2.waitKey(0)
\ No newline at end of file
+    arucoDict = get_dictionary(args["type"])
+
+    if args["ids"] is not None:
+        try:
+            ids = parse_ids(args["ids"], len(arucoDict.bytesList))
+        except ValueError as e:
+            print(e)
+            sys.exit(0)
+        sheet = None if args["sheet"] is None else tuple(int(n) for n in args["sheet"].lower().split("x"))
+        print(f"generating {len(ids)} ArUCo tags of type {args['type']} into {args['output']}")
+        paths = generate_bulk(args["type"], ids, args["output"], size=args["size"], sheet=sheet, workers=args["workers"])
+        print(f"wrote {len(paths)} file(s)")
+        sys.exit(0)
+
+    print(f"generating ArUCo tag type {args['type']}, with ID {args['id']}")
+    tag = np.zeros((args["size"], args["size"], 1), dtype="uint8")
+    # cv2.aruco.drawMarker:
+    # Inputs:
+    # 1 dictionary: dictionary of markers indicating the type of markers
+    # 2 id: ID of the marker that will be returned. Has to be a valid ID in the specified dictionary
+    # 3 sidePixels: The size of the image in pixels
+    # 4 image: the array where the output marker (image) will be stored
+    # 5 border: the width of the padding (border) around the marker
+    cv2.aruco.generateImageMarker(arucoDict, args["id"], args["size"], tag, 1)
+    cv2.imwrite(args["output"], tag)
+    cv2.imshow("ArUCo tag", tag)
+    cv2.waitKey(0)
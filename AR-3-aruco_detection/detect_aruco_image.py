@@ -1,80 +1,103 @@
 # https://pyimagesearch.com/2020/12/21/detecting-aruco-markers-with-opencv-and-python/?_ga=2.251116933.2030539365.1702202819-1842902230.1698424416
 # try: python detect_aruco_image.py --image singlemarkersoriginal.jpg --type DICT_6X6_250
+# batch: python detect_aruco_image.py --batch frames/ "captures/**/*.png" @more_frames.txt --type DICT_6X6_250 --output detections.bin
+# batch: python detect_aruco_image.py --batch frames/ --type DICT_6X6_250 --output detections.arlog
+# tuned: python detect_aruco_image.py --image singlemarkersoriginal.jpg --type DICT_6X6_250 --profile studio
+# tiled: python detect_aruco_image.py --image survey.ppm --tile 2048 --overlap 256 --display 0
+# tiled: python detect_aruco_image.py --image survey.raw --raw-shape 7000x10000x3 --tile 2048 --threads 8 --display 0
 import argparse
 import imutils
 import cv2
 import sys
+import os
 
-ap = argparse.ArgumentParser()
-ap.add_argument("-i", "--image", required=True, help="path to input image containing ArUCo tag")
-# The type of ArUCo tag used for detection must be the same as the ArUCo tag used for generation
-# In the case when the type of dictionary used for ArUCo tag generation is unknown, there are other methods available
-ap.add_argument("-t", "--type", type=str, default="DICT_ARUCO_ORIGINAL", help="type of ArUCo tag to detect")
+# the shared `pyimagesearch` package lives alongside the video AR lesson
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "AR-6-video_ar_with_aruco"))
+from pyimagesearch.batch_detection import expand_inputs, detect_many, open_writer
+from pyimagesearch.aruco_registry import ARUCO_DICT, get_detector
+from pyimagesearch.tiled_detection import TiledDetector, open_image
 
-args = vars(ap.parse_args())
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-i", "--image", help="path to input image containing ArUCo tag")
+    # The type of ArUCo tag used for detection must be the same as the ArUCo tag used for generation
+    # In the case when the type of dictionary used for ArUCo tag generation is unknown, there are other methods available
+    ap.add_argument("-t", "--type", type=str, default="DICT_ARUCO_ORIGINAL", help="type of ArUCo tag to detect")
+    # batch mode: detect over many images with a pool of worker processes and stream the results to a file
+    ap.add_argument("-b", "--batch", nargs="+", help="directories, glob patterns or @file lists of images to detect in")
+    ap.add_argument("-o", "--output", type=str, default="detections.jsonl", help="batch results file: .jsonl for JSON lines, .arlog for a memory-mapped detection log, anything else for the compact binary format")
+    ap.add_argument("-w", "--workers", type=int, default=os.cpu_count(), help="number of worker processes used in batch mode")
+    ap.add_argument("-p", "--profile", type=str, default="", help="name (or path) of a detector parameter profile written by tune_detector.py. default is \"\" (the default parameters)")
+    ap.add_argument("--overlay", type=str, default=None, help="directory to write annotated images to in batch mode. default is None (no rendering)")
+    # tiled mode: very large images are detected tile by tile on a thread pool instead of resized
+    ap.add_argument("--tile", type=int, default=0, help="side, in pixels, of the tiles --image is detected in. default is 0 (the full image in one call)")
+    ap.add_argument("--overlap", type=int, default=256, help="overlap of the tiles, in pixels. Must be larger than the largest tag")
+    ap.add_argument("--threads", type=int, default=0, help="number of threads detecting tiles. default is 0 (every core)")
+    ap.add_argument("--raw-shape", type=str, default="", help="HxWxC of a headerless .raw --image, which is memory-mapped like .npy, .pgm and .ppm images")
+    ap.add_argument("-d", "--display", type=int, default=1, help="whether or not to display the detections")
 
-# define names of each possible ArUco tag OpenCV supports
-ARUCO_DICT = {
-	"DICT_4X4_50": cv2.aruco.DICT_4X4_50,
-	"DICT_4X4_100": cv2.aruco.DICT_4X4_100,
-	"DICT_4X4_250": cv2.aruco.DICT_4X4_250,
-	"DICT_4X4_1000": cv2.aruco.DICT_4X4_1000,
-	"DICT_5X5_50": cv2.aruco.DICT_5X5_50,
-	"DICT_5X5_100": cv2.aruco.DICT_5X5_100,
-	"DICT_5X5_250": cv2.aruco.DICT_5X5_250,
-	"DICT_5X5_1000": cv2.aruco.DICT_5X5_1000,
-	"DICT_6X6_50": cv2.aruco.DICT_6X6_50,
-	"DICT_6X6_100": cv2.aruco.DICT_6X6_100,
-	"DICT_6X6_250": cv2.aruco.DICT_6X6_250,
-	"DICT_6X6_1000": cv2.aruco.DICT_6X6_1000,
-	"DICT_7X7_50": cv2.aruco.DICT_7X7_50,
-	"DICT_7X7_100": cv2.aruco.DICT_7X7_100,
-	"DICT_7X7_250": cv2.aruco.DICT_7X7_250,
-	"DICT_7X7_1000": cv2.aruco.DICT_7X7_1000,
-	"DICT_ARUCO_ORIGINAL": cv2.aruco.DICT_ARUCO_ORIGINAL,
-	"DICT_APRILTAG_16h5": cv2.aruco.DICT_APRILTAG_16h5,
-	"DICT_APRILTAG_25h9": cv2.aruco.DICT_APRILTAG_25h9,
-	"DICT_APRILTAG_36h10": cv2.aruco.DICT_APRILTAG_36h10,
-	"DICT_APRILTAG_36h11": cv2.aruco.DICT_APRILTAG_36h11
-}
+    args = vars(ap.parse_args())
+    if args["image"] is None and args["batch"] is None:
+        ap.error("one of --image or --batch is required")
 
-image = cv2.imread(args["image"])
-# image = imutils.resize(image, width=600)
+    if (ARUCO_DICT.get(args["type"], None) is None):
+        print(f"ArUCo tag {args['type']} is invalid")
+        sys.exit(0)
 
-if (ARUCO_DICT.get(args["type"], None) is None):
-    print(f"ArUCo tag {args['type']} is invalid")
-    sys.exit(0)
+    if args["batch"] is not None:
+        paths = expand_inputs(args["batch"])
+        print(f"detecting {args['type']} type ArUCo tags in {len(paths)} images")
+        if args["overlay"] is not None:
+            os.makedirs(args["overlay"], exist_ok=True)
+        writer = open_writer(args["output"], dictionary=args["type"])
+        for (path, ids, corners) in detect_many(paths, args["type"], workers=args["workers"], overlayDir=args["overlay"], params=args["profile"] or None):
+            writer.write(path, ids, corners)
+        writer.close()
+        sys.exit(0)
 
-print(f"detecting {args['type']} type ArUCo tags")
-arucoDict = cv2.aruco.getPredefinedDictionary(ARUCO_DICT.get(args["type"]))
+    print(f"detecting {args['type']} type ArUCo tags")
+    if args["tile"] > 0:
+        # uncompressed inputs are memory-mapped and only read tile by tile; the full image is only loaded to be shown
+        rawShape = tuple(int(v) for v in args["raw_shape"].lower().split("x")) if args["raw_shape"] != "" else None
+        tiled = open_image(args["image"], rawShape)
+        detector = TiledDetector(args["type"], args["profile"] or None, tileSize=args["tile"], overlap=args["overlap"], workers=args["threads"] or None)
+        (corners, ids, rejected) = detector.detectMarkers(tiled)
+        image = tiled.to_bgr() if args["display"] > 0 else None
+    else:
+        image = cv2.imread(args["image"])
+        # image = imutils.resize(image, width=600)
 
-# Get the ArUCo parameters used for detection
-# Unless there is a good reason, using the default parameters are generally sufficient to get good results
-arucoParams = cv2.aruco.DetectorParameters()
-(corners, ids, rejected) = cv2.aruco.detectMarkers(image, arucoDict, parameters=arucoParams)
-print(corners)
-print(ids)
+        # Get the shared detector for this dictionary, built with the default ArUCo detection parameters
+        # Unless there is a good reason, using the default parameters are generally sufficient to get good results
+        # (or the tuned parameters of --profile)
+        detector = get_detector(args["type"], args["profile"] or None)
+        (corners, ids, rejected) = detector.detectMarkers(image)
+    print(corners)
+    print(ids)
+    if image is None:
+        sys.exit(0)
 
-if ids is not None and len(ids > 0):
-    ids = ids.flatten()
+    if ids is not None and len(ids > 0):
+        ids = ids.flatten()
 
-    for (corner, id) in zip(corners, ids):
-        top_left = corner[0][0]
-        top_right = corner[0][1]
-        bottom_right = corner[0][2]
-        bottom_left = corner[0][3]
-        center_x = int((top_right[0] + bottom_left[0]) // 2)
-        center_y = int((top_right[1] + bottom_left[1]) // 2)
-        top_left =     (int(top_left[0]), int(top_left[1]))
-        top_right =    (int(top_right[0]), int(top_right[1]))
-        bottom_right = (int(bottom_right[0]), int(bottom_right[1]))
-        bottom_left =  (int(bottom_left[0]), int(bottom_left[1]))
-        cv2.line(image, top_left, top_right, (0, 0, 255), 3)
-        cv2.line(image, top_right, bottom_right, (0, 0, 255), 3)
-        cv2.line(image, bottom_right, bottom_left, (0, 0, 255), 3)
-        cv2.line(image, top_left, bottom_left, (0, 0, 255), 3)
-        cv2.circle(image, (center_x, center_y), 5, (0, 255, 0), -1)
-        cv2.putText(image, str(id), (top_left[0] + 3, top_left[1] - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 0), 2)
+        for (corner, id) in zip(corners, ids):
+            top_left = corner[0][0]
+            top_right = corner[0][1]
+            bottom_right = corner[0][2]
+            bottom_left = corner[0][3]
+            center_x = int((top_right[0] + bottom_left[0]) // 2)
+            center_y = int((top_right[1] + bottom_left[1]) // 2)
+            top_left =     (int(top_left[0]), int(top_left[1]))
+            top_right =    (int(top_right[0]), int(top_right[1]))
+            bottom_right = (int(bottom_right[0]), int(bottom_right[1]))
+            bottom_left =  (int(bottom_left[0]), int(bottom_left[1]))
+            cv2.line(image, top_left, top_right, (0, 0, 255), 3)
+            cv2.line(image, top_right, bottom_right, (0, 0, 255), 3)
+            cv2.line(image, bottom_right, bottom_left, (0, 0, 255), 3)
+            cv2.line(image, top_left, bottom_left, (0, 0, 255), 3)
+            cv2.circle(image, (center_x, center_y), 5, (0, 255, 0), -1)
+            cv2.putText(image, str(id), (top_left[0] + 3, top_left[1] - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 0), 2)
 
-cv2.imshow("detected", image)
-cv2.waitKey(0)
\ No newline at end of file
+    if args["display"] > 0:
+        cv2.imshow("detected", image)
+        cv2.waitKey(0)
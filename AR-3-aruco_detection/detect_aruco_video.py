@@ -1,83 +1,218 @@
+# usage: python detect_aruco_video.py --type DICT_ARUCO_ORIGINAL
+# usage: python detect_aruco_video.py --video recording.mp4 --log recording.arlog
+# usage: python detect_aruco_video.py --video recording.mp4 --log recording.arlog --display 0
+# usage: python detect_aruco_video.py --calibration camera.yml --marker-length 0.05
+# usage: python detect_aruco_video.py --type DICT_6X6_250 --profile studio
+# usage: python detect_aruco_video.py --type auto --probe-interval 5
 from imutils.video import VideoStream
+import numpy as np
 import argparse
 import imutils
 import time
 import cv2
 import sys
+import os
 
-ap = argparse.ArgumentParser()
-ap.add_argument("-t", "--type", type=str, default="DICT_ARUCO_ORIGINAL", help="type of ArUCo tag to detect")
-args = vars(ap.parse_args())
-
-ARUCO_DICT = {
-	"DICT_4X4_50": cv2.aruco.DICT_4X4_50,
-	"DICT_4X4_100": cv2.aruco.DICT_4X4_100,
-	"DICT_4X4_250": cv2.aruco.DICT_4X4_250,
-	"DICT_4X4_1000": cv2.aruco.DICT_4X4_1000,
-	"DICT_5X5_50": cv2.aruco.DICT_5X5_50,
-	"DICT_5X5_100": cv2.aruco.DICT_5X5_100,
-	"DICT_5X5_250": cv2.aruco.DICT_5X5_250,
-	"DICT_5X5_1000": cv2.aruco.DICT_5X5_1000,
-	"DICT_6X6_50": cv2.aruco.DICT_6X6_50,
-	"DICT_6X6_100": cv2.aruco.DICT_6X6_100,
-	"DICT_6X6_250": cv2.aruco.DICT_6X6_250,
-	"DICT_6X6_1000": cv2.aruco.DICT_6X6_1000,
-	"DICT_7X7_50": cv2.aruco.DICT_7X7_50,
-	"DICT_7X7_100": cv2.aruco.DICT_7X7_100,
-	"DICT_7X7_250": cv2.aruco.DICT_7X7_250,
-	"DICT_7X7_1000": cv2.aruco.DICT_7X7_1000,
-	"DICT_ARUCO_ORIGINAL": cv2.aruco.DICT_ARUCO_ORIGINAL,
-	"DICT_APRILTAG_16h5": cv2.aruco.DICT_APRILTAG_16h5,
-	"DICT_APRILTAG_25h9": cv2.aruco.DICT_APRILTAG_25h9,
-	"DICT_APRILTAG_36h10": cv2.aruco.DICT_APRILTAG_36h10,
-	"DICT_APRILTAG_36h11": cv2.aruco.DICT_APRILTAG_36h11
-}
-
-if (ARUCO_DICT.get(args["type"], None) is None):
-    print(f"ArUCo tag {args['type']} is invalid")
-    sys.exit(0)
-
-print(f"detecting {args['type']} type ArUCo tags")
-arucoDict = cv2.aruco.getPredefinedDictionary(ARUCO_DICT.get(args["type"]))
-
-# Get the ArUCo parameters used for detection
-# Unless there is a good reason, using the default parameters are generally sufficient to get good results
-arucoParams = cv2.aruco.DetectorParameters()
-
-vs = VideoStream(src=0).start()
-time.sleep(2.0)
-
-key = cv2.waitKey(1) & 0xFF
-while key != ord("q"):
-    frame = vs.read()
-    frame = imutils.resize(frame, width=1000)
-
-    (corners, ids, rejected) = cv2.aruco.detectMarkers(frame, arucoDict, parameters=arucoParams)
-
-    if ids is not None and len(ids > 0):
-        ids = ids.flatten()
-
-        # loop over the potential markers detected
-        for (corner, id) in zip(corners, ids):
-            top_left = corner[0][0]
-            top_right = corner[0][1]
-            bottom_right = corner[0][2]
-            bottom_left = corner[0][3]
-            center_x = int((top_right[0] + bottom_left[0]) // 2)
-            center_y = int((top_right[1] + bottom_left[1]) // 2)
-            top_left =     (int(top_left[0]), int(top_left[1]))
-            top_right =    (int(top_right[0]), int(top_right[1]))
-            bottom_right = (int(bottom_right[0]), int(bottom_right[1]))
-            bottom_left =  (int(bottom_left[0]), int(bottom_left[1]))
-            cv2.line(frame, top_left, top_right, (0, 0, 255), 3)
-            cv2.line(frame, top_right, bottom_right, (0, 0, 255), 3)
-            cv2.line(frame, bottom_right, bottom_left, (0, 0, 255), 3)
-            cv2.line(frame, top_left, bottom_left, (0, 0, 255), 3)
-            cv2.circle(frame, (center_x, center_y), 5, (0, 255, 0), -1)
-            cv2.putText(frame, str(id), (top_left[0] + 3, top_left[1] - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 0), 2)
+# the shared `pyimagesearch` package lives alongside the video AR lesson
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "AR-6-video_ar_with_aruco"))
+from pyimagesearch.marker_tracking import MarkerTracker
+from pyimagesearch.aruco_registry import ARUCO_DICT, get_dictionary, get_parameters, get_detector
+from pyimagesearch.pyramid_detection import PyramidDetector
+from pyimagesearch.frame_ring import SharedFrameRing
+from pyimagesearch.ring_detection import RingDetectionPool
+from pyimagesearch.batch_detection import draw_markers
+from pyimagesearch.detection_log import DetectionLogWriter
+from pyimagesearch.calibration import load_camera_model, estimate_poses
+from pyimagesearch.live_discovery import LiveDiscovery
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-t", "--type", type=str, default="DICT_ARUCO_ORIGINAL", help="type of ArUCo tag to detect, or \"auto\" to discover the dictionaries in view and lock onto them")
+    ap.add_argument("-k", "--track", type=int, default=0, help="run full detection only every N frames and track the tags in between. default is 0 (detect on every frame)")
+    ap.add_argument("--track-mode", type=str, default="flow", choices=["flow", "roi"], help="how tags are followed between detections: optical flow or ROI re-detection")
+    ap.add_argument("-p", "--pyramid", type=int, default=0, help="side, in pixels, of the smallest marker to find. Enables coarse-to-fine detection on the full-resolution frame. default is 0 (resize to a width of 1000 instead)")
+    ap.add_argument("-w", "--workers", type=int, default=0, help="number of detection worker processes fed through shared memory. default is 0 (detect in this process)")
+    ap.add_argument("-v", "--video", type=str, default="", help="path to a recorded video to detect in instead of the camera")
+    ap.add_argument("-l", "--log", type=str, default="", help="directory of a detection log to record the tags of every frame to, in full resolution coordinates. default is \"\" (no log)")
+    ap.add_argument("--profile", type=str, default="", help="name (or path) of a detector parameter profile written by tune_detector.py. default is \"\" (the default parameters)")
+    ap.add_argument("--calibration", type=str, default="", help="camera calibration file (.yml/.xml/.npz/.json). When given, the pose of every tag is estimated and drawn")
+    ap.add_argument("--marker-length", type=float, default=1.0, help="side of the tags, in the unit the poses are reported in")
+    ap.add_argument("--sample-frames", type=int, default=10, help="with --type auto: number of early frames every dictionary is probed on")
+    ap.add_argument("--probe-interval", type=float, default=5.0, help="with --type auto: seconds between two background probes for new dictionaries. 0 to never probe again")
+    ap.add_argument("-d", "--display", type=int, default=1, help="whether or not to show the frames. 0 runs headless (e.g. to record a --log of a --video), until the end of the video or Ctrl+C")
+    args = vars(ap.parse_args())
+    if args["log"] != "" and args["workers"] > 0:
+        ap.error("--log records every frame in order, which the --workers loop does not")
+    auto = args["type"] == "auto"
+    if auto and (args["workers"] > 0 or args["track"] > 0 or args["pyramid"] > 0 or args["log"] != ""):
+        ap.error("--type auto detects several dictionaries per frame, which --workers, --track, --pyramid and --log do not support")
+
+    # show a frame and return the key pressed, or None when running headless
+    def show(frame):
+        if args["display"] <= 0:
+            return None
+        cv2.imshow("VideoStream", frame)
+        return cv2.waitKey(1) & 0xFF
+
+    if not auto and (ARUCO_DICT.get(args["type"], None) is None):
+        print(f"ArUCo tag {args['type']} is invalid")
+        sys.exit(0)
+
+    discovery = None
+    if auto:
+        # every dictionary is probed on the first frames only, then just the dictionaries found are detected
+        print("discovering the ArUCo tag types in view")
+        discovery = LiveDiscovery(params=args["profile"] or None, sampleFrames=args["sample_frames"], probeInterval=args["probe_interval"],
+                                  callback=lambda event, name: print(f"{event} {name}"))
+        args["type"] = "DICT_ARUCO_ORIGINAL" # only names the (unused) single-dictionary detector below
+    else:
+        print(f"detecting {args['type']} type ArUCo tags")
+    arucoDict = get_dictionary(args["type"])
+
+    # Get the ArUCo parameters used for detection
+    # Unless there is a good reason, using the default parameters are generally sufficient to get good results
+    # --profile loads parameters tuned for our conditions by tune_detector.py instead
+    arucoParams = get_parameters(args["profile"] or None)
+    detector = get_detector(args["type"], args["profile"] or None)
+    if args["pyramid"] > 0:
+        # detect on a downscaled level picked from the expected marker size, refine the corners on the full frame
+        detector = PyramidDetector(detector, args["pyramid"])
+    tracker = None
+    if args["track"] > 0:
+        tracker = MarkerTracker(arucoDict, arucoParams, detectEvery=args["track"], mode=args["track_mode"], detector=detector)
+
+    log = None
+    if args["video"] != "":
+        # a recording is read frame by frame, so that a log of it lines up with every frame of the file
+        capture = cv2.VideoCapture(args["video"])
+        read = lambda: capture.read()[1]
+        stop = capture.release
+        fps = capture.get(cv2.CAP_PROP_FPS) or None
+    else:
+        vs = VideoStream(src=0).start()
+        time.sleep(2.0)
+        read = vs.read
+        stop = vs.stop
+        fps = None
+    camera = load_camera_model(args["calibration"]) if args["calibration"] != "" else None
+    if args["log"] != "":
+        # without an fps (camera), the frames are timestamped with the wall clock
+        log = DetectionLogWriter(args["log"], dictionary=args["type"], fps=fps)
+
+    if args["workers"] > 0:
+        # the capture side (this process) writes every frame into a ring of shared memory slots and only sends
+        # the slot's sequence number to the workers, which detect on the slot in place. Frames are never pickled
+        # tracking needs the previous frame, so --track only applies to the single-process loop
+        # results arrive out of order and stale ones are dropped, so --log does too
+        frame = read()
+        if args["pyramid"] <= 0:
+            frame = imutils.resize(frame, width=1000)
+        maxInFlight = 2 * args["workers"]
+        # two spare slots: the one being filled and the one being displayed are never handed to a worker
+        ring = SharedFrameRing(maxInFlight + 2, frame.shape, frame.dtype)
+        pool = RingDetectionPool(ring, args["type"], args["workers"], pyramid=args["pyramid"])
+        lastShown = -1
+
+        key = None
+        while key != ord("q"):
+            if pool.inFlight < maxInFlight:
+                frame = read()
+                if frame is None: # end of the recording
+                    break
+                (seq, slot) = ring.claim()
+                if args["pyramid"] <= 0:
+                    cv2.resize(frame, (slot.shape[1], slot.shape[0]), dst=slot, interpolation=cv2.INTER_AREA)
+                else:
+                    slot[:] = frame
+                ring.publish(seq)
+                pool.submit(seq)
+                continue
+
+            (seq, corners, ids) = pool.get()
+            # results arrive in completion order: a frame older than the one on screen is skipped
+            if ids is None or seq < lastShown:
+                continue
+            frame = ring.view(seq)
+            if frame is None:
+                continue
+            lastShown = seq
+            # the slot is not reused before maxInFlight newer frames are written, so it can be drawn on in place
+            draw_markers(frame, corners, ids)
+            key = show(frame)
+
+        pool.close()
+        frame = None
+        ring.close()
+        ring.unlink()
+        if args["display"] > 0:
+            cv2.destroyAllWindows()
+        stop()
+        sys.exit(0)
+
+    key = None
+    while key != ord("q"):
+        frame = read()
+        if frame is None: # end of the recording
+            break
+        fullW = frame.shape[1]
+        if args["pyramid"] <= 0:
+            frame = imutils.resize(frame, width=1000)
+
+        labels = None
+        if discovery is not None:
+            # one (corners, ids) per dictionary found: merged into one list, labelled with their dictionary
+            found = discovery.detect(frame)
+            corners = [c.reshape(1, 4, 2) for (name, (cs, _)) in found.items() for c in cs]
+            ids = np.array([[i] for (name, (_, ds)) in found.items() for i in ds], dtype="int32") if len(corners) > 0 else None
+            labels = [f"{name[5:]} {i}" for (name, (_, ds)) in found.items() for i in ds]
+        elif tracker is not None:
+            (corners, ids) = tracker.update(frame)
+        else:
+            (corners, ids, rejected) = detector.detectMarkers(frame)
+        # the corners in the coordinates of the frames as recorded
+        fullCorners = np.array(corners, dtype="float32").reshape(-1, 4, 2) * (fullW / frame.shape[1])
+        if log is not None:
+            # the log is in full resolution coordinates, so it can drive find_and_warp on the recorded frames
+            log.append(fullCorners, ids)
+        if camera is not None and ids is not None and len(ids) > 0:
+            # only the corner points are undistorted, and the poses of all tags come out of one batched call
+            fullSize = (fullW, int(round(frame.shape[0] * fullW / frame.shape[1])))
+            (rvecs, tvecs) = estimate_poses(fullCorners, args["marker_length"], camera, fullSize)
+            K = camera.matrix_for(fullSize).copy()
+            K[:2] *= frame.shape[1] / fullW
+            for (rvec, tvec) in zip(rvecs, tvecs):
+                cv2.drawFrameAxes(frame, K, camera.distCoeffs, rvec, tvec, args["marker_length"] / 2)
+
+        if ids is not None and len(ids > 0):
+            ids = ids.flatten()
+            if labels is None:
+                labels = [str(id) for id in ids]
+
+            # loop over the potential markers detected
+            for (corner, id, label) in zip(corners, ids, labels):
+                top_left = corner[0][0]
+                top_right = corner[0][1]
+                bottom_right = corner[0][2]
+                bottom_left = corner[0][3]
+                center_x = int((top_right[0] + bottom_left[0]) // 2)
+                center_y = int((top_right[1] + bottom_left[1]) // 2)
+                top_left =     (int(top_left[0]), int(top_left[1]))
+                top_right =    (int(top_right[0]), int(top_right[1]))
+                bottom_right = (int(bottom_right[0]), int(bottom_right[1]))
+                bottom_left =  (int(bottom_left[0]), int(bottom_left[1]))
+                cv2.line(frame, top_left, top_right, (0, 0, 255), 3)
+                cv2.line(frame, top_right, bottom_right, (0, 0, 255), 3)
+                cv2.line(frame, bottom_right, bottom_left, (0, 0, 255), 3)
+                cv2.line(frame, top_left, bottom_left, (0, 0, 255), 3)
+                cv2.circle(frame, (center_x, center_y), 5, (0, 255, 0), -1)
+                cv2.putText(frame, label, (top_left[0] + 3, top_left[1] - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 0), 2)
     
-    cv2.imshow("VideoStream", frame)
-    key = cv2.waitKey(1) & 0xFF
+        key = show(frame)
 
-cv2.destroyAllWindows()
-vs.stop()
\ No newline at end of file
+    if log is not None:
+        log.close()
+    if discovery is not None:
+        discovery.close()
+    if args["display"] > 0:
+        cv2.destroyAllWindows()
+    stop()
@@ -0,0 +1,27 @@
+# usage: python detection_client.py --image example_01.png --type DICT_5X5_100
+# usage: python detection_client.py --image example_01.png --address unix:/tmp/aruco.sock --encode .png
+# usage: python detection_client.py --image apriltag.png --kind apriltag --families tag36h11
+import argparse
+import json
+import cv2
+import sys
+import os
+
+# the shared `pyimagesearch` package lives alongside the video AR lesson
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "AR-6-video_ar_with_aruco"))
+from pyimagesearch.detection_service import DetectionClient
+
+ap = argparse.ArgumentParser()
+ap.add_argument("-i", "--image", type=str, required=True, help="path to input image containing tags")
+ap.add_argument("-a", "--address", type=str, default="127.0.0.1:5557", help="address of detection_server.py: host:port, or unix:/path/to/socket")
+ap.add_argument("-k", "--kind", type=str, default="aruco", choices=["aruco", "apriltag"], help="kind of tags to detect")
+ap.add_argument("-t", "--type", type=str, default="DICT_ARUCO_ORIGINAL", help="type of ArUCo tag to detect")
+ap.add_argument("-f", "--families", type=str, default="tag36h11", help="AprilTag families to detect")
+ap.add_argument("-e", "--encode", type=str, default="", help="extension used to compress the image before sending it, e.g. .jpg. default is \"\", in which case raw pixels are sent")
+args = vars(ap.parse_args())
+
+image = cv2.imread(args["image"])
+client = DetectionClient(args["address"])
+reply = client.detect(image, kind=args["kind"], encode=args["encode"] if args["encode"] != "" else None, dictionary=args["type"], families=args["families"])
+client.close()
+print(json.dumps(reply))
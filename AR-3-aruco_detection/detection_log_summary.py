@@ -0,0 +1,30 @@
+# Per-marker analytics straight from a detection log, without running detection again
+# usage: python detection_log_summary.py --log recording.arlog
+# usage: python detection_log_summary.py --log recording.arlog --id 923 --csv tag923.csv
+import numpy as np
+import argparse
+import sys
+import os
+
+# the shared `pyimagesearch` package lives alongside the video AR lesson
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "AR-6-video_ar_with_aruco"))
+from pyimagesearch.detection_log import DetectionLog
+
+ap = argparse.ArgumentParser()
+ap.add_argument("-l", "--log", type=str, required=True, help="directory of the detection log")
+ap.add_argument("-i", "--id", type=int, default=-1, help="marker id to export the track of. default is -1 (summary only)")
+ap.add_argument("-c", "--csv", type=str, default="", help="path to write the track of --id to as CSV: frame, timestamp, then the 8 corner coordinates")
+args = vars(ap.parse_args())
+
+log = DetectionLog(args["log"])
+print(f"{len(log)} detections over {log.frames} frames ({log.meta['dictionary']})")
+unreadable = [path for (path, status) in log.images() if status == "unreadable"]
+if len(unreadable) > 0:
+    print(f"{len(unreadable)} images could not be read: {', '.join(unreadable[:5])}{' ...' if len(unreadable) > 5 else ''}")
+for (markerID, report) in sorted(log.summary().items()):
+    print(f"id {markerID}: seen in {report['frames']} frames ({100.0 * report['frames'] / max(log.frames, 1):.1f}%), frames {report['first']}-{report['last']}, mean motion {report['mean_motion_px']:.2f} px")
+
+if args["id"] >= 0 and args["csv"] != "":
+    (frames, timestamps, corners) = log.track(args["id"])
+    rows = np.column_stack([frames, timestamps, corners.reshape(-1, 8)])
+    np.savetxt(args["csv"], rows, delimiter=",", fmt=["%d", "%.6f"] + ["%.3f"] * 8, header="frame,timestamp,tl_x,tl_y,tr_x,tr_y,br_x,br_y,bl_x,bl_y", comments="")
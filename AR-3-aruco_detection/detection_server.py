@@ -0,0 +1,38 @@
+# Long-running detection service: pays the cv2 import and detector setup once, then answers requests over a socket
+# usage: python detection_server.py
+# usage: python detection_server.py --address unix:/tmp/aruco.sock --workers 8
+# usage: python detection_server.py --address 127.0.0.1:5557 --max-in-flight 128 --max-queue-ms 200 --processes 1
+# query it with detection_client.py, or with pyimagesearch.detection_service.DetectionClient
+import argparse
+import asyncio
+import sys
+import os
+
+# the shared `pyimagesearch` package lives alongside the video AR lesson
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "AR-6-video_ar_with_aruco"))
+from pyimagesearch.detection_service import DetectionService
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-a", "--address", type=str, default="127.0.0.1:5557", help="host:port, or unix:/path/to/socket")
+    ap.add_argument("-w", "--workers", type=int, default=0, help="size of the worker pool. default is 0 (one per CPU)")
+    ap.add_argument("-m", "--max-in-flight", type=int, default=64, help="requests accepted at a time, the rest are rejected as busy")
+    ap.add_argument("-q", "--max-queue-ms", type=float, default=500.0, help="requests that waited longer than this for a worker are answered with a timeout")
+    ap.add_argument("-b", "--batch-size", type=int, default=8, help="largest number of requests handed to a worker at once")
+    ap.add_argument("--batch-window-ms", type=float, default=0.0, help="how long a partial batch waits for more requests once a worker is free. default is 0 (no wait)")
+    ap.add_argument("-p", "--processes", type=int, default=0, help="whether or not to detect in worker processes instead of threads")
+    args = vars(ap.parse_args())
+
+    service = DetectionService(
+        workers=args["workers"] if args["workers"] > 0 else None,
+        maxInFlight=args["max_in_flight"],
+        maxQueueMs=args["max_queue_ms"],
+        batchSize=args["batch_size"],
+        batchWindowMs=args["batch_window_ms"],
+        processes=args["processes"] > 0
+    )
+    print(f"serving on {args['address']} with {service.workers} workers")
+    try:
+        asyncio.run(service.serve(args["address"]))
+    except KeyboardInterrupt:
+        print(f"served {service.served} requests, rejected {service.rejected} as busy, {service.expired} timed out")
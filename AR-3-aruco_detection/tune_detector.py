@@ -0,0 +1,55 @@
+# Search for the fastest DetectorParameters that still meet an accuracy floor, and save them as a named profile
+# usage: python tune_detector.py --name fast_720p --type DICT_ARUCO_ORIGINAL --size 1280x720
+# usage: python tune_detector.py --name studio --type DICT_6X6_250 --labels reference.jsonl --min-recall 0.99
+# then:  python detect_aruco_video.py --type DICT_6X6_250 --profile studio
+import argparse
+import sys
+import os
+
+# the shared `pyimagesearch` package lives alongside the video AR lesson
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "AR-6-video_ar_with_aruco"))
+from pyimagesearch.param_tuning import synthetic_frames, labelled_frames, tune, save_profile
+from pyimagesearch.aruco_registry import ARUCO_DICT
+
+ap = argparse.ArgumentParser()
+ap.add_argument("-n", "--name", type=str, required=True, help="name of the profile to write")
+ap.add_argument("-t", "--type", type=str, default="DICT_ARUCO_ORIGINAL", help="type of ArUCo tag to tune for")
+ap.add_argument("-l", "--labels", type=str, default="", help="JSON lines file of labelled images (the .jsonl output of detect_aruco_image.py --batch). default is \"\" (synthetic frames)")
+ap.add_argument("-s", "--size", type=str, default="1280x720", help="WxH of the synthetic frames")
+ap.add_argument("-f", "--frames", type=int, default=30, help="number of synthetic frames")
+ap.add_argument("--ids", type=str, default="923,1001,241,1007", help="comma separated tag ids placed on every synthetic frame")
+ap.add_argument("-b", "--blur", type=float, default=0.8, help="sigma of the Gaussian blur applied to the synthetic frames")
+ap.add_argument("--noise", type=float, default=3.0, help="standard deviation of the noise added to the synthetic frames")
+ap.add_argument("-r", "--min-recall", type=float, default=0.98, help="lowest acceptable fraction of tags found")
+ap.add_argument("-e", "--max-corner-error", type=float, default=1.5, help="highest acceptable mean corner error, in pixels")
+ap.add_argument("-o", "--output", type=str, default="", help="path of the profile. default is \"\" (the shared profile directory, so it can be loaded by name)")
+ap.add_argument("-v", "--verbose", type=int, default=0, help="whether or not to print every evaluated parameter set")
+args = vars(ap.parse_args())
+
+if (ARUCO_DICT.get(args["type"], None) is None):
+    print(f"ArUCo tag {args['type']} is invalid")
+    sys.exit(0)
+
+if args["labels"] != "":
+    frames = labelled_frames(args["labels"], args["type"])
+else:
+    size = tuple(int(v) for v in args["size"].lower().split("x"))
+    ids = [int(i) for i in args["ids"].split(",")]
+    frames = synthetic_frames(args["frames"], size, args["type"], ids, blur=args["blur"], noise=args["noise"])
+print(f"tuning {args['type']} detection on {len(frames)} frames")
+
+def report(params, metrics, accepted):
+    if args["verbose"] > 0:
+        print(f"{'+' if accepted else ' '} {metrics['ms_per_frame']:7.2f} ms  recall {metrics['recall']:.3f}  error {metrics['corner_error_px']:.2f} px  {params}")
+
+(params, metrics, baseline) = tune(frames, args["type"], minRecall=args["min_recall"], maxCornerError=args["max_corner_error"], callback=report)
+if metrics["recall"] < args["min_recall"] or metrics["corner_error_px"] > args["max_corner_error"]:
+    print("no parameter set meets the accuracy floor, no profile written")
+    sys.exit(1)
+
+settings = {key: args[key] for key in ("labels", "size", "frames", "blur", "noise", "min_recall", "max_corner_error")}
+path = save_profile(args["name"], args["type"], params, metrics, baseline, path=args["output"] or None, settings=settings)
+print(f"defaults: {baseline['ms_per_frame']:.2f} ms/frame, recall {baseline['recall']:.3f}, error {baseline['corner_error_px']:.2f} px")
+print(f"{args['name']}: {metrics['ms_per_frame']:.2f} ms/frame, recall {metrics['recall']:.3f}, error {metrics['corner_error_px']:.2f} px")
+print(f"overrides: {params}")
+print(f"profile written to {path}")
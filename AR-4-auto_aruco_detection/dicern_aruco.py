@@ -1,50 +1,24 @@
-import cv2
+# usage: python dicern_aruco.py --image warehouse_01.jpg
+# usage: python dicern_aruco.py --image images/*.jpg --workers 8 --output discovered.jsonl
+# usage: python dicern_aruco.py --image warehouse_01.jpg --display 1
+from concurrent.futures import ProcessPoolExecutor
 import argparse
-ARUCO_DICT = {
-	"DICT_4X4_50": cv2.aruco.DICT_4X4_50,
-	"DICT_4X4_100": cv2.aruco.DICT_4X4_100,
-	"DICT_4X4_250": cv2.aruco.DICT_4X4_250,
-	"DICT_4X4_1000": cv2.aruco.DICT_4X4_1000,
-	"DICT_5X5_50": cv2.aruco.DICT_5X5_50,
-	"DICT_5X5_100": cv2.aruco.DICT_5X5_100,
-	"DICT_5X5_250": cv2.aruco.DICT_5X5_250,
-	"DICT_5X5_1000": cv2.aruco.DICT_5X5_1000,
-	"DICT_6X6_50": cv2.aruco.DICT_6X6_50,
-	"DICT_6X6_100": cv2.aruco.DICT_6X6_100,
-	"DICT_6X6_250": cv2.aruco.DICT_6X6_250,
-	"DICT_6X6_1000": cv2.aruco.DICT_6X6_1000,
-	"DICT_7X7_50": cv2.aruco.DICT_7X7_50,
-	"DICT_7X7_100": cv2.aruco.DICT_7X7_100,
-	"DICT_7X7_250": cv2.aruco.DICT_7X7_250,
-	"DICT_7X7_1000": cv2.aruco.DICT_7X7_1000,
-	"DICT_ARUCO_ORIGINAL": cv2.aruco.DICT_ARUCO_ORIGINAL,
-	"DICT_APRILTAG_16h5": cv2.aruco.DICT_APRILTAG_16h5,
-	"DICT_APRILTAG_25h9": cv2.aruco.DICT_APRILTAG_25h9,
-	"DICT_APRILTAG_36h10": cv2.aruco.DICT_APRILTAG_36h10,
-	"DICT_APRILTAG_36h11": cv2.aruco.DICT_APRILTAG_36h11
-}
-
-ap = argparse.ArgumentParser()
-ap.add_argument("-i", "--image", type=str, required=True, help="path to input image containing tags")
-args = vars(ap.parse_args())
-
-image = cv2.imread(args["image"])
+import json
+import sys
+import os
+import cv2
 
-for dict_name, dict_code in ARUCO_DICT.items():
-    arucoDict = cv2.aruco.getPredefinedDictionary(dict_code)
-    params = cv2.aruco.DetectorParameters()
-    (corners, ids, rejected) = cv2.aruco.detectMarkers(image, arucoDict, parameters=params)
+# the shared `pyimagesearch` package lives alongside the video AR lesson
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "AR-6-video_ar_with_aruco"))
+from pyimagesearch.dictionary_discovery import discover, discover_file
 
-    if ids is not None and len(ids) > 0:
-        ids = ids.flatten()
+def draw_results(image, results):
+    for (dict_name, (corners, ids)) in results.items():
         print(f"{len(ids)} tag(s) detected for dictionary type {dict_name}")
         image_copy = image.copy()
-        
+
         for ( corner, id ) in zip( corners, ids ):
-            top_left = corner[0][0]
-            top_right = corner[0][1]
-            bottom_right = corner[0][2]
-            bottom_left = corner[0][3]
+            (top_left, top_right, bottom_right, bottom_left) = corner
 
             top_left = (int(top_left[0]), int(top_left[1]))
             top_right = (int(top_right[0]), int(top_right[1]))
@@ -52,14 +26,43 @@ for dict_name, dict_code in ARUCO_DICT.items():
             bottom_left = (int(bottom_left[0]), int(bottom_left[1]))
             center_x = int((top_left[0] + bottom_right[0]) // 2)
             center_y = int((top_left[1] + bottom_right[1]) // 2)
-            
+
             cv2.line(image_copy, top_left, top_right, (0, 0, 255), 3)
             cv2.line(image_copy, top_right, bottom_right, (0, 0, 255), 3)
             cv2.line(image_copy, bottom_right, bottom_left, (0, 0, 255), 3)
             cv2.line(image_copy, bottom_left, top_left, (0, 0, 255), 3)
             cv2.circle(image_copy, (center_x, center_y), 3, (128, 128, 0), -1)
             cv2.putText(image_copy, str( id ), (top_left[0] + 10, top_left[1] + 10), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 0, 0), 2)
-        
+
         cv2.imshow(f"Detection results for {dict_name}", image_copy)
-        
-cv2.waitKey(0)
\ No newline at end of file
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-i", "--image", type=str, nargs="+", required=True, help="path(s) to input image(s) containing tags")
+    ap.add_argument("-w", "--workers", type=int, default=1, help="number of worker processes used when several images are given")
+    ap.add_argument("-o", "--output", type=str, default="", help="path to a JSON lines file for the results. default is \"\", in which case they are printed")
+    ap.add_argument("-d", "--display", type=int, default=0, help="whether or not to show a window per detected dictionary (single image only)")
+    args = vars(ap.parse_args())
+
+    # every candidate quad is extracted once per image and decoded against all dictionaries at the same time,
+    # instead of re-running the full detection once per dictionary
+    if args["display"] > 0:
+        image = cv2.imread(args["image"][0])
+        draw_results(image, discover(image))
+        cv2.waitKey(0)
+        sys.exit(0)
+
+    out = open(args["output"], "w") if args["output"] != "" else sys.stdout
+    paths = args["image"]
+    if args["workers"] > 1 and len(paths) > 1:
+        with ProcessPoolExecutor(max_workers=args["workers"]) as executor:
+            results = executor.map(discover_file, paths, chunksize=4)
+            for (path, found) in results:
+                out.write(json.dumps({"image": path, "dictionaries": found}) + "\n")
+    else:
+        for path in paths:
+            (path, found) = discover_file(path)
+            out.write(json.dumps({"image": path, "dictionaries": found}) + "\n")
+
+    if out is not sys.stdout:
+        out.close()
@@ -1,32 +1,78 @@
 # https://pyimagesearch.com/2021/01/04/opencv-augmented-reality-ar/?_ga=2.249952902.1816397012.1702485325-1842902230.1698424416
 # usage: python opencv_ar_image.py --image input_03.jpg --source alice_and_janet.jpeg
+# usage: python opencv_ar_image.py --image input_03.jpg --source alice_and_janet.jpeg --mode feather --feather 12 --output output.png --display 0
+# usage: python opencv_ar_image.py --image storefront.jpg --layout screens.json --source fallback.jpg
+# usage: python opencv_ar_image.py --image survey.ppm --source alice_and_janet.jpeg --tile 2048 --output output.png --display 0
 import numpy as np
 import argparse
 import imutils
 import sys
+import os
 import cv2
 
+# the shared `pyimagesearch` package lives alongside the video AR lesson
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "AR-6-video_ar_with_aruco"))
+from pyimagesearch.aruco_registry import get_detector
+from pyimagesearch.compositing import composite, MODES
+from pyimagesearch.surfaces import load_layout, SurfaceRenderer
+from pyimagesearch.tiled_detection import TiledDetector, open_image
+
 ap = argparse.ArgumentParser()
 ap.add_argument("-i", "--image", required=True, help="path to input image with ArUCo tag")
-ap.add_argument("-s", "--source", required=True, help="path to source image that will be put on ArUCo image")
+ap.add_argument("-s", "--source", type=str, default="", help="path to source image that will be put on ArUCo image")
+ap.add_argument("-l", "--layout", type=str, default="", help="JSON surface layout: every surface whose four tags are found gets its own source (or --source) from one detection pass")
+ap.add_argument("-m", "--mode", type=str, default="aa", choices=MODES, help="how the source is composited: hard mask, anti-aliased edges or feathered edges")
+ap.add_argument("-f", "--feather", type=int, default=8, help="width, in pixels, of the feathered edge")
+ap.add_argument("-o", "--output", type=str, default="", help="path to save the output image to. default is \"\", in which case, the output is NOT saved")
+ap.add_argument("-d", "--display", type=int, default=1, help="whether or not to display the output")
+ap.add_argument("-t", "--tile", type=int, default=0, help="side, in pixels, of the tiles the tags are detected in, for very large images. default is 0 (the full image in one call)")
+ap.add_argument("--overlap", type=int, default=256, help="overlap of the tiles, in pixels. Must be larger than the largest tag")
+ap.add_argument("--threads", type=int, default=0, help="number of threads detecting tiles. default is 0 (every core)")
 args = vars(ap.parse_args())
-
-# load images
-image = cv2.imread(args["image"])
-# image = imutils.resize(image, width=600)
-(imgH, imgW) = image.shape[:2]
-source = cv2.imread(args["source"])
+if args["source"] == "" and args["layout"] == "":
+    ap.error("--source is required without a --layout")
 
 # ArUCo detection
-arucoDict = cv2.aruco.getPredefinedDictionary(cv2.aruco.DICT_ARUCO_ORIGINAL)
-arucoParams = cv2.aruco.DetectorParameters()
+detector = get_detector("DICT_ARUCO_ORIGINAL")
 
-# Note that the order in which the id's are presented in the `ids` array is arbitrary --
-# The detector does not actually understand "Orientation"!
-(tags, ids, rejected) = cv2.aruco.detectMarkers(image, arucoDict, parameters=arucoParams)
+# load images
+if args["tile"] > 0:
+    # very large images: detected tile by tile on a thread pool, at full resolution. Uncompressed inputs (.npy,
+    # .pgm, .ppm) are memory-mapped for the detection and only loaded whole to be composited onto
+    tiled = open_image(args["image"])
+    (tags, ids, rejected) = TiledDetector("DICT_ARUCO_ORIGINAL", tileSize=args["tile"], overlap=args["overlap"], workers=args["threads"] or None).detectMarkers(tiled)
+    image = tiled.to_bgr()
+else:
+    image = cv2.imread(args["image"])
+    # image = imutils.resize(image, width=600)
+    # Note that the order in which the id's are presented in the `ids` array is arbitrary --
+    # The detector does not actually understand "Orientation"!
+    (tags, ids, rejected) = detector.detectMarkers(image)
+(imgH, imgW) = image.shape[:2]
+source = cv2.imread(args["source"]) if args["source"] != "" else None
+
+if args["layout"] != "":
+    # many surfaces: the tags are sorted into surfaces through the layout's id -> (surface, corner) index, and
+    # every surface whose four tags were found is composited with its own source
+    (layout, sourcePaths) = load_layout(args["layout"])
+    sources = {name: cv2.imread(path) for (name, path) in sourcePaths.items()}
+    for name in layout.names():
+        if sources.get(name) is None:
+            sources[name] = source
+    renderer = SurfaceRenderer(layout, detector, useCache=False, useROI=True, blend=args["mode"], feather=args["feather"])
+    (output, drawn) = renderer.render(image, sources, detections=(tags, ids))
+    print(f"{len(drawn)} of {len(layout)} surfaces drawn: {drawn}")
+    if args["output"] != "":
+        cv2.imwrite(args["output"], output)
+    if args["display"] > 0:
+        cv2.imshow("output", output)
+        cv2.waitKey(0)
+    sys.exit(0)
 
-if (len(tags) != 4):
-    print(f"missing coreners! Only {len(tags)} detected")
+# other tags in view are fine, as long as the four corner tags are all there
+missing = set((923, 1001, 241, 1007)) - set([] if ids is None else ids.flatten().tolist())
+if (len(missing) > 0):
+    print(f"missing coreners! Tags {sorted(missing)} not detected")
     sys.exit(0)
 
 ids = ids.flatten()
@@ -107,40 +153,19 @@ print(source_coordinates)
 # 1 source: the source image with all source coordinates
 # 2 H: the homography matrix
 # 3 size: the size of the destination image
-warped = cv2.warpPerspective(source, H, (imgW, imgH))
-cv2.imshow("warped", warped)
-cv2.waitKey(0)
-
-mask = np.ones((imgH, imgW), dtype='float')
-# fill a polygon with a certain color
-cv2.fillConvexPoly(mask, destination_coordinates.astype("int32"), (0, 0, 0), cv2.LINE_AA)
-
-# mask = mask / 255.0 # turn the mask into a binary image
-mask = np.dstack([mask] * 3) # stack the mask such that it shares the same dimensions as GBR images
-
-# warped_in_mask = cv2.multiply(warped.astype(float), mask)
-mask_in_image = cv2.multiply(image.astype(float), mask) # essentially, do an element by element multiplication
-output = cv2.add(warped.astype(float), mask_in_image) # element by element addition
-output = output.astype("uint8") # convert the data type to uint8 so that it can be displayed
-# cv2.imshow("warped in mask", warped_in_mask.astype("uint8"))
-
-# make sure that during the final display, the input image (matrix) has to have type uint8
-cv2.imshow("mask in image", mask_in_image.astype("uint8"))
-cv2.imshow("output", output)
-cv2.waitKey(0)
-
-mask = np.ones((imgH, imgW), dtype='uint8') * 255
-# fill a polygon with a certain color
-cv2.fillConvexPoly(mask, destination_coordinates.astype("int32"), (0, 0, 0), cv2.LINE_AA)
-
-
-# warped_in_mask = cv2.multiply(warped.astype(float), mask)
-mask_in_image = cv2.bitwise_and(image, image, mask=mask)
-output = cv2.add(warped, mask_in_image)
-output = output.astype("uint8") # convert the data type to uint8 so that it can be displayed
-# cv2.imshow("warped in mask", warped_in_mask.astype("uint8"))
-
-# make sure that during the final display, the input image (matrix) has to have type uint8
-cv2.imshow("mask in image 2", mask_in_image.astype("uint8"))
-cv2.imshow("output 2", output)
-cv2.waitKey(0)
\ No newline at end of file
+# composite: warps the source only inside the bounding rectangle of the destination coordinates and blends it into
+# the image in place, with uint8 masks and uint16 fixed-point products. Converting the image and the warped source to
+# float64 and stacking a 3-channel float mask takes eight times the memory of the image, which does not scale to
+# large (e.g. 24 MP) images
+# modes:
+# "hard": keep the image outside the quad and the source inside it
+# "aa": anti-aliased edges along the quad
+# "feather": the source fades in over `feather` pixels inside the quad
+output = composite(image, source, H, destination_coordinates, mode=args["mode"], feather=args["feather"])
+
+if args["output"] != "":
+    cv2.imwrite(args["output"], output)
+if args["display"] > 0:
+    # make sure that during the final display, the input image (matrix) has to have type uint8
+    cv2.imshow("output", output)
+    cv2.waitKey(0)
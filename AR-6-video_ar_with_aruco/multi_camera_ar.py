@@ -0,0 +1,51 @@
+# usage: python multi_camera_ar.py --input jp_trailer_short.mp4 --cameras 0,1
+# usage: python multi_camera_ar.py --input jp_trailer_short.mp4 --cameras 0,1,2,3 --output-dir results --display 0
+# usage: python multi_camera_ar.py --input jp_trailer_short.mp4 --cameras 0,1,2,3,4,5,6,7 --processes 2 --workers 4
+from pyimagesearch.multi_stream import MultiStreamRunner, open_stream, run_processes
+import threading
+import argparse
+import json
+import os
+import cv2
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-i", "--input", type=str, required=True, help="path to input video file warped onto every camera")
+    ap.add_argument("-m", "--cameras", type=str, default="0", help="comma separated camera indexes or stream URLs")
+    ap.add_argument("-o", "--output-dir", type=str, default="", help="directory the output video of every camera is saved to. default is \"\", in which case, the outputs are NOT saved")
+    ap.add_argument("-w", "--workers", type=int, default=0, help="number of threads per process. default is 0 (one per camera, capped at the number of CPUs)")
+    ap.add_argument("-p", "--processes", type=int, default=1, help="number of worker processes the cameras are spread over")
+    ap.add_argument("-d", "--display", type=int, default=1, help="whether or not to show a window per camera (single process only)")
+    ap.add_argument("-c", "--cache", type=int, default=1, help="whether or not to use the cache")
+    ap.add_argument("-r", "--roi", type=int, default=1, help="whether or not to composite in place, only inside the tags' bounding rectangle. 0 composites into a copy of every camera frame")
+    ap.add_argument("-k", "--track", type=int, default=0, help="run full tag detection only every N frames and track the tags in between")
+    ap.add_argument("-s", "--stats", type=int, default=0, help="whether or not to time every stage per camera and print the breakdown at the end")
+    args = vars(ap.parse_args())
+
+    specs = []
+    for (i, camera) in enumerate(args["cameras"].split(",")):
+        spec = {"name": f"camera{i}", "camera": camera, "input": args["input"], "cache": args["cache"], "roi": args["roi"], "track": args["track"], "stats": args["stats"]}
+        if args["output_dir"] != "":
+            os.makedirs(args["output_dir"], exist_ok=True)
+            spec["output"] = os.path.join(args["output_dir"], f"camera{i}.mp4")
+        specs.append(spec)
+    workers = args["workers"] if args["workers"] > 0 else None
+
+    if args["processes"] > 1:
+        reports = run_processes(specs, args["processes"], workers)
+    else:
+        # frames are handed back to the main thread, which is the only one allowed to make GUI calls
+        stop = threading.Event()
+        onFrame = None
+        if args["display"] > 0:
+            def onFrame(stream, frame):
+                cv2.imshow(stream.name, frame)
+                if cv2.waitKey(1) & 0xFF == ord("q"):
+                    stop.set()
+        runner = MultiStreamRunner([open_stream(spec) for spec in specs], workers=workers, onFrame=onFrame)
+        reports = runner.run(stop)
+        if args["display"] > 0:
+            cv2.destroyAllWindows()
+
+    for report in reports:
+        print(json.dumps(report))
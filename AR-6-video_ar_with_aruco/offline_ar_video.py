@@ -0,0 +1,40 @@
+# Offline version of opencv_ar_video.py: renders a recorded video to a file without a camera or a GUI
+# usage: python offline_ar_video.py --video recording.mp4 --input jp_trailer_short.mp4 --output results.mp4
+# usage: python offline_ar_video.py --video recording.mp4 --input jp_trailer_short.mp4 --output results.mp4 --workers 8 --overlap 60
+# usage: python offline_ar_video.py --video recording.mp4 --input jp_trailer_short.mp4 --output results.mp4 --track 10
+# usage: python offline_ar_video.py --video recording.mp4 --input jp_trailer_short.mp4 --output results.mp4 --replay recording.arlog
+# (record the log with: python ../AR-3-aruco_detection/detect_aruco_video.py --video recording.mp4 --log recording.arlog)
+from pyimagesearch.offline_render import render_offline
+import argparse
+import time
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-v", "--video", type=str, required=True, help="path to the recorded video the tags are detected in")
+    ap.add_argument("-i", "--input", type=str, required=True, help="path to input video file warped onto the recording")
+    ap.add_argument("-o", "--output", type=str, required=True, help="path to the output video")
+    ap.add_argument("-w", "--workers", type=int, default=0, help="number of worker processes. default is 0 (one per CPU)")
+    ap.add_argument("-g", "--segments", type=int, default=0, help="number of time segments the recording is split into. default is 0 (one per worker)")
+    ap.add_argument("--overlap", type=int, default=30, help="number of frames rendered before every segment to warm up the cache and the tracker")
+    ap.add_argument("-c", "--cache", type=int, default=1, help="whether or not to use the cache")
+    ap.add_argument("-r", "--roi", type=int, default=1, help="whether or not to composite in place, only inside the tags' bounding rectangle. 0 composites into a copy of every camera frame")
+    ap.add_argument("-k", "--track", type=int, default=0, help="run full tag detection only every N frames and track the tags in between")
+    ap.add_argument("--track-mode", type=str, default="flow", choices=["flow", "roi"], help="how tags are followed between detections: optical flow or ROI re-detection")
+    ap.add_argument("--replay", type=str, default="", help="detection log of the recording to take the tags from instead of detecting them. default is \"\" (detect)")
+    ap.add_argument("--calibration", type=str, default="", help="calibration file of the camera the video was recorded with. Frames are undistorted before the tags are detected")
+    ap.add_argument("--profile", type=str, default="", help="name (or path) of a detector parameter profile written by ../AR-3-aruco_detection/tune_detector.py. default is \"\" (the default parameters)")
+    args = vars(ap.parse_args())
+
+    start = time.time()
+    settings = {"cache": args["cache"], "roi": args["roi"], "track": args["track"], "track_mode": args["track_mode"], "replay": args["replay"], "calibration": args["calibration"], "profile": args["profile"]}
+    (written, warped) = render_offline(
+        args["video"],
+        args["input"],
+        args["output"],
+        workers=args["workers"] if args["workers"] > 0 else None,
+        segments=args["segments"] if args["segments"] > 0 else None,
+        overlap=args["overlap"],
+        settings=settings
+    )
+    elapsed = time.time() - start
+    print(f"{written} frames written ({warped} warped) in {elapsed:.1f} s, {written / max(elapsed, 1e-9):.1f} FPS")
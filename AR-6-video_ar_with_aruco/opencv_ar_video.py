@@ -2,7 +2,30 @@
 # usage: python opencv_ar_video.py --input jp_trailer_short.mp4
 # usage: python opencv_ar_video.py --input jp_trailer_short.mp4 --cache 0
 # usage: python opencv_ar_video.py --input jp_trailer_short.mp4 --output results.mp4
+# usage: python opencv_ar_video.py --input jp_trailer_short.mp4 --roi 0
+# usage: python opencv_ar_video.py --input jp_trailer_short.mp4 --track 10
+# usage: python opencv_ar_video.py --input jp_trailer_short.mp4 --pipeline 1
+# usage: python opencv_ar_video.py --input jp_trailer_short.mp4 --stats 1 --stats-log stats.jsonl
+# usage: python opencv_ar_video.py --input jp_trailer_short.mp4 --loop 1 --source-size 480
+# usage: python opencv_ar_video.py --input jp_trailer_short.mp4 --log session.arlog
+# usage: python opencv_ar_video.py --input jp_trailer_short.mp4 --calibration camera.yml
+# usage: python opencv_ar_video.py --input jp_trailer_short.mp4 --profile fast_720p
+# usage: python opencv_ar_video.py --input jp_trailer_short.mp4 --memo 0.5
+# usage: python opencv_ar_video.py --input jp_trailer_short.mp4 --schedule 1 --pipeline 1 --latency-ms 80
+# for recorded footage, see offline_ar_video.py
 from pyimagesearch.augmented_reality import find_and_warp
+from pyimagesearch.marker_tracking import MarkerTracker
+from pyimagesearch.aruco_registry import get_dictionary, get_parameters
+from pyimagesearch.pipeline import DecodeStage, CaptureStage, WarpStage, WriterStage, STOP
+from pyimagesearch.instrumentation import StageStats, NULL_STATS, jsonl_dumper
+from pyimagesearch.source_cache import SourceCache, SourcePlayer, fit_size
+from pyimagesearch.detection_log import DetectionLogWriter
+from pyimagesearch.calibration import load_camera_model
+from pyimagesearch.warp_memo import WarpMemo
+from pyimagesearch.playback import SourceScheduler, TimedCaptureStage, ScheduledWarpStage
+from functools import partial
+from queue import Queue, Empty
+import threading
 from imutils.video import VideoStream
 from collections import deque # this provides a queue data structure (FIFO)
 import argparse
@@ -14,73 +37,218 @@ ap = argparse.ArgumentParser()
 ap.add_argument("-i", "--input", type=str, required=True, help="path to input video file")
 ap.add_argument("-c", "--cache", type=int, default=1, help="whether or not to use the cache")
 ap.add_argument("-o", "--output", type=str, default="", help="output video stream. default is \"\", in which case, the output is NOT saved")
+ap.add_argument("-r", "--roi", type=int, default=1, help="whether or not to composite in place, only inside the tags' bounding rectangle. 0 composites into a copy of every camera frame")
+ap.add_argument("-k", "--track", type=int, default=0, help="run full tag detection only every N frames and track the tags in between. default is 0 (detect on every frame)")
+ap.add_argument("--track-mode", type=str, default="flow", choices=["flow", "roi"], help="how tags are followed between detections: optical flow or ROI re-detection")
+ap.add_argument("-p", "--pipeline", type=int, default=0, help="whether or not to run decode, capture, detection/warp and encoding in separate threads")
+ap.add_argument("-s", "--stats", type=int, default=0, help="whether or not to time every stage of the AR hot path and overlay the breakdown on the displayed frame")
+ap.add_argument("--stats-log", type=str, default="", help="append a JSON snapshot of the stage statistics to this file every few seconds (implies --stats 1)")
+ap.add_argument("-l", "--loop", type=int, default=0, help="whether or not to loop the input video forever. The video is decoded once into a cache")
+ap.add_argument("--source-size", type=int, default=0, help="longest side, in pixels, the input video is decoded and cached at. default is 0 (fit the camera frame when caching)")
+ap.add_argument("--source-cache-mb", type=int, default=512, help="memory budget of the cached input video; the rest spills to a memory-mapped file")
+ap.add_argument("--log", type=str, default="", help="directory of a detection log to record the tags found in every camera frame to. default is \"\" (no log)")
+ap.add_argument("--calibration", type=str, default="", help="camera calibration file (.yml/.xml/.npz/.json). Frames are undistorted through precomputed remap tables before the tags are detected")
+ap.add_argument("--profile", type=str, default="", help="name (or path) of a detector parameter profile written by tune_detector.py. default is \"\" (the default parameters)")
+ap.add_argument("--memo", type=float, default=0, help="reuse the homography, mask and warp tables while no tag corner moves more than this many pixels, e.g. 0.5 for a fixed camera. default is 0 (recompute every frame)")
+ap.add_argument("--schedule", type=int, default=0, help="whether or not to play the input video by its timestamps (skipping late frames) instead of one frame per warped camera frame")
+ap.add_argument("--latency-ms", type=int, default=100, help="with --schedule 1 --pipeline 1: camera frames older than this are dropped when a newer one is waiting")
 args = vars(ap.parse_args())
 
 # load ArUCo dictionary
-arucoDict = cv2.aruco.getPredefinedDictionary(cv2.aruco.DICT_ARUCO_ORIGINAL)
-arucoParams = cv2.aruco.DetectorParameters()
+arucoDict = get_dictionary("DICT_ARUCO_ORIGINAL")
+arucoParams = get_parameters(args["profile"] or None)
+tracker = None
+if args["track"] > 0:
+    tracker = MarkerTracker(arucoDict, arucoParams, detectEvery=args["track"], mode=args["track_mode"])
 
-# load video that will be warped onto the live video stream
-vf = cv2.VideoCapture(args["input"])
-
-# initialize queue to maintain next frame from video stream
-# by having at least one frame maintained in the queue, 
-# latency in loading the video will be reduced
-source_queue = deque(maxlen=128)
+# per-stage timing and counters (detection misses, cache fallbacks, source frames held back)
+stats = NULL_STATS
+if args["stats"] > 0 or args["stats_log"] != "":
+    stats = StageStats(callback=jsonl_dumper(args["stats_log"]) if args["stats_log"] != "" else None)
 
-# read video capture, get frame and save it in queue
-(grabbed, source) = vf.read()
-source_queue.appendleft(source)
+# the camera has no frame rate to derive timestamps from, so the frames are timestamped with the wall clock
+log = DetectionLogWriter(args["log"], dictionary="DICT_ARUCO_ORIGINAL") if args["log"] != "" else None
 
 vs = VideoStream(src=0).start()
+time.sleep(2.0)
+(frameH, frameW) = vs.read().shape[:2]
 vo = None
 if args["output"] != "":
+    # the writer must be opened with the size of the frames it gets, whatever the camera delivers
     fourcc = cv2.VideoWriter_fourcc(*"MP4V")
-    vo = cv2.VideoWriter(args["output"], fourcc, 30.0, (1280, 720))
-time.sleep(2.0)
+    vo = cv2.VideoWriter(args["output"], fourcc, 30.0, (frameW, frameH))
+
+# load video that will be warped onto the live video stream
+vf = cv2.VideoCapture(args["input"])
+if args["loop"] > 0 or args["source_size"] > 0:
+    # decode the video once, already shrunk to (at most) the size it is warped at: the tags' quad never
+    # covers more than the camera frame. The player reads like a VideoCapture, so the loops below do not change
+    (sourceW, sourceH) = (int(vf.get(cv2.CAP_PROP_FRAME_WIDTH)), int(vf.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+    vf.release()
+    (maxW, maxH) = (args["source_size"], args["source_size"]) if args["source_size"] > 0 else (frameW, frameH)
+    cache = SourceCache(args["input"], size=fit_size(sourceW, sourceH, maxW, maxH), maxBytes=args["source_cache_mb"] * 2 ** 20)
+    vf = SourcePlayer(cache, loop=args["loop"] > 0)
 key = cv2.waitKey(1) & 0xFF
 
-# access the frames from the queue
-# how the source video is handled:
-# if the tags in the camera is detected, then get the oldest source frame
-# that was stored in the queue and warp it onto the camera's frame
-# if the aruco tags in the camera were not detected, then just store the most recent
-# frame into the queue to await warping. That way, the source video is "paused"
-# until the aruco tags are missing
-# when the source video is done loading, the queue will stop appending items,
-# and the video will continue to appear on the camera's frames as long as:
-# 1. the queue doesn't run out
-# 2. the aruco tags continue to be detected
-while len(source_queue) > 0 and key != ord("q"):
-    # get frame from live video stream
+# the next camera frame. VideoStream hands out the same frame object until the camera grabs a new one, and with
+# --roi 1 that object was already composited into (its tags covered): wait for the new one instead
+def next_frame(last):
     frame = vs.read()
+    while frame is last:
+        time.sleep(0.001)
+        frame = vs.read()
+    return frame
+
+warp = partial(
+    find_and_warp,
+    tagIDs=(923, 1001, 241, 1007),
+    arucoDict=arucoDict,
+    arucoParams=arucoParams,
+    useCache=args["cache"] > 0,
+    useROI=args["roi"] > 0,
+    tracker=tracker,
+    stats=stats,
+    log=log,
+    camera=load_camera_model(args["calibration"]) if args["calibration"] != "" else None,
+    memo=WarpMemo(args["memo"]) if args["memo"] > 0 else None
+)
+
+if args["pipeline"] > 0:
+    # staged pipeline: every stage runs in its own thread and the stages are connected by bounded queues,
+    # so a slow source decode no longer adds to the latency of every camera frame
+    # decode (vf) -> source_queue --\
+    #                                 warp -> display_queue -> imshow (main thread, GUI calls must stay here)
+    # capture (vs) -> frame_queue --/     \-> writer_queue -> writer (vo)
+    stop = threading.Event()
+    source_queue = Queue(maxsize=128)
+    frame_queue = Queue(maxsize=2)
+    display_queue = Queue(maxsize=2)
+    writer_queue = Queue(maxsize=32)
+
+    outQueues = [display_queue] + ([writer_queue] if vo is not None else [])
+    if args["schedule"] > 0:
+        # no decode stage: the scheduler reads the source itself, only when a frame is due, and the capture
+        # stage replaces stale camera frames instead of waiting for the warp stage
+        # capture (vs) -> frame_queue -> warp (scheduled source) -> display_queue / writer_queue
+        stages = [
+            TimedCaptureStage(vs, frame_queue, stop, stats=stats),
+            ScheduledWarpStage(frame_queue, SourceScheduler(vf, stats=stats), outQueues, warp, stop, budget=args["latency_ms"] / 1000.0, stats=stats)
+        ]
+    else:
+        stages = [
+            DecodeStage(vf, source_queue, stop),
+            CaptureStage(vs, frame_queue, stop),
+            WarpStage(frame_queue, source_queue, outQueues, warp, stop, stats=stats)
+        ]
+    if vo is not None:
+        stages.append(WriterStage(vo, writer_queue, stop))
+    for stage in stages:
+        stage.start()
+
+    while key != ord("q"):
+        try:
+            frame = display_queue.get(timeout=0.1)
+        except Empty:
+            key = cv2.waitKey(1) & 0xFF
+            continue
+        if frame is STOP: # the source video ran out
+            break
+        if stats.enabled:
+            # the writer thread may still be encoding this frame, so draw on a copy
+            frame = stats.draw_overlay(frame.copy())
+        cv2.imshow("frame", frame)
+        key = cv2.waitKey(1) & 0xFF
+
+    # shut down upstream stages first, then let the writer drain what was already produced
+    stop.set()
+    for stage in stages:
+        stage.join()
+elif args["schedule"] > 0:
+    # the source frame shown is the one due at the current time, whatever the rate of this loop. The camera
+    # thread of VideoStream always hands out its latest frame, so there are no stale camera frames to drop here
+    scheduler = SourceScheduler(vf, stats=stats)
+    last = None
+    while key != ord("q"):
+        frame = last = next_frame(last)
+        captured = time.monotonic()
+        (available, source) = scheduler.read()
+        if not available: # the source video ran out
+            break
+
+        with stats.stage("frame"):
+            warped_frame = warp(frame, source)
+        if warped_frame is not None:
+            frame = warped_frame
+            scheduler.resume()
+        else:
+            # the source is paused until the tags are visible again
+            stats.count("source_held")
+            scheduler.pause()
+        stats.record("latency", time.monotonic() - captured)
+        stats.frame_done()
+
+        if (vo is not None):
+            vo.write(frame)
+        if stats.enabled:
+            stats.draw_overlay(frame)
+        cv2.imshow("frame", frame)
+        key = cv2.waitKey(1) & 0xFF
+else:
+    # initialize queue to maintain next frame from video stream
+    # by having at least one frame maintained in the queue,
+    # latency in loading the video will be reduced
+    source_queue = deque(maxlen=128)
+
+    # read video capture, get frame and save it in queue
+    (grabbed, source) = vf.read()
+    source_queue.appendleft(source)
+
+    # access the frames from the queue
+    # how the source video is handled:
+    # if the tags in the camera is detected, then get the oldest source frame
+    # that was stored in the queue and warp it onto the camera's frame
+    # if the aruco tags in the camera were not detected, then just store the most recent
+    # frame into the queue to await warping. That way, the source video is "paused"
+    # until the aruco tags are missing
+    # when the source video is done loading, the queue will stop appending items,
+    # and the video will continue to appear on the camera's frames as long as:
+    # 1. the queue doesn't run out
+    # 2. the aruco tags continue to be detected
+    # with --loop 1 the video never runs out, so the loop only ends on "q"
+    last = None
+    while len(source_queue) > 0 and key != ord("q"):
+        # get frame from live video stream
+        frame = last = next_frame(last)
+
+        with stats.stage("frame"):
+            warped_frame = warp(frame, source)
 
-    warped_frame = find_and_warp(
-        frame,
-        source,
-        tagIDs=(923, 1001, 241, 1007),
-        arucoDict=arucoDict,
-        arucoParams=arucoParams,
-        useCache=args["cache"] > 0
-    )
+        if warped_frame is not None: # the warp was successful
+            frame = warped_frame
+            source = source_queue.popleft()
+        else:
+            stats.count("source_held")
+        stats.frame_done()
 
-    if (vo is not None):
-        vo.write(warped_frame)
+        # write the frame that is displayed, also when the tags were not found
+        if (vo is not None):
+            vo.write(frame)
 
-    if warped_frame is not None: # the warp was successful
-        frame = warped_frame
-        source = source_queue.popleft()
+        if len(source_queue) != source_queue.maxlen:
+            (grabbed, next_source) = vf.read()
 
-    if len(source_queue) != source_queue.maxlen:
-        (grabbed, next_source) = vf.read()
+            if grabbed: # i.e., not at the end of the video
+                source_queue.append(next_source)
 
-        if grabbed: # i.e., not at the end of the video
-            source_queue.append(next_source)
-    
-    cv2.imshow("frame", frame)
-    key = cv2.waitKey(1) & 0xFF
+        if stats.enabled:
+            stats.draw_overlay(frame)
+        cv2.imshow("frame", frame)
+        key = cv2.waitKey(1) & 0xFF
 
 cv2.destroyAllWindows()
 vs.stop()
+vf.release()
 if vo is not None:
-    vo.release()
\ No newline at end of file
+    vo.release()
+if log is not None:
+    log.close()
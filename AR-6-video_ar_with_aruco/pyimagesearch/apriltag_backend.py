@@ -0,0 +1,168 @@
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import numpy as np
+import threading
+import os
+import cv2
+
+try:
+    import apriltag
+except ImportError: # only needed when the AprilTag backend is used
+    apriltag = None
+
+# AprilTag detection backend
+# A thin layer over the `apriltag` package that returns results in the same format as the ArUCo path, so the two
+# backends are interchangeable and the faster one can be picked per workload:
+# - detectors are built once and reused (building one loads and indexes every family's code table)
+# - several families are detected in a single pass over the image
+# - the library's own threading (`nthreads`), decimation (`quad_decimate`), blur (`quad_blur`) and edge refinement
+#   (`refine_edges`) are exposed
+# - image batches and video streams are spread over a thread pool. The library releases the GIL while it
+#   detects, so every core is used without pickling frames to other processes
+
+# families the apriltag package knows about
+APRILTAG_FAMILIES = ("tag16h5", "tag25h7", "tag25h9", "tag36h10", "tag36h11", "tag36artoolkit")
+
+# the apriltag package lists the corners counter-clockwise starting from the tag's bottom left. This puts them in
+# the clockwise TL, TR, BR, BL order cv2.aruco uses
+CORNER_ORDER = [3, 2, 1, 0]
+
+# turn "tag36h11,tag25h9", "tag36h11 tag25h9" or a list into a tuple of family names
+def parse_families(families):
+    if isinstance(families, str):
+        families = families.replace(",", " ").split()
+    families = tuple(families)
+    for family in families:
+        if family not in APRILTAG_FAMILIES:
+            raise ValueError(f"AprilTag family {family} is not supported")
+    return families
+
+# persistent AprilTag detector with cv2.aruco.ArucoDetector's interface
+# inputs:
+# 1 families: families to detect in one pass, e.g. "tag36h11" or "tag36h11,tag25h9"
+# 2 nthreads: threads the library uses for one image. Defaults to the number of cores; use 1 when images are
+#   already spread over a pool (see detect_images and detect_stream)
+# 3 quadDecimate: detect quads on an image decimated by this factor. Faster, at the cost of small tags
+# 4 quadBlur: sigma of the Gaussian blur applied to the decimated image before quads are detected, 0 for none.
+#   Cheaper than blurring the full image up front
+# 5 refineEdges: whether or not to snap the quads' edges to strong gradients of the full image
+# 6 refineDecode: whether or not to spend more time decoding, to find more tags
+class AprilTagDetector:
+    def __init__(self, families="tag36h11", nthreads=None, quadDecimate=1.0, quadBlur=0.0, refineEdges=True, refineDecode=False):
+        if apriltag is None:
+            raise ImportError("the apriltag package is not installed")
+        self.families = parse_families(families)
+        self.nthreads = nthreads if nthreads is not None else os.cpu_count() or 1
+        options = apriltag.DetectorOptions(families=" ".join(self.families), nthreads=self.nthreads, quad_decimate=quadDecimate,
+                                           quad_blur=quadBlur, refine_edges=refineEdges, refine_decode=refineDecode)
+        self.detector = apriltag.Detector(options)
+        # one detector must not be used by two threads at the same time
+        self.lock = threading.Lock()
+
+    # detect the tags in an image
+    # inputs:
+    # 1 image: BGR or grayscale image
+    # returns:
+    # 1 corners: (N, 4, 2) float32 array of tag corners, in TL, TR, BR, BL order
+    # 2 ids: (N,) int32 array of tag ids
+    # 3 families: list of the N tags' family names. Ids are only unique within a family
+    def detect(self, image):
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        with self.lock:
+            results = self.detector.detect(np.ascontiguousarray(gray, dtype="uint8"))
+        if len(results) == 0:
+            return (np.zeros((0, 4, 2), dtype="float32"), np.zeros((0,), dtype="int32"), [])
+        corners = np.array([r.corners for r in results], dtype="float32")[:, CORNER_ORDER]
+        ids = np.array([r.tag_id for r in results], dtype="int32")
+        families = [r.tag_family.decode("utf-8") if isinstance(r.tag_family, bytes) else r.tag_family for r in results]
+        return (corners, ids, families)
+
+    # same inputs and outputs as cv2.aruco.ArucoDetector.detectMarkers, so the detector can be handed to
+    # find_and_warp, MarkerTracker, PyramidDetector or a StreamSession. The library does not report rejected
+    # candidates
+    def detectMarkers(self, image):
+        (corners, ids, families) = self.detect(image)
+        if len(ids) == 0:
+            return ((), None, ())
+        return (tuple(corners.reshape(-1, 1, 4, 2)), ids.reshape(-1, 1), ())
+
+# shared detectors, one per option set
+_LOCK = threading.Lock()
+_DETECTORS = {}
+
+# get the (shared) AprilTagDetector for a family list and option set, see AprilTagDetector for the options
+def get_apriltag_detector(families="tag36h11", **options):
+    key = (parse_families(families), tuple(sorted(options.items())))
+    with _LOCK:
+        if key not in _DETECTORS:
+            _DETECTORS[key] = AprilTagDetector(families, **options)
+        return _DETECTORS[key]
+
+# per-thread detectors of the pools below. Each pool thread owns one, built with nthreads=1 since the pool itself
+# provides the parallelism
+_LOCAL = threading.local()
+
+def _thread_detector(families, options):
+    detectors = getattr(_LOCAL, "detectors", None)
+    if detectors is None:
+        detectors = _LOCAL.detectors = {}
+    key = (parse_families(families), tuple(sorted(options.items())))
+    if key not in detectors:
+        detectors[key] = AprilTagDetector(families, nthreads=1, **options)
+    return detectors[key]
+
+# shared thread pools, one per size. Their threads, and so their detectors, live as long as the process
+_POOLS = {}
+
+def _pool(workers):
+    with _LOCK:
+        if workers not in _POOLS:
+            _POOLS[workers] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="apriltag")
+        return _POOLS[workers]
+
+# detect the tags in many images
+# inputs:
+# 1 images: iterable of BGR or grayscale images
+# 2 families: families to detect
+# 3 workers: size of the thread pool. Defaults to the number of cores
+# 4 options: other AprilTagDetector options, e.g. quadDecimate=2.0
+# yields: (corners, ids, families) per image, in input order. At most 2 images per worker are in flight at a time
+def detect_images(images, families="tag36h11", workers=None, **options):
+    workers = workers or os.cpu_count() or 1
+    executor = _pool(workers)
+    detect = lambda image: _thread_detector(families, options).detect(image)
+    pending = deque()
+    for image in images:
+        pending.append(executor.submit(detect, image))
+        if len(pending) >= 2 * workers:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+# detect the tags in every frame of a video
+# inputs:
+# 1 capture: anything with cv2.VideoCapture's read(), e.g. a cv2.VideoCapture or a SourcePlayer
+# 2 families, workers, options: see detect_images
+# yields: (frame, corners, ids, families) in frame order. Frames are read ahead while earlier ones are detected
+def detect_stream(capture, families="tag36h11", workers=None, **options):
+    def frames():
+        while True:
+            (grabbed, frame) = capture.read()
+            if not grabbed:
+                return
+            yield frame
+
+    # the frames are kept alongside their results, in the same order
+    read = deque()
+    def remember(frames):
+        for frame in frames:
+            read.append(frame)
+            yield frame
+
+    for result in detect_images(remember(frames()), families, workers, **options):
+        yield (read.popleft(),) + result
+
+# turn detections into the records used by the detection service and the JSON outputs:
+# [{"id", "family", "corners": 4 [x, y] pairs}, ...]
+def to_records(corners, ids, families):
+    return [{"id": int(i), "family": f, "corners": c.tolist()} for (c, i, f) in zip(corners, ids, families)]
@@ -0,0 +1,164 @@
+from collections import OrderedDict
+import threading
+import hashlib
+import json
+import os
+import cv2
+
+# Shared registry of ArUCo dictionaries, detector parameters and detectors
+# Every object is built lazily the first time it is asked for and then memoized, so scripts, find_and_warp and
+# long-running services all reuse the same warmed-up cv2.aruco.ArucoDetector instead of rebuilding the dictionary
+# and DetectorParameters per frame or per dictionary.
+# Parameter sets are either dicts of DetectorParameters overrides or the name of a tuned profile (see
+# param_tuning.py): a JSON file in PROFILE_DIR, or the path of one.
+
+# define names of each possible ArUco tag OpenCV supports
+ARUCO_DICT = {
+	"DICT_4X4_50": cv2.aruco.DICT_4X4_50,
+	"DICT_4X4_100": cv2.aruco.DICT_4X4_100,
+	"DICT_4X4_250": cv2.aruco.DICT_4X4_250,
+	"DICT_4X4_1000": cv2.aruco.DICT_4X4_1000,
+	"DICT_5X5_50": cv2.aruco.DICT_5X5_50,
+	"DICT_5X5_100": cv2.aruco.DICT_5X5_100,
+	"DICT_5X5_250": cv2.aruco.DICT_5X5_250,
+	"DICT_5X5_1000": cv2.aruco.DICT_5X5_1000,
+	"DICT_6X6_50": cv2.aruco.DICT_6X6_50,
+	"DICT_6X6_100": cv2.aruco.DICT_6X6_100,
+	"DICT_6X6_250": cv2.aruco.DICT_6X6_250,
+	"DICT_6X6_1000": cv2.aruco.DICT_6X6_1000,
+	"DICT_7X7_50": cv2.aruco.DICT_7X7_50,
+	"DICT_7X7_100": cv2.aruco.DICT_7X7_100,
+	"DICT_7X7_250": cv2.aruco.DICT_7X7_250,
+	"DICT_7X7_1000": cv2.aruco.DICT_7X7_1000,
+	"DICT_ARUCO_ORIGINAL": cv2.aruco.DICT_ARUCO_ORIGINAL,
+	"DICT_APRILTAG_16h5": cv2.aruco.DICT_APRILTAG_16h5,
+	"DICT_APRILTAG_25h9": cv2.aruco.DICT_APRILTAG_25h9,
+	"DICT_APRILTAG_36h10": cv2.aruco.DICT_APRILTAG_36h10,
+	"DICT_APRILTAG_36h11": cv2.aruco.DICT_APRILTAG_36h11
+}
+
+_LOCK = threading.RLock()
+_DICTIONARIES = {} # name -> cv2.aruco.Dictionary
+_PARAMETERS = {}   # parameter key -> cv2.aruco.DetectorParameters
+_DETECTORS = {}    # (name, parameter key) -> cv2.aruco.ArucoDetector
+_ADOPTED = OrderedDict() # (dictionary key, parameter values) -> cv2.aruco.ArucoDetector, least recently used first
+_PROFILES = {}     # profile name or path -> loaded profile
+
+# number of detectors kept for dictionary and parameter objects built outside of the registry
+ADOPTED_SIZE = 32
+
+# readable attributes of DetectorParameters, in sorted order like parameters_key
+_DEFAULT_PARAMETERS = cv2.aruco.DetectorParameters()
+_PARAMETER_NAMES = tuple(a for a in dir(_DEFAULT_PARAMETERS) if not a.startswith("_") and not callable(getattr(_DEFAULT_PARAMETERS, a)))
+
+# where named parameter profiles are looked up
+PROFILE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "profiles")
+
+# path of the profile called `name`: `name` itself if it is a file, PROFILE_DIR/<name>.json otherwise
+def profile_path(name):
+    if os.path.isfile(name):
+        return name
+    return os.path.join(PROFILE_DIR, f"{name}.json")
+
+# load a parameter profile, as written by param_tuning.save_profile
+# returns: dict with "name", "dictionary", "parameters" (DetectorParameters overrides) and "metrics"
+def load_profile(name):
+    with _LOCK:
+        if name not in _PROFILES:
+            path = profile_path(name)
+            if not os.path.isfile(path):
+                raise ValueError(f"parameter profile {name} not found")
+            with open(path) as f:
+                _PROFILES[name] = json.load(f)
+        return _PROFILES[name]
+
+# whether `name` is a supported dictionary
+def is_supported(name):
+    return name in ARUCO_DICT
+
+# get the (shared) dictionary called `name`, e.g. "DICT_6X6_250"
+# raises ValueError for names that are not in ARUCO_DICT
+def get_dictionary(name):
+    with _LOCK:
+        if name not in _DICTIONARIES:
+            if name not in ARUCO_DICT:
+                raise ValueError(f"ArUCo tag {name} is not supported")
+            _DICTIONARIES[name] = cv2.aruco.getPredefinedDictionary(ARUCO_DICT[name])
+        return _DICTIONARIES[name]
+
+# turn a parameter set into a hashable key
+# inputs:
+# 1 params: None for the defaults, a dict of DetectorParameters attribute -> value overrides, or a profile name
+def parameters_key(params):
+    if params is None:
+        return ()
+    if isinstance(params, str):
+        params = load_profile(params)["parameters"]
+    return tuple(sorted(params.items()))
+
+# build a new (unshared) DetectorParameters from a parameter set
+# raises ValueError for attributes DetectorParameters does not have
+def make_parameters(params=None):
+    arucoParams = cv2.aruco.DetectorParameters()
+    for (attribute, value) in parameters_key(params):
+        if not hasattr(arucoParams, attribute):
+            raise ValueError(f"unknown detector parameter {attribute}")
+        setattr(arucoParams, attribute, value)
+    return arucoParams
+
+# get the (shared) DetectorParameters for a parameter set. Treat the returned object as read-only: it is shared
+# by every caller asking for the same parameter set
+# inputs:
+# 1 params: None for the defaults, a dict of DetectorParameters attribute -> value overrides, or a profile name
+def get_parameters(params=None):
+    key = parameters_key(params)
+    with _LOCK:
+        if key not in _PARAMETERS:
+            _PARAMETERS[key] = make_parameters(dict(key))
+        return _PARAMETERS[key]
+
+# get the (shared) ArucoDetector for a dictionary and parameter set
+# inputs:
+# 1 name: name of the dictionary, e.g. "DICT_ARUCO_ORIGINAL"
+# 2 params: None for the default parameters, a dict of DetectorParameters overrides or a profile name
+def get_detector(name, params=None):
+    key = (name, parameters_key(params))
+    with _LOCK:
+        if key not in _DETECTORS:
+            _DETECTORS[key] = cv2.aruco.ArucoDetector(get_dictionary(name), get_parameters(params))
+        return _DETECTORS[key]
+
+# the current values of a DetectorParameters object, as a hashable key sorted like parameters_key
+# (make_parameters(dict(values)) builds a copy)
+def parameter_values(arucoParams):
+    return tuple((attribute, getattr(arucoParams, attribute)) for attribute in _PARAMETER_NAMES)
+
+# a hashable key of a dictionary's contents
+def dictionary_key(arucoDict):
+    digest = hashlib.blake2b(arucoDict.bytesList.tobytes(), digest_size=16).digest()
+    return (arucoDict.markerSize, arucoDict.maxCorrectionBits, digest)
+
+# get a cached ArucoDetector for dictionary and parameter objects built outside of the registry, e.g. the
+# `arucoDict` and `arucoParams` passed to find_and_warp
+# The cache is keyed on the current values of the objects rather than their identity: objects modified after a
+# call get a new detector, and objects rebuilt on every call share one. At most ADOPTED_SIZE detectors are kept
+def detector_for(arucoDict, arucoParams):
+    key = (dictionary_key(arucoDict), parameter_values(arucoParams))
+    with _LOCK:
+        detector = _ADOPTED.get(key)
+        if detector is not None:
+            _ADOPTED.move_to_end(key)
+            return detector
+        detector = _ADOPTED[key] = cv2.aruco.ArucoDetector(arucoDict, arucoParams)
+        while len(_ADOPTED) > ADOPTED_SIZE:
+            _ADOPTED.popitem(last=False)
+        return detector
+
+# drop every cached object, e.g. after changing a parameter profile on disk
+def clear():
+    with _LOCK:
+        _DICTIONARIES.clear()
+        _PARAMETERS.clear()
+        _DETECTORS.clear()
+        _ADOPTED.clear()
+        _PROFILES.clear()
@@ -1,3 +1,8 @@
+from .instrumentation import NULL_STATS
+from . import aruco_registry
+from . import compositing
+from . import surfaces
+from . import warp_memo
 import numpy as np
 import cv2
 
@@ -5,8 +10,22 @@ import cv2
 # the ArUCo markers are not detected
 # Without this cache, videos will appear to be flickering when reference points
 # are not detected
+# Only used by calls without a `session`: a StreamSession keeps its own cache, so several streams can be processed
+# in the same process without overwriting each other's reference points
 CACHED_REF_PTS = None
 
+# the compositing itself (and its scratch buffers) lives in the compositing module. The names are kept here so
+# that existing imports keep working
+ROI_PADDING = compositing.ROI_PADDING
+ROI_KERNEL = compositing.ROI_KERNEL
+WarpBuffers = compositing.WarpBuffers
+WARP_BUFFERS = compositing.WARP_BUFFERS
+
+# warp the source onto the frame and composite it in place with the "hard" mask, touching only the bounding
+# rectangle of the destination points. See compositing.composite
+def warp_into_roi(frame, source, H, destination_points, buffers, stats=NULL_STATS):
+    return compositing.composite(frame, source, H, destination_points, buffers, mode="hard", stats=stats)
+
 # inputs:
 # 1 frame: the input frame from a video stream
 # 2 source: the source image that will be warped onto the video stream
@@ -14,40 +33,83 @@ CACHED_REF_PTS = None
 # 4 arucoDict: OpenCV's ArUCo tag dictionary
 # 5 arucoParams: the ArUCo marker detector parameters
 # 6 useCache: boolean -- whether or not to use the cache. True by default
-def find_and_warp(frame, source, tagIDs, arucoDict, arucoParams, useCache=True):
+# 7 useROI: boolean -- composite straight into the frame, which is modified in place and returned, instead of
+#   into a copy of it. Either way only the bounding rectangle of the destination points is touched. False by default
+# 8 buffers: the WarpBuffers reused by the compositing. Defaults to the module-level WARP_BUFFERS, so callers
+#   running find_and_warp from several threads must pass their own buffers (or a session)
+# 9 tracker: an optional MarkerTracker. When given, the tags are tracked between frames and the full-frame
+#   detector only runs every few frames (or when tracking is lost) instead of on every call
+# 10 stats: optional StageStats. When given, the detect, homography, warp, mask and composite stages are timed
+#   and detection misses and cache fallbacks are counted
+# 11 session: optional StreamSession. Its reference point cache is used instead of CACHED_REF_PTS, and its
+#   detector, buffers, tracker and stats are used unless they are passed explicitly
+# 12 blend: compositing mode, "hard" (default), "aa" or "feather", see compositing.MODES
+# 13 feather: width of the "feather" ramp, in pixels
+# 14 detections: optional (corners, ids) of this frame in the format of detectMarkers, e.g. from
+#   DetectionLog.markers. When given, the detector and the tracker are skipped
+# 15 log: optional DetectionLogWriter the detections (or tracked tags) of every call are appended to
+# 16 camera: optional CameraModel. Calibrated mode: the frame is undistorted with the model's precomputed remap
+#   tables first, and the tags are detected and the source composited on the undistorted frame, so the
+#   homography is fitted to corners free of lens distortion. The returned frame is the undistorted one
+# 17 memo: optional WarpMemo. While the destination points stay within its tolerance, the homography, the mask
+#   and the warp's remap tables of the previous frames are reused, see warp_memo
+def find_and_warp(frame, source, tagIDs, arucoDict, arucoParams, useCache=True, useROI=False, buffers=None, tracker=None, stats=None, session=None, blend="hard", feather=8, detections=None, log=None, camera=None, memo=None):
     global CACHED_REF_PTS
+    if session is not None:
+        buffers = session.buffers if buffers is None else buffers
+        tracker = session.tracker if tracker is None else tracker
+        stats = session.stats if stats is None else stats
+        log = session.log if log is None else log
+        camera = session.camera if camera is None else camera
+        memo = session.memo if memo is None else memo
+    stats = NULL_STATS if stats is None else stats
+    if camera is not None:
+        with stats.stage("undistort"):
+            frame = camera.undistort(frame)
     # get width of frame and source image
     (frameH, frameW) = frame.shape[:2]
     (sourceH, sourceW) = source.shape[:2]
 
-    # detect ArUCo tags in the input frame:
-    (tags, ids, rejected) = cv2.aruco.detectMarkers(frame, arucoDict, parameters=arucoParams)
-
-    ids = np.array([]) if len(tags) != 4 else ids.flatten()
+    # detect (or track) ArUCo tags in the input frame:
+    with stats.stage("detect"):
+        if detections is not None:
+            (tags, ids) = detections
+        elif tracker is not None:
+            (tags, ids) = tracker.update(frame)
+        elif session is not None:
+            (tags, ids, rejected) = session.detector.detectMarkers(frame)
+        else:
+            (tags, ids, rejected) = aruco_registry.detector_for(arucoDict, arucoParams).detectMarkers(frame)
+    if log is not None:
+        log.append(tags, ids)
+    if session is not None:
+        # kept for StreamSession.poses
+        session.lastDetections = (tags, ids, (frame.shape[1], frame.shape[0]))
 
-    # initialize list of reference points:
-    reference_points = []
+    # id -> corners of every tag found, so that each of the four tags is a dictionary lookup. Tags that are not
+    # part of the surface (other surfaces, stray markers) no longer make the whole frame a miss
+    found = surfaces.index_detections(tags, ids)
 
-    # loop over the ID's of the ArUCo markers: TL, TR, BR, BL
-    for i in tagIDs:
-        # index of the current id:
-        j = np.squeeze(np.where(ids == i))
+    # reference points of the ArUCo markers: TL, TR, BR, BL
+    reference_points = [found[i] for i in tagIDs if i in found]
 
-        if j.size > 0:
-            tag = np.squeeze(tags[j])
-            reference_points.append(tag)
-    
     # at least one tag was not found in the frame
     # consider using cached frames
+    cached = CACHED_REF_PTS if session is None else session.cachedRefPts
     if len(reference_points) < 4:
-        if useCache and CACHED_REF_PTS is not None:
-            reference_points = CACHED_REF_PTS
+        stats.count("detection_miss")
+        if useCache and cached is not None:
+            stats.count("cache_fallback")
+            reference_points = cached
         else:
             return None
 
     # record the current reference points in case we need them in the future
     if useCache:
-        CACHED_REF_PTS = reference_points
+        if session is None:
+            CACHED_REF_PTS = reference_points
+        else:
+            session.cachedRefPts = reference_points
     
     # get destination points
     destination_TL = reference_points[0]
@@ -57,19 +119,16 @@ def find_and_warp(frame, source, tagIDs, arucoDict, arucoParams, useCache=True):
     destination_points = [destination_TL[0], destination_TR[1], destination_BR[2], destination_BL[3]]
     destination_points = np.array(destination_points)
 
+    # composite in place, only inside the bounding rectangle of the destination points.
+    # Without useROI the caller's frame is left untouched and a composited copy is returned
+    # (the undistorted frame of the calibrated mode is already a new array)
+    output = frame if useROI or camera is not None else frame.copy()
+    if memo is not None:
+        entry = memo.get(destination_points, source, frame.shape, mode=blend, feather=feather, stats=stats)
+        return warp_memo.composite_memoized(output, source, entry, buffers, stats=stats)
+
     # warp the source image onto the frame
     source_points = np.array([(0, 0), (sourceW, 0), (sourceW, sourceH), (0, sourceH)])
-    (H, _) = cv2.findHomography(source_points, destination_points)
-    warped = cv2.warpPerspective(source, H, (frameW, frameH))
-    warped = warped.astype("uint8")
-
-    # make a mask
-    mask = np.ones((frameH, frameW), dtype="uint8") * 255
-    mask = cv2.fillConvexPoly(mask, destination_points.astype("int32"), (0, 0, 0), cv2.LINE_AA)
-    # make the white area slightly smaller:
-    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
-    mask = cv2.erode(mask, kernel, iterations=2)
-    # apply the mask
-    masked_frame = cv2.bitwise_and(frame, frame, mask=mask)
-    masked_frame = cv2.add(masked_frame, warped)
-    return masked_frame
+    with stats.stage("homography"):
+        (H, _) = cv2.findHomography(source_points, destination_points)
+    return compositing.composite(output, source, H, destination_points, buffers, mode=blend, feather=feather, stats=stats)
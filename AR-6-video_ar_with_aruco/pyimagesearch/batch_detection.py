@@ -0,0 +1,193 @@
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+from .aruco_registry import get_detector
+from .detection_log import DetectionLogWriter
+import numpy as np
+import struct
+import json
+import glob
+import os
+import cv2
+
+# Batch ArUCo detection over many images
+# Images are handed to a pool of worker processes in chunks. Every worker imports cv2 and builds its dictionary
+# and detector parameters once, so the start-up cost is paid once per core instead of once per image.
+# Results come back in input order and are streamed to a JSON lines or binary file, one record per image.
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp")
+
+# expand directories, glob patterns and @file lists into a list of image paths
+# inputs:
+# 1 inputs: list of strings. Each one is a directory (every image in it, sorted), a glob pattern,
+#   "@paths.txt" (a text file with one path per line) or a plain path
+def expand_inputs(inputs):
+    paths = []
+    for item in inputs:
+        if item.startswith("@"):
+            with open(item[1:]) as f:
+                paths.extend(line.strip() for line in f if line.strip() != "")
+        elif os.path.isdir(item):
+            paths.extend(sorted(os.path.join(item, name) for name in os.listdir(item) if name.lower().endswith(IMAGE_EXTENSIONS)))
+        elif glob.has_magic(item):
+            paths.extend(sorted(glob.glob(item, recursive=True)))
+        else:
+            paths.append(item)
+    return paths
+
+# draw detected markers onto an image, the same way detect_aruco_image.py does
+# inputs:
+# 1 image: the image to draw on. Modified in place
+# 2 corners: (N, 4, 2) array of marker corners
+# 3 ids: (N,) array of marker ids
+def draw_markers(image, corners, ids):
+    for (corner, id) in zip(corners, ids):
+        (top_left, top_right, bottom_right, bottom_left) = corner.astype("int32")
+        center_x = int((top_right[0] + bottom_left[0]) // 2)
+        center_y = int((top_right[1] + bottom_left[1]) // 2)
+        (top_left, top_right, bottom_right, bottom_left) = [tuple(map(int, p)) for p in (top_left, top_right, bottom_right, bottom_left)]
+        cv2.line(image, top_left, top_right, (0, 0, 255), 3)
+        cv2.line(image, top_right, bottom_right, (0, 0, 255), 3)
+        cv2.line(image, bottom_right, bottom_left, (0, 0, 255), 3)
+        cv2.line(image, top_left, bottom_left, (0, 0, 255), 3)
+        cv2.circle(image, (center_x, center_y), 5, (0, 255, 0), -1)
+        cv2.putText(image, str(id), (top_left[0] + 3, top_left[1] - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 0), 2)
+    return image
+
+# per-process detector state, built once by `init_worker`
+_WORKER = {}
+
+# process pool initializer
+# inputs:
+# 1 dictName: name of the dictionary, e.g. "DICT_6X6_250"
+# 2 overlayDir: directory to write annotated copies of the images to, or None to skip rendering
+# 3 params: None for the default detector parameters, or a parameter profile name (see aruco_registry)
+# 4 root: directory the overlay paths mirror the image paths from, see overlay_root
+def init_worker(dictName, overlayDir=None, params=None, root=None):
+    _WORKER["detector"] = get_detector(dictName, params)
+    _WORKER["overlayDir"] = overlayDir
+    _WORKER["root"] = root
+
+# the deepest directory holding every image. The overlays mirror the image paths below it, so images of different
+# directories that share a file name (a/0001.jpg, b/0001.jpg) do not overwrite each other's overlay
+def overlay_root(paths):
+    if len(paths) == 0:
+        return None
+    return os.path.commonpath([os.path.dirname(os.path.abspath(path)) for path in paths])
+
+# where the overlay of an image is written, creating its directory if needed
+def overlay_path(path, overlayDir, root):
+    target = os.path.join(overlayDir, os.path.relpath(os.path.abspath(path), root))
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    return target
+
+# detect the markers in one image
+# returns: (path, ids, corners) with ids an (N,) int32 array and corners an (N, 4, 2) float32 array,
+# or (path, None, None) if the image could not be read
+def detect_path(path):
+    image = cv2.imread(path)
+    if image is None:
+        return (path, None, None)
+
+    (corners, ids, rejected) = _WORKER["detector"].detectMarkers(image)
+    if ids is None or len(ids) == 0:
+        ids = np.zeros((0,), dtype="int32")
+        corners = np.zeros((0, 4, 2), dtype="float32")
+    else:
+        ids = ids.flatten().astype("int32")
+        corners = np.array(corners, dtype="float32").reshape(-1, 4, 2)
+
+    if _WORKER["overlayDir"] is not None:
+        cv2.imwrite(overlay_path(path, _WORKER["overlayDir"], _WORKER["root"]), draw_markers(image, corners, ids))
+    return (path, ids, corners)
+
+def detect_chunk(paths):
+    return [detect_path(path) for path in paths]
+
+# detect markers in many images across a process pool
+# inputs:
+# 1 paths: list of image paths
+# 2 dictName: name of the dictionary
+# 3 workers: number of worker processes. Defaults to the number of cores
+# 4 chunksize: number of images sent to a worker at a time
+# 5 overlayDir: directory for annotated copies of the images, or None. They keep the images' paths relative to
+#   the deepest directory holding all of them
+# 6 params: None for the default detector parameters, or a parameter profile name
+# yields: (path, ids, corners) in input order. At most 2 chunks per worker are in flight at any time,
+# so memory use does not grow with the number of images
+def detect_many(paths, dictName, workers=None, chunksize=32, overlayDir=None, params=None):
+    workers = workers or os.cpu_count() or 1
+    chunks = (paths[i:i + chunksize] for i in range(0, len(paths), chunksize))
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(dictName, overlayDir, params, overlay_root(paths))) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(detect_chunk, chunk))
+            if len(pending) >= 2 * workers:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+# writes one JSON object per line: {"image": path, "ids": [...], "corners": [[[x, y], ...], ...]}
+class JSONLWriter:
+    def __init__(self, path):
+        self.f = open(path, "w")
+
+    def write(self, path, ids, corners):
+        record = {"image": path, "ids": None if ids is None else ids.tolist(), "corners": None if corners is None else corners.tolist()}
+        self.f.write(json.dumps(record) + "\n")
+
+    def close(self):
+        self.f.close()
+
+# compact binary format:
+# file header: the magic bytes b"ARDT" followed by a uint32 version
+# every record: uint32 path length, int32 marker count N (-1 if the image could not be read), the utf-8 path,
+# N int32 ids, then N * 4 * 2 float32 corners. Everything is little endian
+BINARY_MAGIC = b"ARDT"
+BINARY_VERSION = 1
+RECORD_HEADER = struct.Struct("<Ii")
+
+class BinaryWriter:
+    def __init__(self, path):
+        self.f = open(path, "wb")
+        self.f.write(BINARY_MAGIC + struct.pack("<I", BINARY_VERSION))
+
+    def write(self, path, ids, corners):
+        encoded = path.encode("utf-8")
+        count = -1 if ids is None else len(ids)
+        self.f.write(RECORD_HEADER.pack(len(encoded), count))
+        self.f.write(encoded)
+        if count > 0:
+            self.f.write(ids.astype("<i4").tobytes())
+            self.f.write(corners.astype("<f4").tobytes())
+
+    def close(self):
+        self.f.close()
+
+# read back a file written by BinaryWriter
+# yields: (path, ids, corners), with ids and corners set to None for images that could not be read
+def read_binary(path):
+    with open(path, "rb") as f:
+        header = f.read(8)
+        if header[:4] != BINARY_MAGIC:
+            raise ValueError(f"{path} is not a binary detection file")
+        while True:
+            raw = f.read(RECORD_HEADER.size)
+            if len(raw) < RECORD_HEADER.size:
+                return
+            (pathLength, count) = RECORD_HEADER.unpack(raw)
+            imagePath = f.read(pathLength).decode("utf-8")
+            if count < 0:
+                yield (imagePath, None, None)
+                continue
+            ids = np.frombuffer(f.read(4 * count), dtype="<i4").astype("int32")
+            corners = np.frombuffer(f.read(4 * 8 * count), dtype="<f4").astype("float32").reshape(count, 4, 2)
+            yield (imagePath, ids, corners)
+
+# pick a writer from the output file extension: ".jsonl"/".json" -> JSON lines, ".arlog" -> memory-mapped
+# detection log directory (one frame per image, see detection_log), anything else -> binary
+def open_writer(path, dictionary="DICT_ARUCO_ORIGINAL"):
+    if path.endswith((".jsonl", ".json")):
+        return JSONLWriter(path)
+    if path.endswith(".arlog"):
+        return DetectionLogWriter(path, dictionary=dictionary)
+    return BinaryWriter(path)
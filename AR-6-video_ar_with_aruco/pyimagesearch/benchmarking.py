@@ -0,0 +1,68 @@
+import tracemalloc
+import time
+import sys
+import numpy as np
+
+try:
+    import resource
+except ImportError: # not available on Windows
+    resource = None
+
+# Small timing harness for the benchmark suite
+# Every case is a function called once per input. The first `warmup` calls are not timed, so lazily built
+# detectors and buffers do not skew the numbers.
+
+# time a function over a list of inputs
+# inputs:
+# 1 name: name of the case, copied into the report
+# 2 fn: function called as fn(item) for every input
+# 3 inputs: list of inputs
+# 4 repeat: how many times the whole list is run
+# 5 warmup: number of untimed calls before timing starts
+# returns: dict with the number of calls, FPS, mean/p50/p99/max latency in milliseconds, the peak memory
+# allocated through Python/NumPy during the case (OpenCV output arrays are NumPy arrays, so they are included)
+# and the peak resident set size of the whole process so far
+def run_case(name, fn, inputs, repeat=1, warmup=2):
+    for item in inputs[:warmup]:
+        fn(item)
+
+    latencies = []
+    tracemalloc.start()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for item in inputs:
+            t0 = time.perf_counter()
+            fn(item)
+            latencies.append(time.perf_counter() - t0)
+    total = time.perf_counter() - start
+    (_, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies = np.array(latencies) * 1000.0
+    return {
+        "case": name,
+        "calls": len(latencies),
+        "fps": len(latencies) / total if total > 0 else float("inf"),
+        "mean_ms": float(latencies.mean()),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "max_ms": float(latencies.max()),
+        "peak_traced_mb": peak / 2 ** 20,
+        "max_rss_mb": max_rss_mb()
+    }
+
+# peak resident set size of the process in MB, or NaN where it cannot be measured
+def max_rss_mb():
+    if resource is None:
+        return float("nan")
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes everywhere else
+    return rss / 2 ** 20 if sys.platform == "darwin" else rss / 1024.0
+
+# format a list of reports as a fixed-width table
+def format_table(reports):
+    header = f"{'case':<48} {'fps':>9} {'p50 ms':>9} {'p99 ms':>9} {'peak MB':>9} {'rss MB':>9}"
+    lines = [header, "-" * len(header)]
+    for r in reports:
+        lines.append(f"{r['case']:<48} {r['fps']:>9.1f} {r['p50_ms']:>9.2f} {r['p99_ms']:>9.2f} {r['peak_traced_mb']:>9.1f} {r['max_rss_mb']:>9.1f}")
+    return "\n".join(lines)
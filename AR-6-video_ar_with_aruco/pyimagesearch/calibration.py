@@ -0,0 +1,260 @@
+import numpy as np
+import json
+import cv2
+
+# Camera intrinsics: undistortion and marker pose
+# A CameraModel holds the camera matrix and distortion coefficients of one camera. Two ways of removing the lens
+# distortion are offered:
+# - whole frames: the initUndistortRectifyMap remap tables are built once per frame size, after which every frame
+#   is undistorted by a single cv2.remap lookup (fixed point maps) instead of solving the distortion model per pixel
+# - detected corners only: cv2.undistortPoints on the handful of corner points, for pose estimation on raw frames
+# Marker poses are recovered for every marker of a frame at once: the corners of all markers go through one
+# undistortPoints call, and the per-marker homographies and their IPPE decomposition into (R, t) (the method of
+# solvePnP's SOLVEPNP_IPPE_SQUARE) are solved as batched numpy operations, without a Python loop over the markers.
+
+# loads a camera model
+# Supported files:
+# - OpenCV FileStorage (.yml, .yaml, .xml), as written by OpenCV's calibration sample: "camera_matrix",
+#   "distortion_coefficients" and optionally "image_width" / "image_height"
+# - .npz or .json with "camera_matrix" (or "cameraMatrix"), "dist_coeffs" (or "distCoeffs") and optionally "size"
+#   as [width, height]
+def load_camera_model(path):
+    size = None
+    if path.endswith((".yml", ".yaml", ".xml")):
+        fs = cv2.FileStorage(path, cv2.FILE_STORAGE_READ)
+        cameraMatrix = fs.getNode("camera_matrix").mat()
+        distCoeffs = fs.getNode("distortion_coefficients").mat()
+        (width, height) = (fs.getNode("image_width"), fs.getNode("image_height"))
+        if not width.empty() and not height.empty():
+            size = (int(width.real()), int(height.real()))
+        fs.release()
+        if cameraMatrix is None:
+            raise ValueError(f"{path} has no camera_matrix")
+    else:
+        if path.endswith(".json"):
+            with open(path) as f:
+                data = json.load(f)
+        else:
+            data = dict(np.load(path))
+        cameraMatrix = data.get("camera_matrix", data.get("cameraMatrix"))
+        distCoeffs = data.get("dist_coeffs", data.get("distCoeffs"))
+        if data.get("size") is not None:
+            size = tuple(int(v) for v in data["size"])
+        if cameraMatrix is None:
+            raise ValueError(f"{path} has no camera_matrix")
+    return CameraModel(cameraMatrix, distCoeffs, size)
+
+# inputs:
+# 1 cameraMatrix: 3x3 intrinsic matrix
+# 2 distCoeffs: distortion coefficients (k1, k2, p1, p2[, k3, ...]), None for none
+# 3 size: (width, height) the model was calibrated at. Frames of another size are handled by scaling the
+#   intrinsics, which is exact for a resize of the whole frame. None to take the size of the first frame
+# 4 alpha: free scaling of getOptimalNewCameraMatrix: 0 keeps only valid pixels, 1 keeps every source pixel
+class CameraModel:
+    def __init__(self, cameraMatrix, distCoeffs=None, size=None, alpha=0.0):
+        self.cameraMatrix = np.asarray(cameraMatrix, dtype="float64").reshape(3, 3)
+        self.distCoeffs = np.zeros(5) if distCoeffs is None else np.asarray(distCoeffs, dtype="float64").ravel()
+        self.size = None if size is None else tuple(size)
+        self.alpha = alpha
+        self.maps = {} # frame size -> (map1, map2, new camera matrix)
+
+    # the camera matrix of frames of size `size`
+    def matrix_for(self, size):
+        if self.size is None or tuple(size) == self.size:
+            return self.cameraMatrix
+        K = self.cameraMatrix.copy()
+        K[0] *= size[0] / self.size[0]
+        K[1] *= size[1] / self.size[1]
+        return K
+
+    # undistortion maps of frames of size `size`, built on first use
+    # returns: (map1, map2, newCameraMatrix) -- the maps for cv2.remap and the camera matrix of the undistorted
+    # frames, which have no distortion left
+    def undistort_maps(self, size):
+        size = tuple(size)
+        if size not in self.maps:
+            K = self.matrix_for(size)
+            (newK, _) = cv2.getOptimalNewCameraMatrix(K, self.distCoeffs, size, self.alpha, size)
+            # CV_16SC2 maps are the fastest for cv2.remap and half the size of float maps
+            (map1, map2) = cv2.initUndistortRectifyMap(K, self.distCoeffs, None, newK, size, cv2.CV_16SC2)
+            self.maps[size] = (map1, map2, newK)
+        return self.maps[size]
+
+    # undistort a whole frame with the precomputed maps
+    # inputs:
+    # 1 frame: the raw frame
+    # 2 dst: optional output array of the same shape, reused between calls
+    def undistort(self, frame, dst=None):
+        (map1, map2, newK) = self.undistort_maps((frame.shape[1], frame.shape[0]))
+        return cv2.remap(frame, map1, map2, cv2.INTER_LINEAR, dst=dst)
+
+    # the model of frames undistorted by `undistort`: same size, no distortion
+    def rectified(self, size):
+        return CameraModel(self.undistort_maps(size)[2], None, size)
+
+    # undistort points only
+    # inputs:
+    # 1 points: (..., 2) array of raw pixel coordinates, e.g. the (N, 4, 2) corners of all markers of a frame
+    # 2 size: (width, height) of the frame the points come from
+    # 3 normalized: True to return normalized camera coordinates (x / z, y / z), False for pixel coordinates in
+    #   the undistorted frame of `undistort`
+    # returns: an array of the same shape
+    def undistort_points(self, points, size, normalized=False):
+        points = np.asarray(points, dtype="float64")
+        if points.size == 0:
+            return points
+        K = self.matrix_for(size)
+        P = None if normalized else self.undistort_maps(size)[2]
+        result = cv2.undistortPoints(points.reshape(-1, 1, 2), K, self.distCoeffs, P=P)
+        return result.reshape(points.shape)
+
+# corners of a square marker of side `markerLength` in its own frame, in the TL, TR, BR, BL order of the
+# detectors: x to the right, y up, z out of the marker (the convention of cv2.aruco's pose estimation)
+def marker_object_points(markerLength):
+    h = markerLength / 2.0
+    return np.array([[-h, h, 0], [h, h, 0], [h, -h, 0], [-h, -h, 0]], dtype="float64")
+
+# homographies from the marker plane to normalized image coordinates, for many markers at once
+# inputs:
+# 1 plane: (4, 2) marker corners in the marker plane
+# 2 image: (N, 4, 2) normalized image coordinates of the corners of N markers
+# returns: (N, 3, 3) homographies with h33 = 1
+def batch_homographies(plane, image):
+    count = image.shape[0]
+    (X, Y) = (plane[:, 0], plane[:, 1])
+    (x, y) = (image[:, :, 0], image[:, :, 1])
+    # two rows of the 8x8 DLT system per corner
+    A = np.zeros((count, 8, 8))
+    A[:, 0::2, 0] = X
+    A[:, 0::2, 1] = Y
+    A[:, 0::2, 2] = 1
+    A[:, 0::2, 6] = -x * X
+    A[:, 0::2, 7] = -x * Y
+    A[:, 1::2, 3] = X
+    A[:, 1::2, 4] = Y
+    A[:, 1::2, 5] = 1
+    A[:, 1::2, 6] = -y * X
+    A[:, 1::2, 7] = -y * Y
+    b = np.empty((count, 8))
+    b[:, 0::2] = x
+    b[:, 1::2] = y
+    h = np.linalg.solve(A, b[..., None])[..., 0]
+    return np.concatenate([h, np.ones((count, 1))], axis=1).reshape(count, 3, 3)
+
+# rotation matrices to Rodrigues vectors, for many rotations at once
+def rotations_to_rvecs(R):
+    cos = np.clip((np.trace(R, axis1=1, axis2=2) - 1.0) / 2.0, -1.0, 1.0)
+    angle = np.arccos(cos)
+    axis = np.stack([R[:, 2, 1] - R[:, 1, 2], R[:, 0, 2] - R[:, 2, 0], R[:, 1, 0] - R[:, 0, 1]], axis=1)
+    sin = np.sin(angle)
+    rvecs = np.zeros((R.shape[0], 3))
+    regular = sin > 1e-6
+    rvecs[regular] = axis[regular] * (angle[regular] / (2.0 * sin[regular]))[:, None]
+    # angles of (almost) 0 or pi: the axis cannot be read from the antisymmetric part. Rare, left to OpenCV
+    for i in np.flatnonzero(~regular & (angle > 1e-6)):
+        rvecs[i] = cv2.Rodrigues(R[i])[0].ravel()
+    return rvecs
+
+# rotations that turn (N, 3) vectors onto the z axis
+def rotations_to_z(v):
+    (x, y, z) = (v / np.linalg.norm(v, axis=1)[:, None]).T
+    d = 1.0 / (1.0 + z)
+    R = np.empty((len(v), 3, 3))
+    R[:, 0, 0] = 1.0 - x * x * d
+    R[:, 0, 1] = -x * y * d
+    R[:, 0, 2] = -x
+    R[:, 1, 0] = -x * y * d
+    R[:, 1, 1] = 1.0 - y * y * d
+    R[:, 1, 2] = -y
+    R[:, 2, 0] = x
+    R[:, 2, 1] = y
+    R[:, 2, 2] = 1.0 - (x * x + y * y) * d
+    return R
+
+# the two rotations of planar markers compatible with their homographies (IPPE, Collins and Bartoli 2014)
+# The pose is read from the homography's first order approximation at the marker center, which is well
+# conditioned even for small, noisy markers, unlike a normalization of the homography's columns. The two
+# solutions mirror the marker normal about the line of sight.
+# inputs:
+# 1 H: (N, 3, 3) homographies from the marker plane (centered on the marker) to normalized image coordinates,
+#   with h33 = 1
+# returns: two (N, 3, 3) arrays of rotations
+def ippe_rotations(H):
+    # image of the marker center and jacobian of the homography there
+    (p, q) = (H[:, 0, 2], H[:, 1, 2])
+    J = H[:, :2, :2] - H[:, :2, 2:] * H[:, 2:, :2]
+    # the line of sight through the marker center, rotated onto the z axis
+    Rv = rotations_to_z(np.stack([p, q, np.ones_like(p)], axis=1)).transpose(0, 2, 1)
+    B = Rv[:, :2, :2] - np.stack([p, q], axis=1)[:, :, None] * Rv[:, 2:, :2]
+    A = np.linalg.solve(B, J)
+    # largest singular value of A
+    AAt = A @ A.transpose(0, 2, 1)
+    (a, b, c) = (AAt[:, 0, 0], AAt[:, 0, 1], AAt[:, 1, 1])
+    gamma = np.sqrt(0.5 * (a + c + np.sqrt((a - c) ** 2 + 4.0 * b * b)))
+    Rtilde = A / gamma[:, None, None]
+    # complete the first two columns to unit length, with the sign making them orthogonal
+    b0 = np.sqrt(np.maximum(1.0 - Rtilde[:, 0, 0] ** 2 - Rtilde[:, 1, 0] ** 2, 0.0))
+    b1 = np.sqrt(np.maximum(1.0 - Rtilde[:, 0, 1] ** 2 - Rtilde[:, 1, 1] ** 2, 0.0))
+    b1 = np.where(-Rtilde[:, 0, 0] * Rtilde[:, 0, 1] - Rtilde[:, 1, 0] * Rtilde[:, 1, 1] < 0, -b1, b1)
+    rotations = []
+    for sign in (1.0, -1.0):
+        c0 = np.stack([Rtilde[:, 0, 0], Rtilde[:, 1, 0], sign * b0], axis=1)
+        c1 = np.stack([Rtilde[:, 0, 1], Rtilde[:, 1, 1], sign * b1], axis=1)
+        rotations.append(Rv @ np.stack([c0, c1, np.cross(c0, c1)], axis=2))
+    return rotations
+
+# least squares translations of N markers given their rotations
+# inputs:
+# 1 R: (N, 3, 3) rotations
+# 2 objectPoints: (4, 3) corners in the marker frame
+# 3 normalized: (N, 4, 2) observed corners, in normalized camera coordinates
+# returns: (N, 3) translations
+def marker_translations(R, objectPoints, normalized):
+    rotated = objectPoints @ R.transpose(0, 2, 1)
+    # x (r_z + t_z) = r_x + t_x and y (r_z + t_z) = r_y + t_y for every corner
+    count = len(R)
+    A = np.zeros((count, 4, 2, 3))
+    A[:, :, 0, 0] = 1.0
+    A[:, :, 1, 1] = 1.0
+    A[:, :, :, 2] = -normalized
+    b = normalized * rotated[:, :, 2:] - rotated[:, :, :2]
+    (A, b) = (A.reshape(count, 8, 3), b.reshape(count, 8, 1))
+    At = A.transpose(0, 2, 1)
+    return np.linalg.solve(At @ A, At @ b)[..., 0]
+
+# sum of the squared reprojection errors of N poses, in normalized camera coordinates
+def reprojection_errors(R, t, objectPoints, normalized):
+    camera = objectPoints @ R.transpose(0, 2, 1) + t[:, None, :]
+    return ((camera[:, :, :2] / camera[:, :, 2:] - normalized) ** 2).sum(axis=(1, 2))
+
+# pose of every marker of a frame
+# inputs:
+# 1 corners: detected corners, as returned by detectMarkers or as an (N, 4, 2) array, in raw pixel coordinates
+#   (or in the coordinates of `camera.undistort` frames when `undistorted` is True)
+# 2 markerLength: side of the markers, in the unit the translations should be in
+# 3 camera: the CameraModel
+# 4 size: (width, height) of the frame
+# 5 undistorted: whether or not the corners come from a frame undistorted by `camera.undistort`
+# returns: (rvecs, tvecs), (N, 3) arrays of Rodrigues rotations and translations of the marker frames in the
+# camera frame, like cv2.aruco.estimatePoseSingleMarkers
+def estimate_poses(corners, markerLength, camera, size, undistorted=False):
+    corners = np.asarray(corners, dtype="float64").reshape(-1, 4, 2)
+    count = corners.shape[0]
+    if count == 0:
+        return (np.zeros((0, 3)), np.zeros((0, 3)))
+
+    # one call for the corners of all markers
+    if undistorted:
+        K = camera.undistort_maps(size)[2]
+        normalized = (corners - K[[0, 1], [2, 2]]) / K[[0, 1], [0, 1]]
+    else:
+        normalized = camera.undistort_points(corners, size, normalized=True)
+    objectPoints = marker_object_points(markerLength)
+    H = batch_homographies(objectPoints[:, :2], normalized)
+
+    # the IPPE solution of lower reprojection error, as solvePnP's SOLVEPNP_IPPE_SQUARE
+    (R, otherR) = ippe_rotations(H)
+    (t, otherT) = (marker_translations(R, objectPoints, normalized), marker_translations(otherR, objectPoints, normalized))
+    better = reprojection_errors(otherR, otherT, objectPoints, normalized) < reprojection_errors(R, t, objectPoints, normalized)
+    (R[better], t[better]) = (otherR[better], otherT[better])
+    return (rotations_to_rvecs(R), t)
@@ -0,0 +1,182 @@
+from .instrumentation import NULL_STATS
+import numpy as np
+import cv2
+
+# Compositing of a warped source onto a frame
+# Everything happens in place, inside the bounding rectangle of the destination quad, on uint8 data (uint16 for the
+# intermediate products of the alpha blend) -- no float copies of the frame or 3-channel masks are ever made, and the scratch buffers are only as large as the ROI.
+# Modes:
+# "hard": the classic find_and_warp mask: an anti-aliased, twice-eroded mask that keeps the frame outside the quad
+#   and the warped source inside it. Pixel-identical to the original full-frame implementation
+# "aa": the quad is rasterized with sub-pixel precision and anti-aliased edges, and the source is alpha blended
+#   along them
+# "feather": the alpha ramps linearly from 0 at the quad's edge to 255 `feather` pixels inside it
+MODES = ("hard", "aa", "feather")
+
+# the "hard" mask is eroded twice with a 3x3 kernel and drawn anti-aliased, so the composited
+# area can reach up to 3 pixels past the bounding rectangle of the destination points
+ROI_PADDING = 3
+ROI_KERNEL = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
+
+# fractional bits of the vertex coordinates passed to fillConvexPoly by the "aa" mode
+SUBPIXEL_SHIFT = 4
+
+# scratch buffers used by the compositing path
+# they are sized to the ROI, not the frame: each buffer is a flat array holding `capacity` pixels, and the views
+# handed out are its first roiW * roiH pixels reshaped to the ROI. A larger ROI grows the buffers (with some
+# headroom, so a quad that slowly grows does not reallocate on every frame); smaller ones reuse them, so the
+# per-frame hot path only ever takes views of them instead of allocating new arrays
+class WarpBuffers:
+    def __init__(self):
+        self.capacity = 0   # pixels every buffer can hold
+        self.channels = ()  # trailing shape of the frame, () for grayscale
+        self.warped = None  # warped source, roiH * roiW * C uint8
+        self.keep = None    # 255 where the frame is kept, 0 where the source replaces it
+        self.overlay = None # 255 where the source replaces the frame, or its alpha in the blending modes
+        self.inverse = None # 255 - alpha
+        self.acc = None     # uint16 products of the alpha blend, one channel at a time
+        self.tmp = None
+
+    # returns views of the buffers covering an ROI of size (roiW, roiH)
+    # inputs:
+    # 1 frame: the frame the ROI lives in; the buffers are reallocated if its channel count changes
+    # 2 roiW, roiH: the size of the ROI
+    def views(self, frame, roiW, roiH):
+        channels = frame.shape[2:]
+        pixels = roiW * roiH
+        if self.warped is None or channels != self.channels or pixels > self.capacity:
+            self.capacity = pixels + pixels // 4
+            self.channels = channels
+            self.warped = np.empty(self.capacity * int(np.prod(channels)), dtype="uint8")
+            self.keep = np.empty(self.capacity, dtype="uint8")
+            self.overlay = np.empty(self.capacity, dtype="uint8")
+            self.acc = None
+        return (self.warped[:pixels * int(np.prod(channels))].reshape((roiH, roiW) + channels),
+                self.keep[:pixels].reshape(roiH, roiW), self.overlay[:pixels].reshape(roiH, roiW))
+
+    # single-channel views of the alpha blend's buffers, allocated the first time a blending mode is used
+    def blend_views(self, roiW, roiH):
+        if self.acc is None:
+            self.inverse = np.empty(self.capacity, dtype="uint8")
+            self.acc = np.empty(self.capacity, dtype="uint16")
+            self.tmp = np.empty(self.capacity, dtype="uint16")
+        pixels = roiW * roiH
+        return (self.inverse[:pixels].reshape(roiH, roiW), self.acc[:pixels].reshape(roiH, roiW), self.tmp[:pixels].reshape(roiH, roiW))
+
+# buffers shared by every call that does not bring its own
+WARP_BUFFERS = WarpBuffers()
+
+# blend `warped` over `roi` in place: roi = (warped * alpha + roi * (255 - alpha)) / 255, rounded
+# The blend runs one channel at a time against the single-channel alpha, so no per-channel copies of the alpha are
+# made. The products are taken in uint16 (255 * 255 = 65025 fits), and (x + 128 + ((x + 128) >> 8)) >> 8 is the
+# exact rounded division by 255 over that range
+# inputs:
+# 1 roi: uint8 destination, modified in place
+# 2 warped: uint8 source, same shape as roi
+# 3 alpha: uint8 (H, W) weights of the source
+# 4 inverse: uint8 (H, W), 255 - alpha (see cv2.bitwise_not)
+# 5 acc, tmp: uint16 (H, W) scratch arrays
+def blend_fixed_point(roi, warped, alpha, inverse, acc, tmp):
+    pairs = [(roi, warped)] if roi.ndim == 2 else [(roi[..., c], warped[..., c]) for c in range(roi.shape[2])]
+    for (channel, source) in pairs:
+        np.multiply(source, alpha, out=acc, dtype="uint16")
+        np.multiply(channel, inverse, out=tmp, dtype="uint16")
+        acc += tmp
+        acc += 128
+        np.right_shift(acc, 8, out=tmp)
+        acc += tmp
+        acc >>= 8
+        channel[...] = acc
+    return roi
+
+# bounding rectangle of a destination quad, padded and clipped to the frame
+# returns: (x0, y0, x1, y1), x1 and y1 exclusive, or None when the quad is entirely outside the frame
+def roi_rect(destination_points, frameW, frameH):
+    x0 = max(int(np.floor(destination_points[:, 0].min())) - ROI_PADDING, 0)
+    y0 = max(int(np.floor(destination_points[:, 1].min())) - ROI_PADDING, 0)
+    x1 = min(int(np.ceil(destination_points[:, 0].max())) + ROI_PADDING + 1, frameW)
+    y1 = min(int(np.ceil(destination_points[:, 1].max())) + ROI_PADDING + 1, frameH)
+    if x1 <= x0 or y1 <= y0:
+        return None
+    return (x0, y0, x1, y1)
+
+# the blending modes sample the source's own edge pixels past its border instead of black
+def border_mode(mode):
+    return cv2.BORDER_CONSTANT if mode == "hard" else cv2.BORDER_REPLICATE
+
+# draw the mask of a compositing mode
+# inputs:
+# 1 mode: see MODES
+# 2 quad: destination points relative to the ROI's top left corner
+# 3 keep, overlay: uint8 (roiH, roiW) arrays, filled in place. "hard" uses both: `keep` is 255 where the frame is
+#   kept and `overlay` 255 where the source replaces it. The blending modes write the source's alpha to `overlay`
+# 4 feather: width of the "feather" ramp, in pixels
+def draw_mask(mode, quad, keep, overlay, feather=8):
+    if mode == "hard":
+        # same mask as the full frame path, restricted to the ROI
+        keep.fill(255)
+        cv2.fillConvexPoly(keep, quad.astype("int32"), 0, cv2.LINE_AA)
+        cv2.erode(keep, ROI_KERNEL, dst=keep, iterations=2)
+        cv2.compare(keep, 0, cv2.CMP_EQ, dst=overlay)
+        return
+    overlay.fill(0)
+    if mode == "aa":
+        cv2.fillConvexPoly(overlay, np.round(quad * (1 << SUBPIXEL_SHIFT)).astype("int32"), 255, cv2.LINE_AA, SUBPIXEL_SHIFT)
+    else:
+        cv2.fillConvexPoly(overlay, np.round(quad).astype("int32"), 255, cv2.LINE_8)
+        if feather > 0:
+            # shrink by the ramp's width, then a box blur of the same width spreads it back out to the edge
+            cv2.erode(overlay, ROI_KERNEL, dst=overlay, iterations=feather)
+            cv2.blur(overlay, (2 * feather + 1, 2 * feather + 1), dst=overlay, borderType=cv2.BORDER_CONSTANT)
+
+# warp the source onto the frame and composite it in place, touching only the bounding
+# rectangle of the destination points
+# inputs:
+# 1 frame: the frame to composite onto. It is modified in place
+# 2 source: the source image that will be warped onto the frame
+# 3 H: the homography that maps the source coordinates to frame coordinates
+# 4 destination_points: the (TL, TR, BR, BL) corners of the destination quad in frame coordinates
+# 5 buffers: the WarpBuffers to reuse. Defaults to the module-level WARP_BUFFERS
+# 6 mode: "hard", "aa" or "feather", see MODES
+# 7 feather: width of the "feather" ramp, in pixels
+# 8 stats: StageStats that times the warp, mask and composite stages, or NULL_STATS
+# returns:
+# 1 the frame, with the warped source composited into it
+def composite(frame, source, H, destination_points, buffers=None, mode="hard", feather=8, stats=NULL_STATS):
+    if mode not in MODES:
+        raise ValueError(f"unknown compositing mode {mode}")
+    buffers = WARP_BUFFERS if buffers is None else buffers
+    destination_points = np.asarray(destination_points, dtype="float64")
+    (frameH, frameW) = frame.shape[:2]
+
+    rect = roi_rect(destination_points, frameW, frameH)
+    if rect is None:
+        # the quad is entirely outside the frame
+        return frame
+    (x0, y0, x1, y1) = rect
+    (roiW, roiH) = (x1 - x0, y1 - y0)
+    (warped, keep, overlay) = buffers.views(frame, roiW, roiH)
+    quad = destination_points - (x0, y0)
+
+    # translate the homography so that the ROI's top left corner becomes the origin
+    T = np.array([[1, 0, -x0], [0, 1, -y0], [0, 0, 1]], dtype="float64")
+    with stats.stage("warp"):
+        warped = cv2.warpPerspective(source, T @ H, (roiW, roiH), dst=warped, borderMode=border_mode(mode))
+
+    roi = frame[y0:y1, x0:x1]
+    with stats.stage("mask"):
+        draw_mask(mode, quad, keep, overlay, feather)
+    if mode == "hard":
+        # frame AND mask + warped, written straight into the frame:
+        # inside the quad the warped source replaces the frame, elsewhere the warped source is added
+        with stats.stage("composite"):
+            cv2.copyTo(warped, overlay, roi)
+            cv2.add(roi, warped, dst=roi, mask=keep)
+        return frame
+
+    # `overlay` holds the alpha of the source
+    with stats.stage("composite"):
+        (inverse, acc, tmp) = buffers.blend_views(roiW, roiH)
+        cv2.bitwise_not(overlay, dst=inverse)
+        blend_fixed_point(roi, warped, overlay, inverse, acc, tmp)
+    return frame
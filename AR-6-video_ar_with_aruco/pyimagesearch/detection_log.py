@@ -0,0 +1,192 @@
+import numpy as np
+import json
+import time
+import os
+
+# Compact, memory-mapped record of marker detections
+# A log is a directory holding one flat little-endian file per column (struct of arrays), one row per detected
+# marker:
+#   frame.i4      int32    index of the frame the marker was found in, never decreasing
+#   timestamp.f8  float64  time of that frame, in seconds
+#   id.i4         int32    marker id
+#   corners.f4    float32  4 (x, y) corners per marker, in cv2.aruco's TL, TR, BR, BL order
+#   meta.json     dictionary, number of frames logged, fps, ... written by the writer on every flush
+#   images.tsv    logs of images only (see DetectionLogWriter.write): one "frame<TAB>status<TAB>path" line per
+#                 image, status "ok" or "unreadable". Appended to, like the columns
+# Rows are buffered and appended to every column in bulk. Readers map the columns with np.memmap, so replaying
+# hours of footage only pages in the rows it touches and never runs detection again.
+IMAGES_FILE = "images.tsv"
+COLUMNS = {
+    "frame": ("<i4", ()),
+    "timestamp": ("<f8", ()),
+    "id": ("<i4", ()),
+    "corners": ("<f4", (4, 2)),
+}
+LOG_VERSION = 1
+
+def column_path(path, name):
+    return os.path.join(path, f"{name}.{COLUMNS[name][0][1:]}")
+
+# appends detections to a log
+# inputs:
+# 1 path: directory of the log. Created if needed; an existing log is appended to
+# 2 dictionary: name of the ArUCo dictionary (or AprilTag families) the markers belong to, kept in meta.json
+# 3 fps: frame rate of the video, used for the default timestamps of `append`. None for wall clock time
+# 4 flushRows: number of buffered rows that triggers a write
+# 5 meta: extra fields stored in meta.json
+class DetectionLogWriter:
+    def __init__(self, path, dictionary="DICT_ARUCO_ORIGINAL", fps=None, flushRows=4096, meta=None):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.fps = fps
+        self.flushRows = flushRows
+        self.meta = {"version": LOG_VERSION, "dictionary": dictionary, "fps": fps, "frames": 0}
+        if os.path.exists(os.path.join(path, "meta.json")):
+            with open(os.path.join(path, "meta.json")) as f:
+                self.meta.update(json.load(f))
+        self.meta.update(meta or {})
+        self.files = {name: open(column_path(path, name), "ab") for name in COLUMNS}
+        self.pending = {name: [] for name in COLUMNS}
+        self.pendingRows = 0
+        self.images = None       # images.tsv, opened on the first `write`
+        self.pendingImages = []
+        self.nextFrame = self.meta["frames"]
+        self.start = time.time()
+
+    # log the markers found in one frame
+    # inputs:
+    # 1 corners: the corners as returned by detectMarkers (a sequence of (1, 4, 2) arrays) or an (N, 4, 2) array
+    # 2 ids: (N, 1) or (N,) ids, or None when nothing was found
+    # 3 frameIndex: index of the frame. Defaults to the frame after the last one logged
+    # 4 timestamp: time of the frame, in seconds. Defaults to frameIndex / fps, or the time since the writer was
+    #   opened when there is no fps
+    def append(self, corners, ids, frameIndex=None, timestamp=None):
+        frameIndex = self.nextFrame if frameIndex is None else frameIndex
+        if frameIndex < self.nextFrame - 1:
+            raise ValueError(f"frame {frameIndex} is older than the last frame logged")
+        if timestamp is None:
+            timestamp = frameIndex / self.fps if self.fps else time.time() - self.start
+        self.nextFrame = frameIndex + 1
+        self.meta["frames"] = max(self.meta["frames"], self.nextFrame)
+
+        count = 0 if ids is None else len(ids)
+        if count == 0:
+            return
+        self.pending["frame"].append(np.full(count, frameIndex, dtype="<i4"))
+        self.pending["timestamp"].append(np.full(count, timestamp, dtype="<f8"))
+        self.pending["id"].append(np.asarray(ids, dtype="<i4").reshape(count))
+        self.pending["corners"].append(np.asarray(corners, dtype="<f4").reshape(count, 4, 2))
+        self.pendingRows += count
+        if self.pendingRows >= self.flushRows:
+            self.flush()
+
+    # write the buffered rows, one bulk write per column
+    def flush(self):
+        if self.pendingRows > 0:
+            for name in COLUMNS:
+                np.concatenate(self.pending[name]).tofile(self.files[name])
+                self.files[name].flush()
+                self.pending[name] = []
+            self.pendingRows = 0
+        if len(self.pendingImages) > 0:
+            if self.images is None:
+                self.images = open(os.path.join(self.path, IMAGES_FILE), "a")
+            self.images.writelines(self.pendingImages)
+            self.images.flush()
+            self.pendingImages = []
+        with open(os.path.join(self.path, "meta.json"), "w") as f:
+            json.dump(self.meta, f)
+
+    def close(self):
+        self.flush()
+        for f in self.files.values():
+            f.close()
+        if self.images is not None:
+            self.images.close()
+
+    # batch_detection writer interface (see open_writer): one image per frame. The path and whether the image
+    # could be read at all (ids None when it could not) go to images.tsv, so an unreadable image is not mistaken
+    # for one without markers
+    def write(self, path, ids, corners):
+        status = "unreadable" if ids is None else "ok"
+        self.pendingImages.append(f"{self.nextFrame}\t{status}\t{path}\n")
+        self.append(corners, ids, timestamp=0.0)
+
+# reads a log through memory maps
+# inputs:
+# 1 path: directory of the log
+class DetectionLog:
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        # a log that is still being written can have one column a few rows ahead of the others
+        rows = min(os.path.getsize(column_path(path, name)) // (np.dtype(dtype).itemsize * int(np.prod(shape)))
+                   for (name, (dtype, shape)) in COLUMNS.items())
+        self.columns = {}
+        for (name, (dtype, shape)) in COLUMNS.items():
+            if rows == 0: # np.memmap cannot map an empty file
+                self.columns[name] = np.zeros((0,) + shape, dtype=dtype)
+            else:
+                self.columns[name] = np.memmap(column_path(path, name), dtype=dtype, mode="r", shape=(rows,) + shape)
+        self.frame = self.columns["frame"]
+        self.timestamp = self.columns["timestamp"]
+        self.id = self.columns["id"]
+        self.corners = self.columns["corners"]
+        self.frames = self.meta["frames"]
+
+    # number of rows (detected markers)
+    def __len__(self):
+        return len(self.frame)
+
+    # rows of frame `frameIndex`, as a slice. The frame column is sorted, so this is a binary search
+    def rows(self, frameIndex):
+        (lo, hi) = np.searchsorted(self.frame, [frameIndex, frameIndex + 1])
+        return slice(int(lo), int(hi))
+
+    # returns: (corners, ids) of frame `frameIndex`, as (N, 4, 2) and (N,) arrays
+    def detections(self, frameIndex):
+        rows = self.rows(frameIndex)
+        return (np.asarray(self.corners[rows]), np.asarray(self.id[rows]))
+
+    # returns: the detections of frame `frameIndex` in the (corners, ids) format of detectMarkers, which is what
+    # find_and_warp's `detections` argument expects
+    def markers(self, frameIndex):
+        (corners, ids) = self.detections(frameIndex)
+        if len(ids) == 0:
+            return ((), None)
+        return (tuple(corners.reshape(-1, 1, 4, 2)), ids.reshape(-1, 1))
+
+    # the images of a log written from images, one per frame
+    # returns: list of (path, status), status "ok" or "unreadable". Empty for logs of videos
+    def images(self):
+        imagesPath = os.path.join(self.path, IMAGES_FILE)
+        if not os.path.exists(imagesPath):
+            return []
+        with open(imagesPath) as f:
+            rows = [line.rstrip("\n").split("\t", 2) for line in f if line.strip() != ""]
+        return [(path, status) for (frame, status, path) in rows]
+
+    # every row of one marker
+    # returns: (frames, timestamps, corners)
+    def track(self, markerID):
+        rows = np.flatnonzero(self.id == markerID)
+        return (np.asarray(self.frame[rows]), np.asarray(self.timestamp[rows]), np.asarray(self.corners[rows]))
+
+    # per-marker analytics: for every id, the number of frames it was seen in, the first and last frame, and the
+    # mean distance its center moved between consecutive detections
+    # Every column is read once: the rows are grouped by id with one stable sort (which keeps each id's rows in
+    # frame order) rather than scanned once per id
+    def summary(self):
+        order = np.argsort(self.id, kind="stable")
+        (markerIDs, starts) = np.unique(np.asarray(self.id)[order], return_index=True)
+        frames = np.asarray(self.frame)[order]
+        centers = np.asarray(self.corners).mean(axis=1)[order]
+        # distance moved from the previous row; the first row of every id is skipped below
+        motion = np.linalg.norm(np.diff(centers, axis=0), axis=1)
+        report = {}
+        for (markerID, start, end) in zip(markerIDs, starts, np.append(starts[1:], len(order))):
+            seen = frames[start:end]
+            jitter = float(motion[start:end - 1].mean()) if end - start > 1 else 0.0
+            report[int(markerID)] = {"frames": int(np.count_nonzero(np.diff(seen)) + 1), "first": int(seen[0]), "last": int(seen[-1]), "mean_motion_px": jitter}
+        return report
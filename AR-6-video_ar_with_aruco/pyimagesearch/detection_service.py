@@ -0,0 +1,357 @@
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from .aruco_registry import ARUCO_DICT, get_dictionary, get_parameters
+from .dictionary_discovery import discover
+from . import apriltag_backend
+import numpy as np
+import threading
+import asyncio
+import socket
+import struct
+import json
+import time
+import os
+import cv2
+
+# Long-running marker detection service
+# Clients connect over TCP ("host:port") or a Unix socket ("unix:/path") and send frames; the server replies with
+# the ids and corners of the markers it found. cv2 and the detectors are set up once for the lifetime of the server
+# instead of once per call. Whenever a worker frees up, the requests that queued up meanwhile (from one or many
+# connections) are handed to it as one micro-batch. Requests of a batch that carry the same frame, e.g. several
+# services polling one camera for different dictionaries or for AprilTags, share a single decode, grayscale
+# conversion and detector pass: all of the ArUCo dictionaries asked for are decoded from one candidate extraction
+# (see dictionary_discovery). Detection itself cannot be shared between different frames.
+#
+# Every message, in both directions, is
+#   !II header length, payload length
+#   header: UTF-8 JSON
+#   payload: raw bytes
+# Request header:
+#   "id": any value, copied into the reply so that replies can be matched to requests
+#   "kind": "aruco" (default) or "apriltag"
+#   "dictionary": ArUCo dictionary name, DICT_ARUCO_ORIGINAL by default
+#   "families": AprilTag families, e.g. "tag36h11" (default) or "tag36h11,tag25h9"
+#   "encoding": "image" for an encoded image file (JPEG, PNG, ...) or "raw" for pixels
+#   "shape", "dtype": shape and dtype of a raw frame, e.g. [720, 1280, 3] and "uint8"
+# Reply header:
+#   "id", "ok", and either "error" or "detections" (list of {"id", "corners": 4 [x, y] pairs} plus "family" for
+#   AprilTags), "queue_ms" (time spent waiting for a worker) and "detect_ms"
+# Replies on one connection are sent as soon as they are ready, so they can come back out of order.
+MESSAGE_HEADER = struct.Struct("!II")
+
+# largest accepted header and payload, in bytes
+MAX_HEADER = 1 << 16
+MAX_PAYLOAD = 1 << 28
+
+# per-worker detector state. Every worker thread (or process) builds its own detectors, so no detector object is
+# ever used by two threads at the same time
+_LOCAL = threading.local()
+
+def _detectors():
+    detectors = getattr(_LOCAL, "detectors", None)
+    if detectors is None:
+        detectors = _LOCAL.detectors = {}
+    return detectors
+
+# build a frame from a request
+def decode_frame(header, payload):
+    if header.get("encoding", "image") == "raw":
+        return np.frombuffer(payload, dtype=header.get("dtype", "uint8")).reshape(header["shape"])
+    frame = cv2.imdecode(np.frombuffer(payload, dtype="uint8"), cv2.IMREAD_UNCHANGED)
+    if frame is None:
+        raise ValueError("payload is not a decodable image")
+    return frame
+
+# the frame in grayscale, the input of every detector
+def to_gray(frame):
+    if frame.ndim == 2:
+        return frame
+    if frame.shape[2] == 4:
+        return cv2.cvtColor(frame, cv2.COLOR_BGRA2GRAY)
+    if frame.shape[2] == 1:
+        return frame[:, :, 0]
+    return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+# detect the markers of one request
+# inputs:
+# 1 header: the request header
+# 2 gray: the frame, in grayscale
+# 3 found: the `discover` results of the frame for the ArUCo dictionaries of its batch, or None
+# returns: list of {"id", "corners"} (and "family" for AprilTags)
+def detect_frame(header, gray, found=None):
+    kind = header.get("kind", "aruco")
+    detectors = _detectors()
+    if kind == "aruco":
+        dictName = header.get("dictionary", "DICT_ARUCO_ORIGINAL")
+        if found is not None and dictName in ARUCO_DICT:
+            (corners, ids) = found.get(dictName, ((), ()))
+            return [{"id": int(i), "corners": c.tolist()} for (c, i) in zip(corners, ids)]
+        detector = detectors.get(dictName)
+        if detector is None:
+            detector = detectors[dictName] = cv2.aruco.ArucoDetector(get_dictionary(dictName), get_parameters())
+        (corners, ids, rejected) = detector.detectMarkers(gray)
+        if ids is None:
+            return []
+        return [{"id": int(i), "corners": np.asarray(c).reshape(4, 2).tolist()} for (c, i) in zip(corners, ids.flatten())]
+
+    if kind == "apriltag":
+        if apriltag_backend.apriltag is None:
+            raise ValueError("the apriltag package is not installed")
+        families = header.get("families", "tag36h11")
+        detector = detectors.get(("apriltag", families))
+        if detector is None:
+            # the worker pool provides the parallelism, so every detector runs single-threaded
+            detector = detectors[("apriltag", families)] = apriltag_backend.AprilTagDetector(families, nthreads=1)
+        return apriltag_backend.to_records(*detector.detect(gray))
+
+    raise ValueError(f"unknown kind {kind}")
+
+# what identifies the frame of a request: requests with the same key are decoded and detected once
+def frame_key(header, payload):
+    if header.get("encoding", "image") == "raw":
+        return ("raw", str(header.get("shape")), str(header.get("dtype", "uint8")), payload)
+    return ("image", payload)
+
+# worker: detect a batch of requests
+# inputs:
+# 1 batch: list of (header, payload)
+# returns: list of reply headers without "id" and "queue_ms", in the order of the batch
+def detect_batch(batch):
+    frames = {}
+    for (k, (header, payload)) in enumerate(batch):
+        frames.setdefault(frame_key(header, payload), []).append(k)
+
+    replies = [None] * len(batch)
+    for indices in frames.values():
+        start = time.perf_counter()
+        headers = [batch[k][0] for k in indices]
+        try:
+            gray = to_gray(decode_frame(headers[0], batch[indices[0]][1]))
+            # one candidate extraction for every ArUCo dictionary asked for on this frame
+            names = {header.get("dictionary", "DICT_ARUCO_ORIGINAL") for header in headers if header.get("kind", "aruco") == "aruco"}
+            names = [name for name in names if name in ARUCO_DICT]
+            found = discover(gray, names, get_parameters()) if len(names) > 1 else None
+        except Exception as e:
+            for k in indices:
+                replies[k] = {"ok": False, "error": str(e)}
+            continue
+        for (k, header) in zip(indices, headers):
+            try:
+                detections = detect_frame(header, gray, found)
+                replies[k] = {"ok": True, "detections": detections, "detect_ms": (time.perf_counter() - start) * 1000.0}
+            except Exception as e:
+                replies[k] = {"ok": False, "error": str(e)}
+    return replies
+
+async def read_message(reader):
+    (headerLength, payloadLength) = MESSAGE_HEADER.unpack(await reader.readexactly(MESSAGE_HEADER.size))
+    if headerLength > MAX_HEADER or payloadLength > MAX_PAYLOAD:
+        raise ValueError("message too large")
+    header = json.loads(await reader.readexactly(headerLength))
+    if not isinstance(header, dict):
+        raise ValueError("the message header must be a JSON object")
+    payload = await reader.readexactly(payloadLength)
+    return (header, payload)
+
+def encode_message(header, payload=b""):
+    data = json.dumps(header).encode("utf-8")
+    return MESSAGE_HEADER.pack(len(data), len(payload)) + data + payload
+
+# one queued request
+class _Pending:
+    __slots__ = ("header", "payload", "future", "queued")
+
+    def __init__(self, header, payload, future):
+        self.header = header
+        self.payload = payload
+        self.future = future
+        self.queued = time.perf_counter()
+
+# the server
+# inputs:
+# 1 workers: size of the worker pool
+# 2 maxInFlight: requests accepted (queued or being detected) at a time. Requests over the limit are rejected
+#   right away with "busy" instead of piling up
+# 3 maxQueueMs: requests that waited longer than this for a worker are answered with "timeout" instead of being
+#   detected, since the caller has most likely moved on
+# 4 batchSize: largest number of requests handed to a worker at once
+# 5 batchWindowMs: how long a partial batch waits for more requests once a worker is free. 0 (the default) hands
+#   out the requests that are already queued without waiting, so batching adds no queueing delay
+# 6 processes: True for a process pool (pure CPU scaling, frames are copied to the workers), False for a thread
+#   pool (OpenCV releases the GIL while it decodes and detects, and frames are not copied)
+class DetectionService:
+    def __init__(self, workers=None, maxInFlight=64, maxQueueMs=500.0, batchSize=8, batchWindowMs=0.0, processes=False):
+        self.workers = workers if workers is not None else os.cpu_count() or 1
+        self.maxInFlight = maxInFlight
+        self.maxQueueMs = maxQueueMs
+        self.batchSize = batchSize
+        self.batchWindow = batchWindowMs / 1000.0
+        self.processes = processes
+        self.inFlight = 0
+        self.served = 0
+        self.rejected = 0
+        self.expired = 0
+
+    # serve on `address` until cancelled
+    # inputs:
+    # 1 address: "host:port" or "unix:/path/to/socket"
+    # 2 ready: optional asyncio.Event set once the server is listening
+    async def serve(self, address, ready=None):
+        self.queue = asyncio.Queue()
+        self.slots = asyncio.Semaphore(self.workers)
+        executorType = ProcessPoolExecutor if self.processes else ThreadPoolExecutor
+        self.executor = executorType(max_workers=self.workers)
+        if address.startswith("unix:"):
+            server = await asyncio.start_unix_server(self.handle_client, path=address[len("unix:"):])
+        else:
+            (host, port) = address.rsplit(":", 1)
+            server = await asyncio.start_server(self.handle_client, host, int(port))
+        batcher = asyncio.ensure_future(self.batch_loop())
+        if ready is not None:
+            ready.set()
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def handle_client(self, reader, writer):
+        lock = asyncio.Lock()
+        tasks = set()
+        try:
+            while True:
+                try:
+                    (header, payload) = await read_message(reader)
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                task = asyncio.ensure_future(self.answer(header, payload, writer, lock))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except ValueError as e:
+            # the stream is out of sync after a malformed message: report it and drop the connection
+            writer.write(encode_message({"ok": False, "error": str(e)}))
+        finally:
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+            writer.close()
+
+    async def answer(self, header, payload, writer, lock):
+        reply = await self.submit(header, payload)
+        reply["id"] = header.get("id")
+        async with lock:
+            writer.write(encode_message(reply))
+            await writer.drain()
+
+    # queue a request and wait for its reply header
+    async def submit(self, header, payload):
+        if self.inFlight >= self.maxInFlight:
+            self.rejected += 1
+            return {"ok": False, "error": "busy"}
+        self.inFlight += 1
+        try:
+            pending = _Pending(header, payload, asyncio.get_running_loop().create_future())
+            await self.queue.put(pending)
+            return await pending.future
+        finally:
+            self.inFlight -= 1
+
+    # start a batch as soon as a worker is free, with the requests that queued up while every worker was busy
+    async def batch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            # waiting for a free worker is part of the queue time
+            await self.slots.acquire()
+            batch = [await self.queue.get()]
+            while len(batch) < self.batchSize and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            deadline = loop.time() + self.batchWindow
+            while len(batch) < self.batchSize:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            now = time.perf_counter()
+            live = []
+            for pending in batch:
+                if (now - pending.queued) * 1000.0 > self.maxQueueMs:
+                    self.expired += 1
+                    pending.future.set_result({"ok": False, "error": "timeout"})
+                else:
+                    live.append(pending)
+            if len(live) == 0:
+                self.slots.release()
+                continue
+            asyncio.ensure_future(self.run_batch(live, now))
+
+    async def run_batch(self, batch, started):
+        loop = asyncio.get_running_loop()
+        try:
+            replies = await loop.run_in_executor(self.executor, detect_batch, [(p.header, p.payload) for p in batch])
+        except Exception as e:
+            replies = [{"ok": False, "error": str(e)}] * len(batch)
+        finally:
+            self.slots.release()
+        for (pending, reply) in zip(batch, replies):
+            reply = dict(reply)
+            reply["queue_ms"] = (started - pending.queued) * 1000.0
+            self.served += 1
+            if not pending.future.done():
+                pending.future.set_result(reply)
+
+# blocking client, for callers that do not run an event loop
+# inputs:
+# 1 address: "host:port" or "unix:/path/to/socket"
+# 2 timeout: socket timeout in seconds
+class DetectionClient:
+    def __init__(self, address, timeout=10.0):
+        if address.startswith("unix:"):
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.settimeout(timeout)
+            self.sock.connect(address[len("unix:"):])
+        else:
+            (host, port) = address.rsplit(":", 1)
+            self.sock = socket.create_connection((host, int(port)), timeout=timeout)
+        self.nextID = 0
+
+    def _recv_exactly(self, n):
+        data = bytearray()
+        while len(data) < n:
+            chunk = self.sock.recv(n - len(data))
+            if not chunk:
+                raise ConnectionError("connection closed by the server")
+            data.extend(chunk)
+        return bytes(data)
+
+    # detect the markers in a frame
+    # inputs:
+    # 1 frame: BGR or grayscale image
+    # 2 kind: "aruco" or "apriltag"
+    # 3 encode: file extension used to compress the frame before sending it (e.g. ".jpg"), or None to send raw
+    #   pixels, which is faster over a local socket
+    # 4 options: other request header fields, e.g. dictionary="DICT_6X6_250" or families="tag36h11"
+    # returns: the reply header
+    def detect(self, frame, kind="aruco", encode=None, **options):
+        header = dict(options)
+        header.update({"id": self.nextID, "kind": kind})
+        self.nextID += 1
+        if encode is None:
+            frame = np.ascontiguousarray(frame)
+            header.update({"encoding": "raw", "shape": list(frame.shape), "dtype": frame.dtype.str})
+            payload = frame.tobytes()
+        else:
+            (ok, buffer) = cv2.imencode(encode, frame)
+            header["encoding"] = "image"
+            payload = buffer.tobytes()
+        self.sock.sendall(encode_message(header, payload))
+
+        (headerLength, payloadLength) = MESSAGE_HEADER.unpack(self._recv_exactly(MESSAGE_HEADER.size))
+        reply = json.loads(self._recv_exactly(headerLength))
+        self._recv_exactly(payloadLength)
+        return reply
+
+    def close(self):
+        self.sock.close()
@@ -0,0 +1,338 @@
+from .aruco_registry import ARUCO_DICT, get_dictionary, get_parameters, detector_for, parameter_values, make_parameters
+from collections import OrderedDict
+import numpy as np
+import threading
+import cv2
+
+# Discovers which ArUCo dictionaries are present in an image in a single pass
+# The brute-force approach runs cv2.aruco.detectMarkers once per dictionary, which repeats the thresholding,
+# contour and quad extraction for every dictionary even though none of it depends on the dictionary.
+# Here the candidate quads are extracted once, their bits are read once per marker size (4x4, 5x5, 6x6, 7x7),
+# and the candidates with a valid border are then matched against every dictionary of that size at the same time,
+# once per family of dictionaries sharing their code words.
+
+# the dictionary used to extract candidates. Which one is used does not matter: the candidates it identifies
+# are returned as markers and the rest are returned as rejected, and both are decoded again below
+PROBE_DICT = "DICT_4X4_50"
+
+# masks of the SWAR popcount below
+M1 = np.uint64(0x5555555555555555)
+M2 = np.uint64(0x3333333333333333)
+M4 = np.uint64(0x0F0F0F0F0F0F0F0F)
+H01 = np.uint64(0x0101010101010101)
+
+# number of set bits of every element of a uint64 array, without a per-byte lookup
+def popcount(x):
+    x = x - ((x >> np.uint64(1)) & M1)
+    x = (x & M2) + ((x >> np.uint64(2)) & M2)
+    x = (x + (x >> np.uint64(4))) & M4
+    return ((x * H01) >> np.uint64(56)).astype("int32")
+
+# per-process cache of the code words of every dictionary, packed into integers: name -> codeWords
+_CODE_WORDS = {}
+
+# per-process cache of the packed code words of every dictionary sorted, for exact lookups: name -> (sorted, order)
+_LOOKUPS = {}
+
+# per-process cache of the candidate extraction parameters: parameter values -> probe parameters, least recently
+# used first out. discover may run on several threads (see live_discovery.py)
+_PROBE_PARAMETERS = OrderedDict()
+_PROBE_LOCK = threading.Lock()
+PROBE_CACHE_SIZE = 8
+
+# the parameters used to extract candidates: a copy of `arucoParams` that keeps nested quads
+# Recent OpenCV versions group quads that are too close to each other (the inner and outer contour of a marker's
+# border, a marker and its white margin) and only report the outermost quad of a group that fails to decode,
+# which for markers of another dictionary is usually the margin rather than the marker. A tiny
+# minMarkerDistanceRate keeps every quad of the group; the grouping of the actual parameters is then replayed once
+# per marker size after decoding, see CandidateGroups
+def _probe_parameters(arucoParams):
+    key = parameter_values(arucoParams)
+    with _PROBE_LOCK:
+        probe = _PROBE_PARAMETERS.get(key)
+        if probe is not None:
+            _PROBE_PARAMETERS.move_to_end(key)
+            return probe
+        probe = _PROBE_PARAMETERS[key] = make_parameters(dict(key))
+        probe.minMarkerDistanceRate = min(arucoParams.minMarkerDistanceRate, 0.001)
+        while len(_PROBE_PARAMETERS) > PROBE_CACHE_SIZE:
+            _PROBE_PARAMETERS.popitem(last=False)
+        return probe
+
+# codeWords is Dictionary.bytesList viewed as (markers, rotations, bytes) and packed into one integer per code word:
+# OpenCV exposes it as (markers, bytes, 4) but stores the 4 rotations one after the other
+def _get_code_words(name):
+    if name not in _CODE_WORDS:
+        bytesList = get_dictionary(name).bytesList
+        _CODE_WORDS[name] = pack_bytes(bytesList.reshape(len(bytesList), 4, -1))
+    return _CODE_WORDS[name]
+
+def _get_lookup(name):
+    if name not in _LOOKUPS:
+        flat = _get_code_words(name).ravel()
+        order = np.argsort(flat, kind="stable")
+        _LOOKUPS[name] = (flat[order], order)
+    return _LOOKUPS[name]
+
+# per-process cache of where the code words of every dictionary come from: name -> (source name, markers)
+_SOURCES = {}
+
+# the dictionary whose code words a dictionary's are the first of, and how many of them it has
+# The sized variants of a family (DICT_6X6_50 ... DICT_6X6_1000) are prefixes of the largest one, so a candidate
+# only has to be matched against the largest; the smaller ones use the first rows of its distances
+def _code_word_source(name):
+    if name not in _SOURCES:
+        bytesList = get_dictionary(name).bytesList
+        source = name
+        for other in ARUCO_DICT:
+            otherList = get_dictionary(other).bytesList
+            if len(otherList) > len(get_dictionary(source).bytesList) and otherList.shape[1:] == bytesList.shape[1:] \
+                    and np.array_equal(otherList[:len(bytesList)], bytesList):
+                source = other
+        _SOURCES[name] = (source, len(bytesList))
+    return _SOURCES[name]
+
+# extract every candidate quad from the image
+# returns an (N, 4, 2) float32 array of candidate corners
+def extract_candidates(gray, arucoParams):
+    (corners, ids, rejected) = detector_for(get_dictionary(PROBE_DICT), _probe_parameters(arucoParams)).detectMarkers(gray)
+    quads = [np.asarray(c, dtype="float32").reshape(4, 2) for c in list(corners) + list(rejected)]
+    if len(quads) == 0:
+        return np.zeros((0, 4, 2), dtype="float32")
+    return np.array(quads, dtype="float32")
+
+# read the bit grid (border included) of every candidate, the same way cv2.aruco does:
+# remove the perspective, Otsu threshold the cell grid and count the white pixels in each cell
+# returns a (N, cells, cells) uint8 array of bits, where cells = markerSize + 2 * markerBorderBits
+def extract_bits(gray, candidates, markerSize, arucoParams):
+    borderBits = arucoParams.markerBorderBits
+    cellSize = arucoParams.perspectiveRemovePixelPerCell
+    cells = markerSize + 2 * borderBits
+    size = cells * cellSize
+    margin = int(arucoParams.perspectiveRemoveIgnoredMarginPerCell * cellSize)
+    corners = np.array([[0, 0], [size - 1, 0], [size - 1, size - 1], [0, size - 1]], dtype="float32")
+
+    # the patches are thresholded one by one, but their cells are counted all at once
+    patches = np.empty((len(candidates), size, size), dtype="uint8")
+    uniform = {}
+    for (i, quad) in enumerate(candidates):
+        M = cv2.getPerspectiveTransform(quad, corners)
+        patch = cv2.warpPerspective(gray, M, (size, size), flags=cv2.INTER_NEAREST)
+
+        # a patch without enough contrast is either all black or all white
+        inner = patch[cellSize // 2:size - cellSize // 2, cellSize // 2:size - cellSize // 2]
+        (mean, stddev) = cv2.meanStdDev(inner)
+        if stddev[0, 0] < arucoParams.minOtsuStdDev:
+            uniform[i] = 1 if mean[0, 0] > 127 else 0
+            continue
+        cv2.threshold(patch, 125, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU, dst=patches[i])
+
+    grid = patches.reshape(len(candidates), cells, cellSize, cells, cellSize)[:, :, margin:cellSize - margin, :, margin:cellSize - margin]
+    counts = np.count_nonzero(grid, axis=(2, 4))
+    bits = (counts > (grid.shape[2] * grid.shape[4]) / 2).astype("uint8")
+    for (i, value) in uniform.items():
+        bits[i] = value
+    return bits
+
+# pack (N, markerSize, markerSize) bit grids into the byte layout of a dictionary code word (rotation 0):
+# row-major, 8 bits per byte, most significant bit first, with the last partial byte right aligned
+def pack_bits(bits):
+    flat = bits.reshape(len(bits), -1).astype("int64")
+    nbits = flat.shape[1]
+    starts = np.arange(0, nbits, 8)
+    ends = np.minimum(starts + 8, nbits)
+    weights = np.concatenate([1 << np.arange(e - s - 1, -1, -1) for (s, e) in zip(starts, ends)])
+    return np.add.reduceat(flat * weights, starts, axis=1).astype("uint8")
+
+# pack the bytes of code words (at most 8, 7x7 markers need 7) into one uint64 each, first byte most significant
+def pack_bytes(codes):
+    shifts = np.arange(codes.shape[-1] - 1, -1, -1, dtype="uint64") * np.uint64(8)
+    return np.bitwise_or.reduce(codes.astype("uint64") << shifts, axis=-1)
+
+# hamming distance of packed candidate codes to every code word and rotation of a dictionary
+# returns: (N, markers, rotations) int32 array
+def hamming(codes, codeWords):
+    return popcount(codes[:, None, None] ^ codeWords[None])
+
+# the best match of every candidate among the first `markers` code words
+# returns: (matched, ids, rotations) arrays of length N
+def identify(distances, markers, maxCorrection):
+    flat = distances[:, :markers].reshape(len(distances), -1)
+    best = flat.argmin(axis=1)
+    matched = flat[np.arange(len(distances)), best] <= maxCorrection
+    (ids, rotations) = np.divmod(best, distances.shape[2])
+    return (matched, ids, rotations)
+
+# identify for dictionaries that correct no bits: a binary search of the sorted code words instead of a distance to
+# every one of them. Of equal code words the first is found, as argmin would
+def lookup(codes, table, markers):
+    (sortedWords, order) = table
+    positions = np.minimum(np.searchsorted(sortedWords, codes), len(sortedWords) - 1)
+    (ids, rotations) = np.divmod(order[positions], 4)
+    matched = (sortedWords[positions] == codes) & (ids < markers)
+    return (matched, ids, rotations)
+
+# merge the detections of one marker found more than once (e.g. in two overlapping tiles, see tiled_detection.py):
+# of the detections of the same id whose centers are closer than a quarter of their side, only the first is kept
+# returns: (corners, ids)
+def merge_duplicates(corners, ids):
+    centers = corners.mean(axis=1)
+    sides = np.linalg.norm(corners[:, 1] - corners[:, 0], axis=1)
+    keep = []
+    for i in range(len(ids)):
+        if not any(ids[j] == ids[i] and np.linalg.norm(centers[j] - centers[i]) < 0.25 * sides[j] for j in keep):
+            keep.append(i)
+    return (corners[keep], ids[keep])
+
+# mean distance between the corners of every pair of quads, over the 4 ways of pairing their corners up
+# returns: (N, N) float64 array
+def average_distances(quads):
+    quads = quads.astype("float64")
+    best = None
+    for first in range(4):
+        squared = ((np.roll(quads, -first, axis=1)[:, None] - quads[None]) ** 2).sum(axis=3).mean(axis=2)
+        best = squared if best is None else np.minimum(best, squared)
+    return np.sqrt(best)
+
+# the candidate selection of cv2.aruco's detectMarkers, replayed on the candidates extracted with the probe parameters
+# detectMarkers sorts the candidates by perimeter, groups the ones whose corners are on average closer than
+# minMarkerDistanceRate times their perimeter, and only decodes the largest quad of a group, falling back to its
+# "close contours": the other quads of the group that are more than minGroupDistance cells apart. The grouping is
+# what keeps the quads just inside a marker's border, whose bits are the marker's own cells, from decoding as a
+# phantom marker of another dictionary, so every dictionary goes through the same selection here
+class CandidateGroups:
+    def __init__(self, candidates, arucoParams):
+        perimeters = np.linalg.norm(candidates - np.roll(candidates, -1, axis=1), axis=2).sum(axis=1)
+        order = np.argsort(-perimeters, kind="stable")
+        self.quads = candidates[order]       # (N, 4, 2) float32 candidates, largest perimeter first
+        self.perimeters = perimeters[order]
+        self.distances = average_distances(self.quads)
+        self.borderBits = arucoParams.markerBorderBits
+        self.minGroupDistance = arucoParams.minGroupDistance
+        self.members = {}                    # marker size -> (owner, rank), see quads_tried
+
+        # groups of quads that are too close to each other, largest first (smallest first for inverted markers)
+        close = np.triu(self.distances < self.perimeters[None] * arucoParams.minMarkerDistanceRate, k=1)
+        groupOf = np.full(len(self.quads), -1)
+        self.groups = []
+        for (i, j) in zip(*np.nonzero(close)):
+            if groupOf[i] < 0 and groupOf[j] < 0:
+                groupOf[i] = groupOf[j] = len(self.groups)
+                self.groups.append([i, j])
+            elif groupOf[j] < 0:
+                groupOf[j] = groupOf[i]
+                self.groups[groupOf[i]].append(j)
+            elif groupOf[i] < 0:
+                groupOf[i] = groupOf[j]
+                self.groups[groupOf[j]].append(i)
+        for group in self.groups:
+            group.sort(reverse=arucoParams.detectInvertedMarker)
+        self.selected = np.array(sorted([i for i in range(len(self.quads)) if groupOf[i] < 0] + [g[0] for g in self.groups]), dtype="int64")
+
+    # the quads decoded for every selected quad, for markers of `markerSize` bits (the close contours depend on
+    # the size of a cell)
+    # returns: (owner, rank) arrays over the candidates: the position in `selected` of the quad a candidate is tried
+    # for and in which order, -1 for the candidates that are never decoded
+    def quads_tried(self, markerSize):
+        if markerSize not in self.members:
+            cellSizes = self.perimeters / (4 * (markerSize + 2 * self.borderBits))
+            owner = np.full(len(self.quads), -1)
+            rank = np.full(len(self.quads), -1)
+            owner[self.selected] = np.arange(len(self.selected))
+            rank[self.selected] = 0
+            for group in self.groups:
+                (current, tried) = (group[0], 1)
+                for m in group[1:]:
+                    if self.distances[m, current] > self.minGroupDistance * cellSizes[m]:
+                        (owner[m], rank[m]) = (owner[group[0]], tried)
+                        (current, tried) = (m, tried + 1)
+            self.members[markerSize] = (owner, rank)
+        return self.members[markerSize]
+
+    # the candidates detectMarkers reports, given the candidates a dictionary decodes
+    # inputs:
+    # 1 matched: (N,) bool array, whether every candidate decodes as a marker of the dictionary
+    # 2 markerSize: the dictionary's marker size
+    # returns: array of candidate indices
+    def select(self, matched, markerSize):
+        (owner, rank) = self.quads_tried(markerSize)
+        decoded = {}
+        for m in np.flatnonzero(matched & (owner >= 0)):
+            k = owner[m]
+            if k not in decoded or rank[m] < rank[decoded[k]]:
+                decoded[k] = m
+        return np.array([decoded[k] for k in sorted(decoded)], dtype="int64")
+
+# find the markers of every dictionary in an image
+# inputs:
+# 1 image: BGR or grayscale image
+# 2 names: names of the dictionaries to look for. Defaults to every dictionary in ARUCO_DICT
+# 3 arucoParams: the ArUCo marker detector parameters. Defaults to the registry's default parameters
+# returns: dict of dictionary name -> (corners, ids) for every dictionary with at least one marker, where
+# corners is an (N, 4, 2) float32 array ordered TL, TR, BR, BL and ids is an (N,) int32 array
+def discover(image, names=None, arucoParams=None):
+    names = list(ARUCO_DICT.keys()) if names is None else names
+    if arucoParams is None:
+        arucoParams = get_parameters()
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+
+    candidates = extract_candidates(gray, arucoParams)
+    results = {}
+    if len(candidates) == 0:
+        return results
+    groups = CandidateGroups(candidates, arucoParams)
+    candidates = groups.quads
+
+    borderBits = arucoParams.markerBorderBits
+    bitsBySize = {}
+    distancesBySource = {}
+    for name in names:
+        dictionary = get_dictionary(name)
+        markerSize = dictionary.markerSize
+
+        # the bits (and border check) only depend on the marker size, so they are shared between dictionaries.
+        # Only the candidates with a valid border are decoded any further
+        if markerSize not in bitsBySize:
+            bits = extract_bits(gray, candidates, markerSize, arucoParams)
+            inner = bits[:, borderBits:borderBits + markerSize, borderBits:borderBits + markerSize]
+            borderErrors = bits.sum(axis=(1, 2), dtype="int32") - inner.sum(axis=(1, 2), dtype="int32")
+            valid = np.flatnonzero(borderErrors <= int(markerSize * markerSize * arucoParams.maxErroneousBitsInBorderRate))
+            bitsBySize[markerSize] = (valid, pack_bytes(pack_bits(inner[valid])))
+        (valid, codes) = bitsBySize[markerSize]
+        if len(valid) == 0:
+            continue
+
+        # the distances are shared by the dictionaries whose code words are a prefix of the same dictionary's
+        (source, markers) = _code_word_source(name)
+        maxCorrection = int(dictionary.maxCorrectionBits * arucoParams.errorCorrectionRate)
+        if maxCorrection == 0:
+            (matched, ids, rotations) = lookup(codes, _get_lookup(source), markers)
+        else:
+            if source not in distancesBySource:
+                distancesBySource[source] = hamming(codes, _get_code_words(source))
+            (matched, ids, rotations) = identify(distancesBySource[source], markers, maxCorrection)
+        if not matched.any():
+            continue
+
+        # of the candidates that decode, keep the ones detectMarkers would have reported
+        decoded = np.zeros(len(candidates), dtype="bool")
+        decoded[valid[matched]] = True
+        (allIds, allRotations) = (np.zeros(len(candidates), dtype="int64"), np.zeros(len(candidates), dtype="int64"))
+        (allIds[valid], allRotations[valid]) = (ids, rotations)
+        picks = groups.select(decoded, markerSize)
+        if len(picks) == 0:
+            continue
+
+        # rotate the corners so that the first corner is the marker's top left corner
+        corners = np.array([np.roll(candidates[m], allRotations[m], axis=0) for m in picks], dtype="float32")
+        results[name] = (corners, allIds[picks].astype("int32"))
+    return results
+
+# process pool entry point: load an image from disk and run `discover` on it
+# returns: (path, results) with the corners and ids converted to lists so that they can be serialized
+def discover_file(path, names=None):
+    image = cv2.imread(path)
+    if image is None:
+        return (path, None)
+    results = discover(image, names)
+    return (path, {name: {"ids": ids.tolist(), "corners": corners.tolist()} for (name, (corners, ids)) in results.items()})
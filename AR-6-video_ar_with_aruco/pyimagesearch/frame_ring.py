@@ -0,0 +1,105 @@
+from multiprocessing import shared_memory
+import numpy as np
+
+# Zero-copy frame transport between processes
+# A SharedFrameRing is a fixed number of preallocated frame slots in one multiprocessing.shared_memory block.
+# The capture process writes frame number `seq` into slot `seq % slots` and hands only `seq` (a small int) to the
+# workers, which attach to the same block and read the slot through a NumPy view -- no frame is ever pickled.
+#
+# Every slot has a stamp: the sequence number of the frame it holds, or WRITING while the capture process fills it.
+# A reader checks the stamp before and after using a view; if it changed, the slot was reused for a newer frame
+# while it was being read and the result must be thrown away. Keeping the ring larger than the number of frames
+# in flight means this only happens when the workers fall behind.
+# Only one process may write to a ring.
+
+# stamp of a slot that was never written
+EMPTY = -1
+# stamp of a slot that is being written
+WRITING = -2
+
+# frame slots are aligned to a cache line
+ALIGNMENT = 64
+
+# inputs:
+# 1 slots: number of frame slots
+# 2 shape: shape of one frame, e.g. (1080, 1920, 3)
+# 3 dtype: dtype of the frames
+# 4 name: name of the shared memory block. Generated when creating a ring
+# 5 create: True to allocate a new ring (the writer), False to attach to an existing one (the readers)
+class SharedFrameRing:
+    def __init__(self, slots, shape, dtype="uint8", name=None, create=True):
+        self.slots = slots
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.created = create
+
+        # stamps of the slots, followed by the sequence number of the newest published frame
+        headerBytes = 8 * (slots + 1)
+        self.offset = (headerBytes + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+        frameBytes = int(np.prod(self.shape)) * self.dtype.itemsize
+        if create:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=self.offset + frameBytes * slots)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.stamps = np.ndarray((slots + 1,), dtype="int64", buffer=self.shm.buf)
+        self.frames = np.ndarray((slots,) + self.shape, dtype=self.dtype, buffer=self.shm.buf, offset=self.offset)
+        if create:
+            self.stamps[:] = EMPTY
+        self.nextSeq = 0
+
+    # everything another process needs to attach, picklable
+    def spec(self):
+        return {"name": self.shm.name, "slots": self.slots, "shape": self.shape, "dtype": self.dtype.str}
+
+    # attach to a ring created by another process
+    @classmethod
+    def attach(cls, spec):
+        return cls(spec["slots"], spec["shape"], spec["dtype"], name=spec["name"], create=False)
+
+    # writer: reserve the slot of the next frame, e.g. to decode or resize straight into it with `dst=`
+    # returns: (seq, writable view of the slot). The frame is not visible to readers until `publish(seq)`
+    def claim(self):
+        seq = self.nextSeq
+        slot = seq % self.slots
+        self.stamps[slot] = WRITING
+        return (seq, self.frames[slot])
+
+    # writer: make a claimed frame visible to readers
+    def publish(self, seq):
+        self.stamps[seq % self.slots] = seq
+        self.stamps[self.slots] = seq
+        self.nextSeq = seq + 1
+
+    # writer: copy a frame into the next slot and publish it
+    # returns: the sequence number of the frame
+    def write(self, frame):
+        (seq, view) = self.claim()
+        np.copyto(view, frame)
+        self.publish(seq)
+        return seq
+
+    # reader: view of frame `seq`, or None if its slot already holds another frame
+    # The view stays valid only as long as `is_current(seq)` is True
+    def view(self, seq):
+        slot = seq % self.slots
+        if self.stamps[slot] != seq:
+            return None
+        return self.frames[slot]
+
+    # reader: whether frame `seq` is still in its slot. Check after reading a view to detect an overwrite
+    def is_current(self, seq):
+        return self.stamps[seq % self.slots] == seq
+
+    # sequence number of the newest published frame, or EMPTY
+    def latest(self):
+        return int(self.stamps[self.slots])
+
+    # detach from the shared memory. Views returned by `claim` and `view` must not be used afterwards
+    def close(self):
+        self.stamps = None
+        self.frames = None
+        self.shm.close()
+
+    # free the shared memory. Called by the process that created the ring once every reader is done
+    def unlink(self):
+        self.shm.unlink()
@@ -0,0 +1,148 @@
+from collections import deque
+import threading
+import json
+import time
+import numpy as np
+import cv2
+
+# Optional per-stage timing for the AR hot path
+# find_and_warp (and the scripts around it) wrap every stage in `stats.stage(name)` and bump counters such as
+# detection misses and cache fallbacks. StageStats keeps a rolling window of recent latencies and a cumulative
+# histogram per stage; NULL_STATS does nothing and is used when no instrumentation was asked for.
+
+# histogram bucket upper edges, in milliseconds. The last bucket holds everything slower
+HISTOGRAM_EDGES_MS = (0.5, 1, 2, 4, 8, 16, 33, 66, 133)
+
+# times one stage. A single instance is reused for every call of the same stage, so timing allocates nothing
+class _StageTimer:
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.stats.record(self.name, time.perf_counter() - self.start)
+        return False
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+# stand-in used when instrumentation is off
+class NullStats:
+    enabled = False
+    _timer = _NullTimer()
+
+    def stage(self, name):
+        return self._timer
+
+    def record(self, name, seconds):
+        pass
+
+    def count(self, name, n=1):
+        pass
+
+    def frame_done(self):
+        pass
+
+NULL_STATS = NullStats()
+
+# per-stage rolling statistics and counters
+# Stages and counters may be recorded from several threads (e.g. the stages of pipeline.py): updates are locked
+# inputs:
+# 1 window: number of recent samples per stage used for the mean and percentiles
+# 2 callback: optional function called with `snapshot()` every `interval` seconds (checked in `frame_done`)
+# 3 interval: seconds between two callback calls
+class StageStats:
+    enabled = True
+
+    def __init__(self, window=300, callback=None, interval=5.0):
+        self.window = window
+        self.callback = callback
+        self.interval = interval
+        self.samples = {}    # stage -> deque of recent latencies in seconds
+        self.histograms = {} # stage -> cumulative bucket counts
+        self.timers = {}
+        self.counters = {}
+        self.frames = 0
+        self.lastCallback = time.monotonic()
+        self.lock = threading.Lock()
+
+    # context manager timing the enclosed block as stage `name`
+    def stage(self, name):
+        timer = self.timers.get(name)
+        if timer is None:
+            timer = self.timers[name] = _StageTimer(self, name)
+        return timer
+
+    def record(self, name, seconds):
+        bucket = np.searchsorted(HISTOGRAM_EDGES_MS, seconds * 1000.0)
+        with self.lock:
+            samples = self.samples.get(name)
+            if samples is None:
+                samples = self.samples[name] = deque(maxlen=self.window)
+                self.histograms[name] = np.zeros(len(HISTOGRAM_EDGES_MS) + 1, dtype="int64")
+            samples.append(seconds)
+            self.histograms[name][bucket] += 1
+
+    # increment counter `name`, e.g. "detection_miss" or "cache_fallback"
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    # mark the end of a frame. Calls the callback when the interval has elapsed
+    def frame_done(self):
+        self.frames += 1
+        if self.callback is not None:
+            now = time.monotonic()
+            if now - self.lastCallback >= self.interval:
+                self.lastCallback = now
+                self.callback(self.snapshot())
+
+    # current statistics as a JSON-serializable dict
+    # Safe to call from another thread than the one recording: everything is copied before it is read
+    def snapshot(self):
+        stages = {}
+        for (name, samples) in list(self.samples.items()):
+            ms = np.array(list(samples)) * 1000.0
+            stages[name] = {
+                "count": int(self.histograms[name].sum()),
+                "mean_ms": float(ms.mean()),
+                "p50_ms": float(np.percentile(ms, 50)),
+                "p99_ms": float(np.percentile(ms, 99)),
+                "histogram": {"edges_ms": list(HISTOGRAM_EDGES_MS), "counts": self.histograms[name].tolist()}
+            }
+        return {"time": time.time(), "frames": self.frames, "stages": stages, "counters": self.counters.copy()}
+
+    # draw the per-stage breakdown (mean and p99 over the window) and the counters onto a frame, in place
+    # inputs:
+    # 1 frame: the frame to draw on
+    # 2 origin: (x, y) of the first line of text
+    def draw_overlay(self, frame, origin=(10, 20)):
+        (x, y) = origin
+        lines = []
+        for (name, samples) in list(self.samples.items()):
+            ms = np.array(list(samples)) * 1000.0
+            lines.append(f"{name:<10} {ms.mean():6.2f} ms  p99 {np.percentile(ms, 99):6.2f} ms")
+        lines.extend(f"{name}: {value}" for (name, value) in self.counters.copy().items())
+        for line in lines:
+            cv2.putText(frame, line, (x, y), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 3)
+            cv2.putText(frame, line, (x, y), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 255), 1)
+            y += 18
+        return frame
+
+# callback for StageStats that appends every snapshot to a JSON lines file
+# inputs:
+# 1 path: path of the file to append to
+def jsonl_dumper(path):
+    def dump(snapshot):
+        with open(path, "a") as f:
+            f.write(json.dumps(snapshot) + "\n")
+    return dump
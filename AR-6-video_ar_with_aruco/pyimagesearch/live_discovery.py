@@ -0,0 +1,233 @@
+from .aruco_registry import ARUCO_DICT, get_parameters, get_detector
+from .dictionary_discovery import discover
+from collections import Counter
+import numpy as np
+import threading
+import time
+import os
+import cv2
+
+# Dictionary discovery for video streams
+# Running `discover` (or worse, one detection per dictionary) on every frame costs up to 21 detections' worth of
+# work per frame. A LiveDiscovery probes every dictionary on the first few frames only, locks onto the
+# dictionaries found in enough of them and from then on only looks for the locked dictionaries: with the native
+# detector when a single one is locked, with one `discover` pass restricted to them otherwise. A low priority
+# background thread re-probes the dictionaries that are not locked on one frame every few seconds, so a family
+# entering the view later is picked up (once it was found in `minHits` probes in a row), and a locked dictionary
+# that has not been seen for a while is dropped again.
+# The sized variants of a family (DICT_4X4_50 ... DICT_4X4_1000) share their code words, so a marker of one is a
+# marker of all the larger ones: only the smallest variant holding every id seen is locked.
+
+# family and size of the sized dictionaries, e.g. "DICT_6X6_250" -> ("DICT_6X6", 250). None for the others
+def sized_family(name):
+    (family, _, size) = name.rpartition("_")
+    if family.startswith("DICT_") and "X" in family and size.isdigit():
+        return (family, int(size))
+    return None
+
+# the smallest dictionary of `name`'s family that holds marker ids up to `maxID`
+def smallest_variant(name, maxID):
+    sized = sized_family(name)
+    if sized is None:
+        return name
+    sizes = sorted(size for (family, size) in filter(None, map(sized_family, ARUCO_DICT)) if family == sized[0])
+    for size in sizes:
+        if maxID < size:
+            return f"{sized[0]}_{size}"
+    return name
+
+# keep one dictionary per sized family: the largest found, which holds every id the smaller ones hold
+def collapse(results):
+    kept = {}
+    for (name, found) in results.items():
+        sized = sized_family(name)
+        key = name if sized is None else sized[0]
+        if key not in kept or (sized is not None and sized[1] > sized_family(kept[key][0])[1]):
+            kept[key] = (name, found)
+    return dict(kept.values())
+
+# inputs:
+# 1 names: dictionaries to look for, every dictionary in ARUCO_DICT by default
+# 2 params: DetectorParameters overrides or profile name, see aruco_registry.get_parameters
+# 3 sampleFrames: number of early frames every dictionary is probed on
+# 4 minHits: number of sampled frames (or consecutive background probes) a marker must be found in for its
+#   dictionary to be locked. Filters out the odd false decode
+# 5 probeInterval: seconds between two background re-probes. 0 for no background thread
+# 6 forgetAfter: seconds after which a locked dictionary that has not been seen is dropped. 0 to keep them
+# 7 callback: optional function called with ("lock" or "unlock", dictionary name) whenever the locked set
+#   changes, from the background thread too
+class LiveDiscovery:
+    def __init__(self, names=None, params=None, sampleFrames=10, minHits=2, probeInterval=5.0, forgetAfter=30.0, callback=None):
+        self.names = list(ARUCO_DICT.keys()) if names is None else list(names)
+        self.params = params
+        self.arucoParams = get_parameters(params)
+        self.sampleFrames = sampleFrames
+        self.minHits = minHits
+        self.probeInterval = probeInterval
+        self.forgetAfter = forgetAfter
+        self.callback = callback
+        self.sampled = 0
+        self.hits = Counter()    # (family, marker id) -> sampled frames it was found in
+        self.probeHits = Counter() # (family, marker id) -> consecutive background probes it was found in
+        self.families = {}       # family -> a dictionary of it that was found
+        self.locked = ()         # locked dictionaries, replaced (never modified) under `lock`
+        self.lastSeen = {}       # locked dictionary -> time it was last found
+        self.lock = threading.Lock()
+        self.probes = 0
+
+        # frame handoff to the background thread: it asks for a frame, the next `detect` copies one in
+        self.wanted = threading.Event()
+        self.ready = threading.Event()
+        self.probeFrame = None
+        self.stopEvent = threading.Event()
+        self.thread = None
+
+    # whether or not the sampling phase is over
+    def is_locked(self):
+        return self.sampled >= self.sampleFrames
+
+    # detect the markers of a frame
+    # returns: dict of dictionary name -> (corners, ids) like `discover`: (N, 4, 2) float32 corners and (N,) int32 ids
+    def detect(self, frame):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        if not self.is_locked():
+            return self._sample(gray)
+
+        if self.wanted.is_set():
+            self.probeFrame = gray.copy()
+            self.wanted.clear()
+            self.ready.set()
+
+        now = time.monotonic()
+        locked = self.locked
+        results = {}
+        if len(locked) > 1:
+            # a single pass extracts the candidates once for all of the locked dictionaries
+            results = discover(gray, list(locked), self.arucoParams)
+        elif len(locked) == 1:
+            (corners, ids, rejected) = get_detector(locked[0], self.params).detectMarkers(gray)
+            if ids is not None and len(ids) > 0:
+                results[locked[0]] = (np.asarray(corners, dtype="float32").reshape(-1, 4, 2), ids.ravel().astype("int32"))
+        for name in results:
+            self.lastSeen[name] = now
+        if self.forgetAfter > 0:
+            for name in self.locked:
+                if now - self.lastSeen.get(name, now) > self.forgetAfter:
+                    self.unlock(name)
+        return results
+
+    # sampling phase: every dictionary is probed in a single pass
+    def _sample(self, gray):
+        results = collapse(discover(gray, self.names, self.arucoParams))
+        self.sampled += 1
+        for (name, (corners, ids)) in results.items():
+            sized = sized_family(name)
+            family = name if sized is None else sized[0]
+            self.families[family] = name
+            for i in set(ids.tolist()):
+                self.hits[(family, i)] += 1
+        if self.is_locked():
+            for (family, name) in self.families.items():
+                confirmed = [i for ((f, i), count) in self.hits.items() if f == family and count >= self.minHits]
+                if len(confirmed) > 0:
+                    self.lock_on(smallest_variant(name, max(confirmed)))
+            self.start()
+        return results
+
+    # add a dictionary to the locked set, replacing a smaller variant of the same family
+    def lock_on(self, name):
+        sized = sized_family(name)
+        with self.lock:
+            if name in self.locked:
+                return
+            replaced = [n for n in self.locked if sized is not None and sized_family(n) is not None and sized_family(n)[0] == sized[0]]
+            if any(sized_family(n)[1] > sized[1] for n in replaced):
+                return
+            self.locked = tuple(n for n in self.locked if n not in replaced) + (name,)
+            self.lastSeen[name] = time.monotonic()
+        for n in replaced:
+            self._notify("unlock", n)
+        self._notify("lock", name)
+
+    def unlock(self, name):
+        with self.lock:
+            if name not in self.locked:
+                return
+            self.locked = tuple(n for n in self.locked if n != name)
+            self.lastSeen.pop(name, None)
+        self._notify("unlock", name)
+
+    def _notify(self, event, name):
+        if self.callback is not None:
+            self.callback(event, name)
+
+    # the dictionaries a background probe looks for, with the smallest id worth reporting: the larger variants of
+    # a locked family only matter for ids the locked variant does not hold
+    def probe_targets(self):
+        locked = {}
+        for name in self.locked:
+            sized = sized_family(name)
+            if sized is not None:
+                locked[sized[0]] = sized[1]
+        targets = {}
+        for name in self.names:
+            if name in self.locked:
+                continue
+            sized = sized_family(name)
+            if sized is not None and sized[0] in locked:
+                if sized[1] <= locked[sized[0]]:
+                    continue
+                targets[name] = locked[sized[0]]
+            else:
+                targets[name] = 0
+        return targets
+
+    # one background probe on `gray`: locks the dictionaries whose markers were found in the last `minHits` probes
+    def probe(self, gray):
+        targets = self.probe_targets()
+        if len(targets) == 0:
+            return
+        self.probes += 1
+        hits = Counter()
+        found = {}
+        for (name, (corners, ids)) in collapse(discover(gray, list(targets), self.arucoParams)).items():
+            sized = sized_family(name)
+            family = name if sized is None else sized[0]
+            for i in set(ids[ids >= targets[name]].tolist()):
+                hits[(family, i)] = self.probeHits[(family, i)] + 1
+                found[family] = name
+        # markers missing from this probe start over
+        self.probeHits = hits
+        for (family, name) in found.items():
+            confirmed = [i for ((f, i), count) in hits.items() if f == family and count >= self.minHits]
+            if len(confirmed) > 0:
+                self.lock_on(smallest_variant(name, max(confirmed)))
+
+    # start the background re-probing, done by `detect` once the sampling phase is over
+    def start(self):
+        if self.thread is not None or self.probeInterval <= 0:
+            return
+        self.thread = threading.Thread(target=self._run, name="discovery", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        try:
+            # Linux schedules threads individually: lower the priority of this one only
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 10)
+        except (AttributeError, OSError):
+            pass
+        while not self.stopEvent.wait(self.probeInterval):
+            self.wanted.set()
+            # wait for the next frame; the stream may also have ended
+            while not self.ready.wait(0.1):
+                if self.stopEvent.is_set():
+                    return
+            self.ready.clear()
+            (gray, self.probeFrame) = (self.probeFrame, None)
+            self.probe(gray)
+
+    def close(self):
+        self.stopEvent.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
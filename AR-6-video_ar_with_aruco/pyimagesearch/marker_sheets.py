@@ -0,0 +1,111 @@
+from concurrent.futures import ProcessPoolExecutor
+from .aruco_registry import get_dictionary
+import numpy as np
+import os
+import cv2
+
+# Bulk ArUCo marker generation
+# Renders a range of IDs (or a whole dictionary) either as one file per marker or as printable tiled sheets.
+# The IDs are split into jobs that run in a pool of worker processes, and every job renders and writes its own
+# files, so nothing but the job description and the written file names crosses process boundaries.
+
+# parse an ID specification such as "0-99,120,200-249" or "all"
+# inputs:
+# 1 spec: the ID specification. Ranges are inclusive
+# 2 dictionarySize: number of markers in the dictionary, used for "all" and to validate the IDs
+def parse_ids(spec, dictionarySize):
+    if spec == "all":
+        return list(range(dictionarySize))
+
+    ids = []
+    for part in spec.split(","):
+        part = part.strip()
+        if "-" in part:
+            (start, end) = part.split("-")
+            ids.extend(range(int(start), int(end) + 1))
+        elif part != "":
+            ids.append(int(part))
+
+    invalid = [i for i in ids if i < 0 or i >= dictionarySize]
+    if len(invalid) > 0:
+        raise ValueError(f"IDs {invalid[:5]} are not valid, the dictionary only has {dictionarySize} markers")
+    return ids
+
+# render a single marker
+# inputs:
+# 1 arucoDict: OpenCV's ArUCo tag dictionary
+# 2 markerID: ID of the marker
+# 3 size: side of the marker image in pixels
+# 4 border: width of the black border, in bits
+def render_marker(arucoDict, markerID, size, border=1):
+    tag = np.zeros((size, size, 1), dtype="uint8")
+    cv2.aruco.generateImageMarker(arucoDict, markerID, size, tag, border)
+    return tag
+
+# render markers tiled on a white sheet, each with its ID printed underneath
+# inputs:
+# 1 arucoDict: OpenCV's ArUCo tag dictionary
+# 2 ids: IDs of the markers on the sheet, laid out row by row
+# 3 size: side of every marker in pixels
+# 4 cols, rows: grid of the sheet
+# 5 margin: white space around every marker in pixels. It must stay white for the markers to be detectable
+def render_sheet(arucoDict, ids, size, cols, rows, margin=40):
+    cellW = size + 2 * margin
+    cellH = size + 2 * margin
+    sheet = np.full((rows * cellH, cols * cellW), 255, dtype="uint8")
+    for (i, markerID) in enumerate(ids[:cols * rows]):
+        (row, col) = divmod(i, cols)
+        (x, y) = (col * cellW + margin, row * cellH + margin)
+        sheet[y:y + size, x:x + size] = render_marker(arucoDict, markerID, size)[:, :, 0]
+        cv2.putText(sheet, str(markerID), (x, y + size + margin // 2 + 5), cv2.FONT_HERSHEY_SIMPLEX, 0.5, 0, 1)
+    return sheet
+
+# worker job: write one file per marker
+# returns the list of written paths
+def write_markers(dictName, ids, size, outputDir, ext):
+    arucoDict = get_dictionary(dictName)
+    paths = []
+    for markerID in ids:
+        path = os.path.join(outputDir, f"{dictName}_{markerID}{ext}")
+        cv2.imwrite(path, render_marker(arucoDict, markerID, size))
+        paths.append(path)
+    return paths
+
+# worker job: write one tiled sheet
+# returns the list of written paths
+def write_sheet(dictName, ids, size, cols, rows, path):
+    arucoDict = get_dictionary(dictName)
+    cv2.imwrite(path, render_sheet(arucoDict, ids, size, cols, rows))
+    return [path]
+
+# generate many markers across a pool of worker processes, without any GUI
+# inputs:
+# 1 dictName: name of the dictionary, also used as the file name prefix
+# 2 ids: list of IDs to generate
+# 3 outputDir: directory the files are written to. It is created if needed
+# 4 size: side of every marker in pixels
+# 5 sheet: (cols, rows) to render tiled sheets, or None to write one file per marker
+# 6 workers: number of worker processes. Defaults to the number of cores
+# 7 ext: image file extension
+# returns the list of written paths
+def generate_bulk(dictName, ids, outputDir, size=300, sheet=None, workers=None, ext=".png"):
+    os.makedirs(outputDir, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        if sheet is not None:
+            (cols, rows) = sheet
+            perSheet = cols * rows
+            futures = [
+                executor.submit(write_sheet, dictName, ids[i:i + perSheet], size, cols, rows,
+                    os.path.join(outputDir, f"{dictName}_sheet_{i // perSheet:04d}{ext}"))
+                for i in range(0, len(ids), perSheet)
+            ]
+        else:
+            # a few jobs per worker keeps the pool busy without sending every ID as its own task
+            chunk = max(1, len(ids) // (workers * 4))
+            futures = [
+                executor.submit(write_markers, dictName, ids[i:i + chunk], size, outputDir, ext)
+                for i in range(0, len(ids), chunk)
+            ]
+        return [path for future in futures for path in future.result()]
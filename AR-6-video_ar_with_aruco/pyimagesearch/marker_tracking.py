@@ -0,0 +1,140 @@
+from .aruco_registry import detector_for
+import numpy as np
+import cv2
+
+# pyramidal Lucas-Kanade settings used to carry tag corners from one frame to the next
+LK_PARAMS = dict(
+    winSize=(21, 21),
+    maxLevel=3,
+    criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 30, 0.01)
+)
+
+# Tracks ArUCo markers between frames so that the full-frame detector only has to run every few frames
+# In between full detections, the four corners of every known tag are either:
+# "flow": carried forward with pyramidal optical flow (forward-backward checked), or
+# "roi": re-detected inside a padded region around the tag's last known quad
+# A full detection is forced whenever the fraction of tags that survived tracking drops below `minConfidence`
+# inputs:
+# 1 arucoDict: OpenCV's ArUCo tag dictionary
+# 2 arucoParams: the ArUCo marker detector parameters
+# 3 detectEvery: run a full-frame detection at least once every `detectEvery` frames
+# 4 mode: "flow" or "roi", how the tags are followed in between full detections
+# 5 minConfidence: fraction of tracked tags that must survive before falling back to a full detection
+# 6 maxFlowError: maximum forward-backward optical flow error, in pixels, for a tracked corner to be trusted
+# 7 roiPadding: padding around the last known quad used by the "roi" mode, as a fraction of the quad's size
+# 8 detector: optional detector (anything with ArucoDetector's `detectMarkers`, e.g. a PyramidDetector) used
+#   instead of the one built from arucoDict and arucoParams
+class MarkerTracker:
+    def __init__(self, arucoDict, arucoParams, detectEvery=10, mode="flow", minConfidence=0.75, maxFlowError=1.0, roiPadding=0.5, detector=None):
+        if mode not in ("flow", "roi"):
+            raise ValueError(f"unknown tracking mode {mode}")
+        self.detector = detector_for(arucoDict, arucoParams) if detector is None else detector
+        self.detectEvery = detectEvery
+        self.mode = mode
+        self.minConfidence = minConfidence
+        self.maxFlowError = maxFlowError
+        self.roiPadding = roiPadding
+        self.reset()
+
+    # forget everything that is currently tracked. The next call to `update` runs a full detection
+    def reset(self):
+        self.corners = np.zeros((0, 4, 2), dtype="float32") # (N, 4, 2) corners of the tracked tags
+        self.ids = np.zeros((0,), dtype="int32")             # (N,) ids of the tracked tags
+        self.prevGray = None
+        self.framesSinceDetection = 0
+        self.confidence = 0.0
+        self.fullDetections = 0
+        self.trackedFrames = 0
+
+    # locate the tags in a new frame
+    # inputs:
+    # 1 frame: the input frame from a video stream
+    # returns: the same (corners, ids) pair as cv2.aruco.detectMarkers, i.e. a tuple of (1, 4, 2) corner arrays
+    # and an (N, 1) array of ids, or None when nothing is being tracked
+    def update(self, frame):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+
+        tracked = False
+        if len(self.ids) > 0 and self.prevGray is not None and self.framesSinceDetection < self.detectEvery - 1:
+            if self.mode == "flow":
+                tracked = self._track_flow(gray)
+            else:
+                tracked = self._track_roi(gray)
+
+        if tracked:
+            self.framesSinceDetection += 1
+            self.trackedFrames += 1
+        else:
+            self._detect(gray)
+
+        self.prevGray = gray
+        return self._as_detection()
+
+    def _detect(self, gray):
+        (corners, ids, rejected) = self.detector.detectMarkers(gray)
+        if ids is None or len(ids) == 0:
+            self.corners = np.zeros((0, 4, 2), dtype="float32")
+            self.ids = np.zeros((0,), dtype="int32")
+        else:
+            self.corners = np.array(corners, dtype="float32").reshape(-1, 4, 2)
+            self.ids = ids.flatten().astype("int32")
+        self.framesSinceDetection = 0
+        self.confidence = 1.0
+        self.fullDetections += 1
+
+    # carry every corner forward with optical flow, checking each point by flowing it back again
+    # returns False when too few tags survived and a full detection is needed
+    def _track_flow(self, gray):
+        previous = self.corners.reshape(-1, 1, 2)
+        (forward, status, _) = cv2.calcOpticalFlowPyrLK(self.prevGray, gray, previous, None, **LK_PARAMS)
+        (backward, backStatus, _) = cv2.calcOpticalFlowPyrLK(gray, self.prevGray, forward, None, **LK_PARAMS)
+
+        error = np.linalg.norm(previous - backward, axis=2).reshape(-1, 4)
+        good = (status.reshape(-1, 4) == 1) & (backStatus.reshape(-1, 4) == 1) & (error < self.maxFlowError)
+        # a tag is only kept if all four of its corners were tracked
+        keep = good.all(axis=1)
+
+        self.confidence = keep.mean()
+        if self.confidence < self.minConfidence:
+            return False
+        self.corners = forward.reshape(-1, 4, 2)[keep]
+        self.ids = self.ids[keep]
+        return True
+
+    # re-detect each tag only inside a padded window around its last known quad
+    # returns False when too few tags were found again and a full detection is needed
+    def _track_roi(self, gray):
+        (frameH, frameW) = gray.shape[:2]
+        found = {}
+
+        for (quad, markerID) in zip(self.corners, self.ids):
+            (x0, y0) = quad.min(axis=0)
+            (x1, y1) = quad.max(axis=0)
+            padX = (x1 - x0) * self.roiPadding
+            padY = (y1 - y0) * self.roiPadding
+            x0 = max(int(x0 - padX), 0)
+            y0 = max(int(y0 - padY), 0)
+            x1 = min(int(np.ceil(x1 + padX)), frameW)
+            y1 = min(int(np.ceil(y1 + padY)), frameH)
+            if x1 <= x0 or y1 <= y0:
+                continue
+
+            (corners, ids, rejected) = self.detector.detectMarkers(gray[y0:y1, x0:x1])
+            if ids is None:
+                continue
+            for (corner, i) in zip(corners, ids.flatten()):
+                if i == markerID:
+                    found[int(i)] = corner.reshape(4, 2) + (x0, y0)
+
+        self.confidence = len(found) / len(self.ids)
+        if self.confidence < self.minConfidence:
+            return False
+        self.ids = np.array(list(found.keys()), dtype="int32")
+        self.corners = np.array(list(found.values()), dtype="float32").reshape(-1, 4, 2)
+        return True
+
+    def _as_detection(self):
+        if len(self.ids) == 0:
+            return ((), None)
+        corners = tuple(c.reshape(1, 4, 2) for c in self.corners)
+        return (corners, self.ids.reshape(-1, 1))
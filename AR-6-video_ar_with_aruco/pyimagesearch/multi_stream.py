@@ -0,0 +1,182 @@
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from collections import deque
+from .stream_session import session_from_spec
+import threading
+import os
+import cv2
+
+# Runs the video AR loop for many cameras at once
+# Every camera is an ARStream with its own StreamSession, so streams never share a reference point cache, detector
+# or buffers. A MultiStreamRunner steps the streams on a thread pool: OpenCV releases the GIL while it decodes,
+# detects and warps, so one process can keep several cores busy. Scheduling is round robin with at most one frame
+# per stream in flight -- a stream that just produced a frame goes to the back of the line, so a fast camera
+# cannot starve a slow one. For more cameras than one process can handle, `run_processes` shards the streams over
+# worker processes that each run their own threaded runner.
+
+# one camera, the source video warped onto it and (optionally) the file its output is written to
+# The source video only advances when the warp succeeded, exactly like the single-camera loop of opencv_ar_video.py
+# inputs:
+# 1 name: name of the stream, used in reports
+# 2 camera: cv2.VideoCapture (or anything with the same `read()`) of the camera
+# 3 source: cv2.VideoCapture of the video that is warped onto the camera frames
+# 4 session: the StreamSession of this stream
+# 5 output: path of the output video, "" to not save it. The writer is opened with the size of the first frame
+# 6 fps: frame rate of the output video
+# 7 sourceQueueSize: number of decoded source frames kept ahead
+class ARStream:
+    def __init__(self, name, camera, source, session, output="", fps=30.0, sourceQueueSize=128):
+        self.name = name
+        self.camera = camera
+        self.sourceCapture = source
+        self.session = session
+        self.output = output
+        self.fps = fps
+        self.writer = None
+        self.sourceQueue = deque(maxlen=sourceQueueSize)
+        self.source = None
+        self.frames = 0
+        self.warped = 0
+        self.done = False
+
+    def _read_source(self):
+        (grabbed, frame) = self.sourceCapture.read()
+        if grabbed:
+            self.sourceQueue.append(frame)
+
+    # process the next camera frame
+    # returns: the output frame, or None once the camera or the source video ran out
+    def step(self):
+        if self.done:
+            return None
+        if self.source is None:
+            (grabbed, self.source) = self.sourceCapture.read()
+            if not grabbed:
+                self.done = True
+                return None
+
+        (grabbed, frame) = self.camera.read()
+        if not grabbed or frame is None:
+            self.done = True
+            return None
+
+        # keep decoding ahead while the queue has room
+        if len(self.sourceQueue) != self.sourceQueue.maxlen:
+            self._read_source()
+
+        with self.session.stats.stage("frame"):
+            warped = self.session.warp(frame, self.source)
+        if warped is not None: # the warp was successful
+            frame = warped
+            self.warped += 1
+            if len(self.sourceQueue) > 0:
+                self.source = self.sourceQueue.popleft()
+            else:
+                # the source video ran out: this was the last frame
+                self.done = True
+        else:
+            self.session.stats.count("source_held")
+        self.session.stats.frame_done()
+
+        if self.output != "":
+            if self.writer is None:
+                (h, w) = frame.shape[:2]
+                self.writer = cv2.VideoWriter(self.output, cv2.VideoWriter_fourcc(*"MP4V"), self.fps, (w, h))
+            self.writer.write(frame)
+        self.frames += 1
+        return frame
+
+    def close(self):
+        self.camera.release()
+        self.sourceCapture.release()
+        if self.writer is not None:
+            self.writer.release()
+
+    # summary of the stream, JSON-serializable
+    def report(self):
+        report = {"name": self.name, "frames": self.frames, "warped": self.warped}
+        if self.session.stats.enabled:
+            report["stats"] = self.session.stats.snapshot()
+        return report
+
+# steps many ARStreams concurrently on a thread pool
+# inputs:
+# 1 streams: list of ARStream
+# 2 workers: number of threads. Defaults to one per stream, capped at the number of CPUs
+# 3 onFrame: optional function called as onFrame(stream, frame) with every output frame, from the thread that
+#   called `run`. Useful to display the streams, since GUI calls have to stay on one thread
+class MultiStreamRunner:
+    def __init__(self, streams, workers=None, onFrame=None):
+        self.streams = streams
+        self.workers = workers if workers is not None else max(min(len(streams), os.cpu_count() or 1), 1)
+        self.onFrame = onFrame
+
+    # run until every stream ran out or `stopEvent` is set. Every stream is closed on the way out, also when a
+    # step raised
+    # returns: the report of every stream
+    def run(self, stopEvent=None):
+        stopEvent = threading.Event() if stopEvent is None else stopEvent
+        ready = deque(self.streams) # round robin: streams wait here for their next turn
+        pending = {}                # future -> stream, at most one per stream
+        try:
+            # leaving the executor waits for the frames that are still being processed, so no stream is closed
+            # while one of its steps is running
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                while (len(ready) > 0 or len(pending) > 0) and not stopEvent.is_set():
+                    while len(ready) > 0 and len(pending) < self.workers:
+                        stream = ready.popleft()
+                        pending[executor.submit(stream.step)] = stream
+
+                    (done, _) = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        stream = pending.pop(future)
+                        frame = future.result()
+                        if frame is None:
+                            continue
+                        if self.onFrame is not None:
+                            self.onFrame(stream, frame)
+                        ready.append(stream)
+        finally:
+            for stream in self.streams:
+                stream.close()
+        return [stream.report() for stream in self.streams]
+
+# open a stream from a picklable description, so that streams can be built inside worker processes
+# inputs:
+# 1 spec: dict with
+#   "name": name of the stream
+#   "camera": camera index or path/URL of the camera stream
+#   "input": path of the source video
+#   "output": path of the output video, optional
+#   and the session settings understood by `session_from_spec`
+def open_stream(spec):
+    session = session_from_spec(spec)
+    camera = spec["camera"]
+    if isinstance(camera, str) and camera.isdigit():
+        camera = int(camera)
+    return ARStream(spec.get("name", str(spec["camera"])), cv2.VideoCapture(camera), cv2.VideoCapture(spec["input"]), session, output=spec.get("output", ""))
+
+# worker process: run a shard of the streams with a threaded runner
+def run_shard(specs, workers=None):
+    # the threads of this process already use the cores assigned to it
+    cv2.setNumThreads(1)
+    return MultiStreamRunner([open_stream(spec) for spec in specs], workers=workers).run()
+
+# run streams in several worker processes
+# Streams are dealt out to the processes round robin, so every process gets the same number of cameras (+-1)
+# inputs:
+# 1 specs: list of stream descriptions, see `open_stream`
+# 2 processes: number of worker processes
+# 3 workers: number of threads per process. Defaults to one per stream of the process
+# returns: the report of every stream, in the order of `specs`
+def run_processes(specs, processes, workers=None):
+    processes = max(min(processes, len(specs)), 1)
+    shards = [specs[i::processes] for i in range(processes)]
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        results = list(executor.map(run_shard, shards, [workers] * processes))
+
+    # undo the round robin dealing
+    reports = [None] * len(specs)
+    for (i, shard) in enumerate(results):
+        for (k, report) in enumerate(shard):
+            reports[i + k * processes] = report
+    return reports
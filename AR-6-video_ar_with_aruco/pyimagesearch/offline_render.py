@@ -0,0 +1,177 @@
+from concurrent.futures import ProcessPoolExecutor
+from .stream_session import session_from_spec
+from .detection_log import DetectionLog
+import tempfile
+import shutil
+import os
+import cv2
+
+# Renders the video AR effect from a recorded video to a file, as fast as the CPU allows
+# The recorded video is cut into time segments that are rendered by separate worker processes and stitched back
+# together in order. Every worker starts `overlap` frames before its segment and runs those frames through its
+# session without writing them, so the reference point cache and the tag tracker are warm when the segment starts.
+#
+# Unlike the live loop, the source video does not pause while the tags are hidden: source frame k is shown on the
+# recorded frame taken at the same time. With pausing, where the source is at any frame depends on every frame
+# before it, and the segments could not be rendered independently.
+
+# fourccs tried, in order, for the intermediate segment files. HuffYUV is lossless and fast, so stitching does not
+# add a second generation of compression artifacts; Motion JPEG is the fallback available in every OpenCV build
+SEGMENT_FOURCCS = ("HFYU", "MJPG")
+
+# split `frameCount` frames into segments
+# inputs:
+# 1 frameCount: number of frames to render
+# 2 segments: number of segments
+# 3 overlap: number of warm-up frames rendered (and thrown away) before every segment but the first
+# returns: list of (warmStart, start, end) frame indexes, `end` exclusive
+def plan_segments(frameCount, segments, overlap):
+    segments = max(min(segments, frameCount), 1)
+    bounds = [round(i * frameCount / segments) for i in range(segments + 1)]
+    return [(max(bounds[i] - overlap, 0), bounds[i], bounds[i + 1]) for i in range(segments)]
+
+# move a capture to frame `index`
+# Frame-accurate seeking is not guaranteed by every backend, so the position is checked and, when the seek
+# missed, the capture is reopened and the frames are skipped with grab() instead
+def seek(capture, path, index):
+    if index == 0:
+        return capture
+    capture.set(cv2.CAP_PROP_POS_FRAMES, index)
+    if int(capture.get(cv2.CAP_PROP_POS_FRAMES)) == index:
+        return capture
+    capture.release()
+    capture = cv2.VideoCapture(path)
+    for _ in range(index):
+        capture.grab()
+    return capture
+
+# open the writer of a segment file with the first fourcc of SEGMENT_FOURCCS this OpenCV build can encode
+def open_segment_writer(path, fps, size):
+    for fourcc in SEGMENT_FOURCCS:
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*fourcc), fps, size)
+        if writer.isOpened():
+            return writer
+    raise RuntimeError(f"could not open a video writer for {path}")
+
+# worker process: render one segment
+# inputs:
+# 1 job: dict with
+#   "video": path of the recorded video, "input": path of the source video
+#   "segment": (warmStart, start, end) from `plan_segments`
+#   "ratio": source frames per recorded frame (source fps / recorded fps), "sourceFrames": length of the source
+#   "path": path of the segment file to write, "fps": its frame rate
+#   "replay": optional path of a DetectionLog of the recorded video. Its detections are used instead of running
+#   the detector, so only the compositing is left to do
+#   and the session settings understood by `session_from_spec`
+# returns: (path, frames written, frames warped)
+def render_segment(job):
+    # this process already has its own core
+    cv2.setNumThreads(1)
+    (warmStart, start, end) = job["segment"]
+    session = session_from_spec(job)
+    log = DetectionLog(job["replay"]) if job.get("replay") else None
+    video = seek(cv2.VideoCapture(job["video"]), job["video"], warmStart)
+    # once the source video ran out, its last frame stays up
+    firstSource = max(min(int(warmStart * job["ratio"]), job["sourceFrames"] - 1), 0)
+    source = seek(cv2.VideoCapture(job["input"]), job["input"], firstSource)
+    (grabbed, sourceFrame) = source.read()
+    sourceIndex = firstSource
+
+    writer = None
+    (written, warped) = (0, 0)
+    index = warmStart
+    while index < end:
+        (grabbed, frame) = video.read()
+        if not grabbed:
+            break
+        # advance the source to the frame shown at this time
+        target = int(index * job["ratio"])
+        while sourceIndex < target:
+            (grabbed, nextFrame) = source.read()
+            if not grabbed:
+                break
+            (sourceFrame, sourceIndex) = (nextFrame, sourceIndex + 1)
+
+        detections = log.markers(index) if log is not None else None
+        result = session.warp(frame, sourceFrame, detections) if sourceFrame is not None else None
+        index += 1
+        if index <= start:
+            # warm-up frame: only primes the cache and the tracker
+            continue
+        if result is not None:
+            frame = result
+            warped += 1
+        if writer is None:
+            (h, w) = frame.shape[:2]
+            writer = open_segment_writer(job["path"], job["fps"], (w, h))
+        writer.write(frame)
+        written += 1
+
+    video.release()
+    source.release()
+    if writer is not None:
+        writer.release()
+    return (job["path"], written, warped)
+
+# render a recorded video
+# inputs:
+# 1 video: path of the recorded (camera) video
+# 2 input: path of the source video warped onto it
+# 3 output: path of the output video
+# 4 workers: number of worker processes
+# 5 segments: number of segments, defaults to `workers`
+# 6 overlap: number of warm-up frames before every segment
+# 7 settings: session settings understood by `session_from_spec`, plus "replay" (see render_segment)
+# 8 fourcc: fourcc of the output video
+# returns: (frames written, frames warped)
+def render_offline(video, input, output, workers=None, segments=None, overlap=30, settings=None, fourcc="MP4V"):
+    workers = workers if workers is not None else os.cpu_count() or 1
+    segments = segments if segments is not None else workers
+    settings = {} if settings is None else settings
+
+    capture = cv2.VideoCapture(video)
+    frameCount = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+    capture.release()
+    sourceCapture = cv2.VideoCapture(input)
+    sourceFps = sourceCapture.get(cv2.CAP_PROP_FPS) or fps
+    sourceFrames = int(sourceCapture.get(cv2.CAP_PROP_FRAME_COUNT))
+    sourceCapture.release()
+    if frameCount <= 0:
+        raise ValueError(f"could not read the frame count of {video}")
+
+    tmpDir = tempfile.mkdtemp(prefix="ar_segments_")
+    try:
+        plan = plan_segments(frameCount, segments, overlap)
+        jobs = []
+        for (i, segment) in enumerate(plan):
+            job = dict(settings)
+            job.update({"video": video, "input": input, "segment": segment, "ratio": sourceFps / fps, "sourceFrames": sourceFrames, "fps": fps, "path": os.path.join(tmpDir, f"segment{i:04d}.avi")})
+            # the frame count is an estimate for some containers: the last segment reads to the end of the file
+            if i == len(plan) - 1:
+                job["segment"] = (segment[0], segment[1], float("inf"))
+            jobs.append(job)
+
+        # stitch the segments in order while the later ones are still being rendered
+        (written, warped) = (0, 0)
+        writer = None
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for (path, segmentWritten, segmentWarped) in executor.map(render_segment, jobs):
+                written += segmentWritten
+                warped += segmentWarped
+                segment = cv2.VideoCapture(path)
+                while True:
+                    (grabbed, frame) = segment.read()
+                    if not grabbed:
+                        break
+                    if writer is None:
+                        (h, w) = frame.shape[:2]
+                        writer = cv2.VideoWriter(output, cv2.VideoWriter_fourcc(*fourcc), fps, (w, h))
+                    writer.write(frame)
+                segment.release()
+                os.remove(path)
+        if writer is not None:
+            writer.release()
+        return (written, warped)
+    finally:
+        shutil.rmtree(tmpDir, ignore_errors=True)
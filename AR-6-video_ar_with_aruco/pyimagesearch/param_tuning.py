@@ -0,0 +1,160 @@
+from .aruco_registry import get_dictionary, make_parameters, PROFILE_DIR
+from .synthetic import synthesize_frame, match_detections
+import numpy as np
+import json
+import time
+import os
+import cv2
+
+# DetectorParameters auto-tuning
+# The default DetectorParameters sweep the adaptive threshold over windows of 3, 13 and 23 pixels and accept
+# markers down to 3% of the frame's perimeter, which costs a full threshold + contour pass per window and a lot
+# of candidate quads on cluttered frames. The tuner searches for the fastest parameter set that still detects a
+# frame set with a given recall and corner error, and saves it as a named profile that get_parameters,
+# get_detector and the scripts' --profile flag load by name.
+
+# candidate values of the searched parameters. The defaults of DetectorParameters are among them
+SEARCH_SPACE = {
+    "adaptiveThreshWinSizeMin": [3, 5, 7, 11],
+    "adaptiveThreshWinSizeMax": [7, 11, 15, 23, 31],
+    "adaptiveThreshWinSizeStep": [4, 6, 10, 20],
+    "minMarkerPerimeterRate": [0.01, 0.02, 0.03, 0.05, 0.08, 0.12],
+    "polygonalApproxAccuracyRate": [0.03, 0.05, 0.08],
+    "perspectiveRemovePixelPerCell": [2, 3, 4, 6],
+    "cornerRefinementMethod": [cv2.aruco.CORNER_REFINE_NONE, cv2.aruco.CORNER_REFINE_SUBPIX],
+}
+
+# whether a parameter set is usable: OpenCV rejects windows under 3 pixels and a maximum below the minimum
+def is_valid(params):
+    params = dict(params)
+    winMin = params.get("adaptiveThreshWinSizeMin", 3)
+    winMax = params.get("adaptiveThreshWinSizeMax", 23)
+    return winMin >= 3 and winMax >= winMin
+
+# synthetic, labelled frame set
+# inputs:
+# 1 count: number of frames
+# 2 size: (width, height)
+# 3 dictName: dictionary of the markers
+# 4 ids: marker ids placed on every frame
+# 5 seed, blur, noise, scale: see synthesize_frame
+# returns: list of (frame, truth)
+def synthetic_frames(count, size, dictName, ids, seed=0, blur=0.0, noise=0.0, scale=(0.08, 0.15)):
+    rng = np.random.default_rng(seed)
+    markers = [(dictName, i) for i in ids]
+    return [synthesize_frame(size, markers, rng=rng, blur=blur, noise=noise, scale=scale) for _ in range(count)]
+
+# labelled frame set from a JSON lines file in the format of batch_detection.JSONLWriter, e.g. reference
+# detections made with the default parameters and checked by hand
+# returns: list of (frame, truth), images that cannot be read are skipped
+def labelled_frames(path, dictName):
+    frames = []
+    with open(path) as f:
+        for line in f:
+            if line.strip() == "":
+                continue
+            record = json.loads(line)
+            image = cv2.imread(record["image"])
+            if image is None or record["ids"] is None:
+                continue
+            truth = [{"dictionary": dictName, "id": i, "corners": np.array(c, dtype="float32")} for (i, c) in zip(record["ids"], record["corners"])]
+            frames.append((image, truth))
+    return frames
+
+# time and score a parameter set on a frame set
+# inputs:
+# 1 params: dict of DetectorParameters overrides
+# 2 frames: list of (frame, truth)
+# 3 dictName: dictionary to detect
+# 4 repeat: the frame set is timed this many times and the fastest pass is kept, which filters out scheduling noise
+# returns: dict with "ms_per_frame", "recall" and "corner_error_px" (mean of the worst corner of every found marker)
+def evaluate(params, frames, dictName, repeat=2):
+    detector = cv2.aruco.ArucoDetector(get_dictionary(dictName), make_parameters(params))
+    # grayscale once, outside of the timing: every configuration gets the same input
+    grays = [cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame for (frame, _) in frames]
+    best = float("inf")
+    for _ in range(repeat):
+        results = []
+        start = time.perf_counter()
+        for gray in grays:
+            results.append(detector.detectMarkers(gray))
+        best = min(best, time.perf_counter() - start)
+
+    (found, expected, errors) = (0, 0, [])
+    for ((corners, ids, rejected), (_, truth)) in zip(results, frames):
+        (f, e, err) = match_detections(corners, ids, truth, dictName)
+        found += f
+        expected += e
+        errors += err
+    return {
+        "ms_per_frame": 1000.0 * best / max(len(frames), 1),
+        "recall": found / max(expected, 1),
+        "corner_error_px": float(np.mean(errors)) if errors else float("inf")
+    }
+
+# search for the fastest parameter set meeting an accuracy floor
+# Coordinate descent from the defaults: every value of every parameter is tried on top of the best set so far
+# and kept when it meets the floor and is faster by at least `minGain`. Rounds repeat until none improves.
+# inputs:
+# 1 frames: list of (frame, truth)
+# 2 dictName: dictionary to detect
+# 3 minRecall: lowest acceptable recall
+# 4 maxCornerError: highest acceptable mean corner error, in pixels
+# 5 space: the search space, SEARCH_SPACE by default
+# 6 rounds: maximum number of passes over the parameters
+# 7 minGain: relative speedup a change must bring to be kept
+# 8 callback: optional function called with (params, metrics, accepted) after every evaluation
+# returns: (best params, best metrics, baseline metrics of the defaults)
+def tune(frames, dictName, minRecall=0.98, maxCornerError=1.0, space=None, rounds=3, minGain=0.03, callback=None):
+    space = SEARCH_SPACE if space is None else space
+    feasible = lambda m: m["recall"] >= minRecall and m["corner_error_px"] <= maxCornerError
+
+    baseline = evaluate({}, frames, dictName)
+    (best, bestMetrics) = ({}, baseline)
+    if not feasible(baseline):
+        # the defaults miss the floor themselves: take the first feasible set found, whatever its speed
+        bestMetrics = dict(baseline, ms_per_frame=float("inf"))
+    seen = {()}
+    for _ in range(rounds):
+        improved = False
+        for (name, values) in space.items():
+            for value in values:
+                candidate = dict(best)
+                candidate[name] = value
+                key = tuple(sorted(candidate.items()))
+                if key in seen or not is_valid(candidate):
+                    continue
+                seen.add(key)
+                metrics = evaluate(candidate, frames, dictName)
+                accepted = feasible(metrics) and metrics["ms_per_frame"] < bestMetrics["ms_per_frame"] * (1.0 - minGain)
+                if callback is not None:
+                    callback(candidate, metrics, accepted)
+                if accepted:
+                    (best, bestMetrics, improved) = (candidate, metrics, True)
+        if not improved:
+            break
+
+    # drop overrides that are equal to the defaults, so the profile only lists what was changed
+    defaults = make_parameters()
+    best = {k: v for (k, v) in best.items() if getattr(defaults, k) != v}
+    # time the winner and the defaults again, back to back, for a fair comparison
+    return (best, evaluate(best, frames, dictName, repeat=3), evaluate({}, frames, dictName, repeat=3))
+
+# write a profile that aruco_registry.load_profile (and so get_parameters / get_detector) can load by name
+# inputs:
+# 1 name: name of the profile
+# 2 dictName: dictionary it was tuned for
+# 3 params: the DetectorParameters overrides
+# 4 metrics, baseline: evaluation results of the profile and of the defaults
+# 5 path: where to write it, PROFILE_DIR/<name>.json by default
+# 6 settings: optional description of the frame set and accuracy floor, kept for reference
+# returns: the path written
+def save_profile(name, dictName, params, metrics, baseline, path=None, settings=None):
+    path = os.path.join(PROFILE_DIR, f"{name}.json") if path is None else path
+    directory = os.path.dirname(path)
+    if directory != "":
+        os.makedirs(directory, exist_ok=True)
+    profile = {"name": name, "dictionary": dictName, "parameters": params, "metrics": metrics, "baseline": baseline, "settings": settings or {}}
+    with open(path, "w") as f:
+        json.dump(profile, f, indent=2)
+    return path
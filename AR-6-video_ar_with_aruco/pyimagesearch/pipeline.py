@@ -0,0 +1,160 @@
+from .instrumentation import NULL_STATS
+from queue import Empty, Full
+import threading
+import time
+
+# Building blocks for running the video AR loop as a staged pipeline
+# Each stage runs in its own thread and talks to its neighbours through bounded queues: a stage that gets ahead
+# blocks on a full queue (backpressure) instead of buffering without limit. OpenCV releases the GIL while it
+# decodes, detects, warps and encodes, so the stages actually run in parallel on separate cores.
+
+# put on a queue to tell the next stage that no more items are coming
+STOP = object()
+
+# how often a blocked stage wakes up to check whether the pipeline is shutting down, in seconds
+POLL_INTERVAL = 0.1
+
+# base class of every stage
+# inputs:
+# 1 name: thread name, useful when debugging
+# 2 stopEvent: threading.Event shared by every stage of the pipeline. Setting it shuts the whole pipeline down
+class Stage(threading.Thread):
+    def __init__(self, name, stopEvent):
+        super().__init__(name=name, daemon=True)
+        self.stopEvent = stopEvent
+
+    # blocking put that gives up when the pipeline is stopped
+    # returns False if the item was not queued
+    def put(self, queue, item):
+        while not self.stopEvent.is_set():
+            try:
+                queue.put(item, timeout=POLL_INTERVAL)
+                return True
+            except Full:
+                pass
+        return False
+
+    # blocking get that returns STOP when the pipeline is stopped
+    def get(self, queue):
+        while not self.stopEvent.is_set():
+            try:
+                return queue.get(timeout=POLL_INTERVAL)
+            except Empty:
+                pass
+        return STOP
+
+    # tell the next stages that no more items are coming. Uses a non-blocking put so that a stage can always exit
+    def finish(self, *queues):
+        for queue in queues:
+            try:
+                queue.put_nowait(STOP)
+            except Full:
+                self.stopEvent.set()
+
+# decodes a video file into a queue, e.g. the source video that is warped onto the camera frames
+# inputs:
+# 1 capture: cv2.VideoCapture of the video
+# 2 outQueue: bounded queue of decoded frames. STOP is queued at the end of the video
+class DecodeStage(Stage):
+    def __init__(self, capture, outQueue, stopEvent):
+        super().__init__("decode", stopEvent)
+        self.capture = capture
+        self.outQueue = outQueue
+
+    def run(self):
+        while not self.stopEvent.is_set():
+            (grabbed, frame) = self.capture.read()
+            if not grabbed or not self.put(self.outQueue, frame):
+                break
+        self.finish(self.outQueue)
+
+# reads frames from a live stream (anything with a `read()` method, e.g. imutils' VideoStream) into a queue
+# inputs:
+# 1 stream: the video stream
+# 2 outQueue: bounded queue of captured frames
+class CaptureStage(Stage):
+    def __init__(self, stream, outQueue, stopEvent):
+        super().__init__("capture", stopEvent)
+        self.stream = stream
+        self.outQueue = outQueue
+
+    def run(self):
+        last = None
+        while not self.stopEvent.is_set():
+            frame = self.stream.read()
+            if frame is None:
+                break
+            if frame is last:
+                # threaded streams (imutils' VideoStream) hand out the same frame until the camera delivers the
+                # next one. Queuing it again would warp it twice, the second time onto an already composited frame
+                time.sleep(0.001)
+                continue
+            last = frame
+            if not self.put(self.outQueue, frame):
+                break
+        self.finish(self.outQueue)
+
+# warps the current source frame onto every captured frame
+# Like the single-threaded loop, the source video only advances when the warp succeeded, so it is "paused"
+# while the tags are not visible. The stage stops once the source video runs out.
+# inputs:
+# 1 frameQueue: queue of captured frames
+# 2 sourceQueue: queue of decoded source frames
+# 3 outQueues: queues that receive every output frame, e.g. one for display and one for the writer
+# 4 warp: function (frame, source) -> warped frame or None, e.g. a partial of find_and_warp
+# 5 stats: optional StageStats. Every frame is timed as the "frame" stage and frames shown without advancing
+#   the source are counted as "source_held"
+class WarpStage(Stage):
+    def __init__(self, frameQueue, sourceQueue, outQueues, warp, stopEvent, stats=None):
+        super().__init__("warp", stopEvent)
+        self.frameQueue = frameQueue
+        self.sourceQueue = sourceQueue
+        self.outQueues = outQueues
+        self.warp = warp
+        self.stats = NULL_STATS if stats is None else stats
+
+    def run(self):
+        source = self.get(self.sourceQueue)
+        while source is not STOP:
+            frame = self.get(self.frameQueue)
+            if frame is STOP:
+                break
+
+            with self.stats.stage("frame"):
+                warped = self.warp(frame, source)
+            if warped is not None: # the warp was successful
+                frame = warped
+                source = self.get(self.sourceQueue)
+            else:
+                self.stats.count("source_held")
+            self.stats.frame_done()
+
+            for queue in self.outQueues:
+                if not self.put(queue, frame):
+                    break
+        self.finish(*self.outQueues)
+
+# encodes output frames with a cv2.VideoWriter
+# inputs:
+# 1 writer: the cv2.VideoWriter
+# 2 inQueue: queue of frames to encode
+class WriterStage(Stage):
+    def __init__(self, writer, inQueue, stopEvent):
+        super().__init__("writer", stopEvent)
+        self.writer = writer
+        self.inQueue = inQueue
+
+    def run(self):
+        # keep draining after a stop request so that every frame that was produced ends up in the file
+        while True:
+            frame = self.get(self.inQueue)
+            if frame is STOP:
+                break
+            self.writer.write(frame)
+        while True:
+            try:
+                frame = self.inQueue.get_nowait()
+            except Empty:
+                break
+            if frame is not STOP:
+                self.writer.write(frame)
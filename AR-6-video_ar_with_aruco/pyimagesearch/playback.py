@@ -0,0 +1,218 @@
+from .instrumentation import NULL_STATS
+from .pipeline import Stage, STOP
+from queue import Empty, Full
+import time
+import cv2
+
+# Timestamp-driven playback of the source video
+# The original loops advance the source video by one frame per successfully warped camera frame, so it plays at
+# whatever rate the camera loop manages: a slow frame means a slow-motion overlay and a growing source backlog.
+# Here the source is presented by its container timestamps against a monotonic clock instead:
+# - SourceScheduler hands out the source frame due at the current time. Frames that are already late by the time
+#   they would be shown are only grabbed (demuxed, but never converted or copied) and skipped, so falling behind
+#   costs less, not more
+# - camera frames are stamped when captured. The capture side never blocks on a full queue: it replaces the
+#   oldest frame. The warp side drops a frame older than the latency budget whenever a newer one is already
+#   waiting, so the capture-to-output latency stays bounded by the budget plus one frame of processing
+# Counters reported to the StageStats: "source_late" (source frames skipped), "camera_dropped" (camera frames
+# dropped) and "source_held" (frames the tags were not found in, the source is paused meanwhile). The
+# capture-to-output latency of every frame is recorded as the "latency" stage.
+
+# frame rate assumed for sources that do not report one
+DEFAULT_FPS = 30.0
+
+# presents the frames of a source by their timestamps
+# Like the original loops, the source is "paused" while the tags are not visible: see pause and resume.
+# inputs:
+# 1 capture: cv2.VideoCapture of the source, or anything with grab, retrieve and get (e.g. a SourcePlayer)
+# 2 fps: frame rate used when the capture reports no timestamps. Defaults to the capture's CAP_PROP_FPS
+# 3 rate: playback speed, 1.0 for real time
+# 4 clock: function returning the time in seconds, time.monotonic by default
+# 5 stats: optional StageStats, counts "source_late"
+class SourceScheduler:
+    def __init__(self, capture, fps=None, rate=1.0, clock=time.monotonic, stats=None):
+        self.capture = capture
+        if fps is None:
+            fps = capture.get(cv2.CAP_PROP_FPS) if hasattr(capture, "get") else 0
+        self.fps = fps if fps and fps > 0 else DEFAULT_FPS
+        self.rate = rate
+        self.clock = clock
+        self.stats = NULL_STATS if stats is None else stats
+        self.mediaTime = 0.0 # seconds of source played so far
+        self.lastTick = None
+        self.playing = True
+        self.frame = None
+        self.frameTime = None # timestamp of `frame`, relative to the first frame
+        self.nextTime = 0.0   # when the frame after `frame` is due
+        self.origin = None    # timestamp of the first frame
+        self.grabbed = 0
+        self.presented = 0
+        self.late = 0
+        self.ended = False
+
+    # advance the media clock to now
+    def tick(self):
+        now = self.clock()
+        if self.lastTick is not None and self.playing:
+            self.mediaTime += (now - self.lastTick) * self.rate
+        self.lastTick = now
+
+    # stop the media clock, e.g. when the tags are not visible
+    def pause(self):
+        self.tick()
+        self.playing = False
+
+    def resume(self):
+        self.tick()
+        self.playing = True
+
+    # container timestamp of the frame grabbed last, in seconds. Captures that report none (0 past the first
+    # frame) are timed by frame count
+    def timestamp(self):
+        t = self.capture.get(cv2.CAP_PROP_POS_MSEC) / 1000.0 if hasattr(self.capture, "get") else 0.0
+        if t <= 0.0 and self.grabbed > 1:
+            t = (self.grabbed - 1) / self.fps
+        return t
+
+    # the source frame due now
+    # returns: (True, frame) like cv2.VideoCapture.read(), (False, None) once the source ran out. The frame is
+    # the same object until the next one is due; it must not be modified
+    def read(self):
+        self.tick()
+        (pending, skipped) = (False, 0)
+        while self.frame is None or self.nextTime <= self.mediaTime:
+            if not self.capture.grab():
+                self.ended = True
+                break
+            self.grabbed += 1
+            if pending:
+                # the frame grabbed before this one was never shown
+                skipped += 1
+            pending = True
+            t = self.timestamp()
+            if self.origin is None:
+                self.origin = t
+            self.frameTime = t - self.origin
+            # the next frame's timestamp is only known once it is grabbed: assume a constant frame rate
+            self.nextTime = self.frameTime + 1.0 / self.fps
+            if self.frame is None:
+                break
+        if skipped > 0:
+            self.late += skipped
+            self.stats.count("source_late", skipped)
+        if pending:
+            (retrieved, frame) = self.capture.retrieve()
+            if retrieved:
+                self.frame = frame
+                self.presented += 1
+        if self.frame is None or (self.ended and self.mediaTime >= self.nextTime):
+            return (False, None)
+        return (True, self.frame)
+
+    def release(self):
+        self.capture.release()
+
+# queue a frame without ever blocking: when the queue is full, its oldest item is dropped to make room
+# returns: the number of items dropped
+def put_latest(queue, item):
+    dropped = 0
+    while True:
+        try:
+            queue.put_nowait(item)
+            return dropped
+        except Full:
+            try:
+                queue.get_nowait()
+                dropped += 1
+            except Empty:
+                pass
+
+# reads frames from a live stream into a queue, as (capture time, frame) pairs
+# Unlike CaptureStage it never waits for the next stage: when the queue is full the oldest frame is dropped, so
+# the queue always holds the most recent frames.
+# inputs:
+# 1 stream: the video stream, anything with a `read()` method
+# 2 outQueue: bounded queue of (capture time, frame)
+# 3 clock: the clock of the timestamps, the same one as the SourceScheduler's
+# 4 stats: optional StageStats, counts "camera_dropped"
+class TimedCaptureStage(Stage):
+    def __init__(self, stream, outQueue, stopEvent, clock=time.monotonic, stats=None):
+        super().__init__("capture", stopEvent)
+        self.stream = stream
+        self.outQueue = outQueue
+        self.clock = clock
+        self.stats = NULL_STATS if stats is None else stats
+
+    def run(self):
+        last = None
+        while not self.stopEvent.is_set():
+            frame = self.stream.read()
+            if frame is None:
+                break
+            if frame is last:
+                # threaded streams (imutils' VideoStream) hand out the same frame until the camera delivers the
+                # next one
+                time.sleep(0.001)
+                continue
+            last = frame
+            dropped = put_latest(self.outQueue, (self.clock(), frame))
+            if dropped > 0:
+                self.stats.count("camera_dropped", dropped)
+        self.finish(self.outQueue)
+
+# warps the scheduled source frame onto every fresh camera frame
+# inputs:
+# 1 frameQueue: queue of (capture time, frame), e.g. from a TimedCaptureStage
+# 2 scheduler: the SourceScheduler of the source video
+# 3 outQueues: queues that receive every output frame
+# 4 warp: function (frame, source) -> warped frame or None, e.g. a partial of find_and_warp
+# 5 budget: capture-to-output latency budget, in seconds. An older frame is dropped when a newer one is waiting
+# 6 stats: optional StageStats
+class ScheduledWarpStage(Stage):
+    def __init__(self, frameQueue, scheduler, outQueues, warp, stopEvent, budget=0.1, stats=None):
+        super().__init__("warp", stopEvent)
+        self.frameQueue = frameQueue
+        self.scheduler = scheduler
+        self.outQueues = outQueues
+        self.warp = warp
+        self.budget = budget
+        self.stats = NULL_STATS if stats is None else stats
+
+    # the next frame worth processing: stale frames are skipped as long as a newer one is queued
+    # returns: (capture time, frame) or STOP
+    def fresh(self):
+        item = self.get(self.frameQueue)
+        while item is not STOP and self.scheduler.clock() - item[0] > self.budget:
+            try:
+                newer = self.frameQueue.get_nowait()
+            except Empty:
+                break
+            self.stats.count("camera_dropped")
+            item = newer
+        return item
+
+    def run(self):
+        while not self.stopEvent.is_set():
+            item = self.fresh()
+            if item is STOP:
+                break
+            (captured, frame) = item
+            (available, source) = self.scheduler.read()
+            if not available:
+                break
+
+            with self.stats.stage("frame"):
+                warped = self.warp(frame, source)
+            if warped is not None:
+                frame = warped
+                self.scheduler.resume()
+            else:
+                self.stats.count("source_held")
+                self.scheduler.pause()
+            self.stats.record("latency", self.scheduler.clock() - captured)
+            self.stats.frame_done()
+
+            for queue in self.outQueues:
+                if not self.put(queue, frame):
+                    break
+        self.finish(*self.outQueues)
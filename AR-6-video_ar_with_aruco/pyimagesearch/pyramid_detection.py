@@ -0,0 +1,69 @@
+import numpy as np
+import cv2
+
+# Coarse-to-fine ArUCo detection
+# Instead of detecting on the full-resolution frame (slow on 4K) or on a fixed-width resize (imprecise on large
+# frames, and wasted work on small ones), the frame is downscaled by the largest power of two that still leaves
+# the smallest expected marker at least `targetSize` pixels wide. Markers are found on that level and only their
+# corners are refined with sub-pixel accuracy on the full-resolution frame, so the detection cost follows the
+# marker's pixel area rather than the frame's.
+
+# side, in pixels, the smallest marker should still have on the level it is detected on
+TARGET_MARKER_SIZE = 32
+
+SUBPIX_CRITERIA = (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 30, 0.01)
+
+# pick the downscale factor for a marker size
+# inputs:
+# 1 markerSize: side, in full-resolution pixels, of the smallest marker that has to be found
+# 2 targetSize: side the marker should keep on the downscaled level
+# 3 maxScale: largest downscale factor allowed
+# returns: a power of two, 1 meaning no downscaling
+def choose_scale(markerSize, targetSize=TARGET_MARKER_SIZE, maxScale=16):
+    scale = 1
+    while scale * 2 <= maxScale and markerSize / (scale * 2) >= targetSize:
+        scale *= 2
+    return scale
+
+# drop-in replacement for cv2.aruco.ArucoDetector that detects on a downscaled level and refines on the full frame
+# inputs:
+# 1 detector: the cv2.aruco.ArucoDetector used on the downscaled level, e.g. from aruco_registry.get_detector
+# 2 markerSize: side, in full-resolution pixels, of the smallest marker that has to be found
+# 3 targetSize: side the smallest marker should keep on the downscaled level
+# 4 refine: whether or not to refine the corners on the full-resolution frame with cv2.cornerSubPix
+class PyramidDetector:
+    def __init__(self, detector, markerSize, targetSize=TARGET_MARKER_SIZE, refine=True):
+        self.detector = detector
+        self.scale = choose_scale(markerSize, targetSize)
+        self.refine = refine
+
+    # same inputs and outputs as cv2.aruco.ArucoDetector.detectMarkers, in full-resolution coordinates
+    def detectMarkers(self, frame):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        (frameH, frameW) = gray.shape[:2]
+        s = self.scale
+
+        level = gray
+        if s > 1:
+            level = cv2.resize(gray, (frameW // s, frameH // s), interpolation=cv2.INTER_AREA)
+        (corners, ids, rejected) = self.detector.detectMarkers(level)
+        if ids is None or len(ids) == 0:
+            return (corners, ids, self._upscale(rejected))
+
+        points = self._upscale_points(np.array(corners, dtype="float32").reshape(-1, 2))
+        if self.refine:
+            # the coarse corners are off by up to about one level pixel, i.e. `s` full-resolution pixels
+            window = max(2, s + 1)
+            cv2.cornerSubPix(gray, points, (window, window), (-1, -1), SUBPIX_CRITERIA)
+        corners = tuple(points.reshape(-1, 1, 4, 2))
+        return (corners, ids, self._upscale(rejected))
+
+    # map level coordinates back to the full-resolution frame. INTER_AREA averages s x s blocks, so the center
+    # of level pixel i is the center of full-resolution pixels i * s ... i * s + s - 1
+    def _upscale_points(self, points):
+        if self.scale == 1:
+            return np.ascontiguousarray(points, dtype="float32")
+        return ((points + 0.5) * self.scale - 0.5).astype("float32")
+
+    def _upscale(self, quads):
+        return tuple(self._upscale_points(np.asarray(q, dtype="float32").reshape(-1, 2)).reshape(1, 4, 2) for q in quads)
@@ -0,0 +1,86 @@
+from .frame_ring import SharedFrameRing
+from .aruco_registry import get_detector
+from .pyramid_detection import PyramidDetector
+from queue import Empty
+import multiprocessing
+import numpy as np
+import cv2
+
+# ArUCo detection spread over worker processes that read frames from a SharedFrameRing
+# The capture side publishes frames into the ring and submits their sequence numbers; every worker detects on the
+# shared slot in place and sends back only the corners and ids. A frame whose slot was reused before the worker
+# was done with it comes back with `corners` and `ids` set to None.
+
+# worker process main loop
+# inputs:
+# 1 ringSpec: SharedFrameRing.spec() of the ring to read from
+# 2 dictName: name of the dictionary, e.g. "DICT_ARUCO_ORIGINAL"
+# 3 pyramid: side, in pixels, of the smallest marker to find for coarse-to-fine detection, 0 to detect directly
+# 4 tasks: queue of sequence numbers to process, None to exit
+# 5 results: queue of (seq, corners (N, 4, 2) float32, ids (N,) int32)
+def detection_worker(ringSpec, dictName, pyramid, tasks, results):
+    # parallelism comes from the processes, not from OpenCV's own thread pool
+    cv2.setNumThreads(1)
+    ring = SharedFrameRing.attach(ringSpec)
+    detector = get_detector(dictName)
+    if pyramid > 0:
+        detector = PyramidDetector(detector, pyramid)
+
+    while True:
+        seq = tasks.get()
+        if seq is None:
+            break
+        frame = ring.view(seq)
+        if frame is None:
+            results.put((seq, None, None))
+            continue
+        (corners, ids, rejected) = detector.detectMarkers(frame)
+        frame = None
+        if not ring.is_current(seq):
+            # overwritten while it was being read: the detections may mix two frames
+            results.put((seq, None, None))
+            continue
+        if ids is None or len(ids) == 0:
+            results.put((seq, np.zeros((0, 4, 2), dtype="float32"), np.zeros((0,), dtype="int32")))
+        else:
+            results.put((seq, np.array(corners, dtype="float32").reshape(-1, 4, 2), ids.flatten().astype("int32")))
+    ring.close()
+
+# pool of detection_worker processes attached to one ring
+# inputs:
+# 1 ring: the SharedFrameRing the frames are published to
+# 2 dictName: name of the dictionary
+# 3 workers: number of worker processes
+# 4 pyramid: see detection_worker
+class RingDetectionPool:
+    def __init__(self, ring, dictName, workers, pyramid=0):
+        self.tasks = multiprocessing.Queue()
+        self.results = multiprocessing.Queue()
+        self.inFlight = 0
+        self.processes = [multiprocessing.Process(target=detection_worker, args=(ring.spec(), dictName, pyramid, self.tasks, self.results), daemon=True) for _ in range(workers)]
+        for process in self.processes:
+            process.start()
+
+    # queue frame `seq` for detection
+    def submit(self, seq):
+        self.tasks.put(seq)
+        self.inFlight += 1
+
+    # next finished frame as (seq, corners, ids), in completion order (not necessarily submission order)
+    def get(self, timeout=None):
+        result = self.results.get(timeout=timeout)
+        self.inFlight -= 1
+        return result
+
+    # stop the workers. Results that were not collected are dropped
+    def close(self):
+        for _ in self.processes:
+            self.tasks.put(None)
+        # keep draining: a worker cannot exit while its results are still stuck in the queue's pipe
+        while any(process.is_alive() for process in self.processes):
+            try:
+                self.results.get(timeout=0.1)
+            except Empty:
+                pass
+        for process in self.processes:
+            process.join()
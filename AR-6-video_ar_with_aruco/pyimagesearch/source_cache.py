@@ -0,0 +1,176 @@
+from collections import OrderedDict
+import numpy as np
+import tempfile
+import os
+import cv2
+
+# Decoded, pre-resized copy of the source (overlay) video
+# The clip is decoded once and every frame is resized to the size it will actually be warped at, so the warp no
+# longer resamples a full-size source that then ends up a few hundred pixels wide. Frames live in memory as long
+# as they fit in `maxBytes`; past that, either
+# "spill": the frames are written to a memory-mapped file and the OS page cache keeps the hot part in memory, or
+# "lru": the `maxBytes` most recently used frames stay in memory and the others are decoded again when needed.
+# Spilling suits looping playback, which touches every frame in turn and defeats an LRU smaller than the clip.
+
+# size of a frame resized to fit in a (maxW, maxH) box, keeping its aspect ratio
+def fit_size(width, height, maxW, maxH):
+    scale = min(maxW / width, maxH / height, 1.0)
+    return (max(int(round(width * scale)), 1), max(int(round(height * scale)), 1))
+
+# inputs:
+# 1 path: path of the source video
+# 2 size: (width, height) the frames are stored at, or None for their native size
+# 3 maxBytes: memory budget of the decoded frames
+# 4 policy: "spill" or "lru", what happens when the clip does not fit in `maxBytes`
+# 5 spillPath: path of the spill file, a temporary file by default
+class SourceCache:
+    def __init__(self, path, size=None, maxBytes=512 * 2 ** 20, policy="spill", spillPath=None):
+        if policy not in ("spill", "lru"):
+            raise ValueError(f"unknown cache policy {policy}")
+        self.path = path
+        self.size = size
+        self.maxBytes = maxBytes
+        self.policy = policy
+        self.frames = OrderedDict() # index -> frame, most recently used last
+        self.spill = None
+        self.spillPath = None
+        self.ownsSpill = False
+        self.hits = 0
+        self.misses = 0
+
+        capture = cv2.VideoCapture(path)
+        self.fps = capture.get(cv2.CAP_PROP_FPS)
+        (grabbed, frame) = capture.read()
+        if not grabbed:
+            raise ValueError(f"could not read {path}")
+        if self.size is None:
+            self.size = (frame.shape[1], frame.shape[0])
+        self.shape = (self.size[1], self.size[0]) + frame.shape[2:]
+        self.frameBytes = int(np.prod(self.shape))
+        self.capacity = max(self.maxBytes // self.frameBytes, 1)
+
+        # single decoding pass
+        spillFile = None
+        self.count = 0
+        while grabbed:
+            frame = self._resize(frame)
+            if spillFile is None and self.count >= self.capacity and self.policy == "spill":
+                # over budget: move what was decoded so far to the spill file and keep appending to it
+                if spillPath is None:
+                    (fd, spillPath) = tempfile.mkstemp(prefix="source_cache_", suffix=".raw")
+                    os.close(fd)
+                    self.ownsSpill = True
+                self.spillPath = spillPath
+                spillFile = open(spillPath, "wb")
+                for k in range(self.count):
+                    spillFile.write(self.frames[k].tobytes())
+                self.frames.clear()
+            if spillFile is not None:
+                spillFile.write(frame.tobytes())
+            elif self.count < self.capacity:
+                self.frames[self.count] = frame
+            self.count += 1
+            (grabbed, frame) = capture.read()
+        capture.release()
+
+        if spillFile is not None:
+            spillFile.close()
+            self.spill = np.memmap(self.spillPath, dtype="uint8", mode="r", shape=(self.count,) + self.shape)
+        # only kept open when frames have to be decoded again
+        self.capture = cv2.VideoCapture(path) if self.policy == "lru" and self.count > self.capacity else None
+        self.capturePos = 0
+
+    def _resize(self, frame):
+        if (frame.shape[1], frame.shape[0]) == self.size:
+            return frame
+        return cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA)
+
+    def __len__(self):
+        return self.count
+
+    # frame `index`. The returned array is shared with the cache and must not be modified
+    def get(self, index):
+        if self.spill is not None:
+            return self.spill[index]
+        frame = self.frames.get(index)
+        if frame is not None:
+            self.hits += 1
+            self.frames.move_to_end(index)
+            return frame
+
+        # lru miss: decode it again, seeking only when not reading straight on
+        self.misses += 1
+        if self.capturePos != index:
+            self.capture.set(cv2.CAP_PROP_POS_FRAMES, index)
+        (grabbed, frame) = self.capture.read()
+        self.capturePos = index + 1
+        if not grabbed:
+            raise IndexError(f"frame {index} could not be decoded again")
+        frame = self._resize(frame)
+        self.frames[index] = frame
+        if len(self.frames) > self.capacity:
+            self.frames.popitem(last=False)
+        return frame
+
+    # bytes held in memory (the spill file is not counted, the OS pages it in and out)
+    def memory_bytes(self):
+        return len(self.frames) * self.frameBytes
+
+    def close(self):
+        self.frames.clear()
+        if self.capture is not None:
+            self.capture.release()
+        if self.spill is not None:
+            # the mapping is closed once the last frame handed out is gone
+            self.spill = None
+            if self.ownsSpill:
+                try:
+                    os.remove(self.spillPath)
+                except OSError: # still mapped (Windows)
+                    pass
+
+# plays a SourceCache with cv2.VideoCapture's `read()` / `grab()` / `retrieve()` interface, so it can replace the
+# capture of the source video anywhere, e.g. in the deque loop of opencv_ar_video.py, in a DecodeStage or in a
+# playback.SourceScheduler
+# inputs:
+# 1 cache: the SourceCache
+# 2 loop: whether or not to start over at the end of the clip instead of running out
+class SourcePlayer:
+    def __init__(self, cache, loop=True):
+        self.cache = cache
+        self.loop = loop
+        self.index = 0
+        self.played = 0 # frames grabbed since the start, loops included, for the timestamps
+
+    # advance to the next frame without touching its pixels
+    # returns: False at the end of the clip
+    def grab(self):
+        if self.index >= len(self.cache):
+            if not self.loop or len(self.cache) == 0:
+                return False
+            self.index = 0
+        self.index += 1
+        self.played += 1
+        return True
+
+    # returns: (True, frame) of the frame grabbed last
+    def retrieve(self):
+        return (True, self.cache.get(self.index - 1))
+
+    # returns: (grabbed, frame) like cv2.VideoCapture.read()
+    def read(self):
+        if not self.grab():
+            return (False, None)
+        return self.retrieve()
+
+    # CAP_PROP_FPS and CAP_PROP_POS_MSEC, the timestamp of the frame grabbed last. Timestamps keep increasing
+    # across loops, like a live stream. Other properties are 0
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FPS:
+            return self.cache.fps
+        if prop == cv2.CAP_PROP_POS_MSEC and self.cache.fps > 0:
+            return 1000.0 * max(self.played - 1, 0) / self.cache.fps
+        return 0.0
+
+    def release(self):
+        self.cache.close()
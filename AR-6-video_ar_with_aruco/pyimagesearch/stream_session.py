@@ -0,0 +1,96 @@
+from .augmented_reality import find_and_warp, WarpBuffers
+from .marker_tracking import MarkerTracker
+from .instrumentation import NULL_STATS, StageStats
+from .aruco_registry import get_dictionary, get_parameters
+from .calibration import load_camera_model, estimate_poses
+from .warp_memo import WarpMemo
+import numpy as np
+import cv2
+
+# Everything find_and_warp needs to remember about one video stream
+# A session owns its reference point cache (instead of the module-level CACHED_REF_PTS), its own ArucoDetector,
+# its own ROI scratch buffers and, optionally, its own tracker and stats. Two sessions never share mutable state,
+# so any number of streams can be processed in the same process, from as many threads as needed; a single session
+# must only be used by one thread at a time.
+# inputs:
+# 1 tagIDs: the ID's of the ArUCo tags: TL, TR, BR, BL
+# 2 arucoDict: OpenCV's ArUCo tag dictionary
+# 3 arucoParams: the ArUCo marker detector parameters
+# 4 useCache: boolean -- whether or not to fall back to the last reference points when a tag is missing
+# 5 useROI: boolean -- composite in place, only inside the bounding rectangle of the tags
+# 6 detectEvery: when > 0, track the tags and only run the full-frame detector every `detectEvery` frames
+# 7 trackMode: "flow" or "roi", see MarkerTracker
+# 8 stats: optional StageStats of this stream
+# 9 detector: optional detector used instead of a new cv2.aruco.ArucoDetector, e.g. a PyramidDetector
+# 10 log: optional DetectionLogWriter that records the tags found in every frame of this stream
+# 11 camera: optional CameraModel of this stream's camera, enables the calibrated mode of find_and_warp
+# 12 markerLength: side of the tags, in the unit of the translations returned by `poses`
+# 13 memo: optional WarpMemo, reuses the warp of the previous frames while the tags do not move
+class StreamSession:
+    def __init__(self, tagIDs, arucoDict, arucoParams, useCache=True, useROI=False, detectEvery=0, trackMode="flow", stats=None, detector=None, log=None, camera=None, markerLength=1.0, memo=None):
+        self.tagIDs = tagIDs
+        self.arucoDict = arucoDict
+        self.arucoParams = arucoParams
+        self.useCache = useCache
+        self.useROI = useROI
+        self.detector = cv2.aruco.ArucoDetector(arucoDict, arucoParams) if detector is None else detector
+        self.buffers = WarpBuffers()
+        self.tracker = None
+        if detectEvery > 0:
+            self.tracker = MarkerTracker(arucoDict, arucoParams, detectEvery=detectEvery, mode=trackMode, detector=self.detector)
+        self.stats = NULL_STATS if stats is None else stats
+        self.log = log
+        self.camera = camera
+        self.markerLength = markerLength
+        self.memo = memo
+        self.lastDetections = None
+        self.cachedRefPts = None
+
+    # warp the source onto a frame of this stream, see find_and_warp
+    # inputs:
+    # 1 frame, source: see find_and_warp
+    # 2 detections: optional precomputed (corners, ids) of the frame, e.g. replayed from a DetectionLog
+    # returns: the warped frame, or None if the tags were not found and nothing is cached
+    def warp(self, frame, source, detections=None):
+        return find_and_warp(frame, source, self.tagIDs, self.arucoDict, self.arucoParams, useCache=self.useCache, useROI=self.useROI, session=self, detections=detections)
+
+    # pose of every tag found in the last warped frame, in one batched call
+    # returns: (ids, rvecs, tvecs) as (N,), (N, 3) and (N, 3) arrays, see calibration.estimate_poses
+    def poses(self):
+        if self.camera is None:
+            raise ValueError("pose estimation needs a camera model")
+        if self.lastDetections is None or self.lastDetections[1] is None or len(self.lastDetections[1]) == 0:
+            return (np.zeros((0,), dtype="int32"), np.zeros((0, 3)), np.zeros((0, 3)))
+        (tags, ids, size) = self.lastDetections
+        # the calibrated mode detects on undistorted frames
+        (rvecs, tvecs) = estimate_poses(tags, self.markerLength, self.camera, size, undistorted=True)
+        return (np.asarray(ids).ravel(), rvecs, tvecs)
+
+    # forget the cached reference points and the tracked tags, e.g. after the camera was moved
+    def reset(self):
+        self.cachedRefPts = None
+        if self.memo is not None:
+            self.memo.clear()
+        if self.tracker is not None:
+            self.tracker.reset()
+
+# build a session from a picklable description, so that sessions can be built inside worker processes
+# inputs:
+# 1 spec: dict with the optional keys
+#   "dictionary": name of the ArUCo dictionary, DICT_ARUCO_ORIGINAL by default
+#   "tags": ID's of the TL, TR, BR, BL tags, (923, 1001, 241, 1007) by default
+#   "cache", "roi", "track", "track_mode", "stats", "calibration", "profile", "memo": same meaning as the flags
+#   of opencv_ar_video.py
+def session_from_spec(spec):
+    return StreamSession(
+        tuple(spec.get("tags", (923, 1001, 241, 1007))),
+        get_dictionary(spec.get("dictionary", "DICT_ARUCO_ORIGINAL")),
+        get_parameters(spec.get("profile") or None),
+        useCache=spec.get("cache", 1) > 0,
+        useROI=spec.get("roi", 1) > 0,
+        detectEvery=spec.get("track", 0),
+        trackMode=spec.get("track_mode", "flow"),
+        stats=StageStats() if spec.get("stats", 0) > 0 else None,
+        camera=load_camera_model(spec["calibration"]) if spec.get("calibration") else None,
+        memo=WarpMemo(spec["memo"]) if spec.get("memo", 0) > 0 else None
+    )
@@ -0,0 +1,177 @@
+from .instrumentation import NULL_STATS
+from .compositing import WarpBuffers, composite
+from .warp_memo import composite_memoized
+from collections import OrderedDict
+import numpy as np
+import json
+import cv2
+
+# Several AR surfaces per frame
+# A surface is a quad spanned by four tags: the outer corner of its TL, TR, BR and BL tags, exactly like the single
+# surface of find_and_warp. A SurfaceLayout declares any number of named surfaces and keeps an index from tag id to
+# (surface, role), so the tags found by one detection pass are sorted into surfaces with one dictionary lookup
+# per tag instead of a scan of the ids per role and per surface. SurfaceRenderer then composites every surface
+# whose four tags are visible (or cached), each with its own source, onto the frame.
+
+# the four corners of a surface, in order. Role k uses corner k of its tag: the TL tag's top left corner, the TR
+# tag's top right corner, and so on
+ROLES = ("TL", "TR", "BR", "BL")
+
+# index the detections of a frame by tag id
+# inputs:
+# 1 corners, ids: detectMarkers output
+# returns: dict of id -> (4, 2) corners. When an id was detected more than once, the first detection is kept
+def index_detections(corners, ids):
+    found = {}
+    if ids is None:
+        return found
+    for (corner, i) in zip(corners, np.asarray(ids).ravel()):
+        found.setdefault(int(i), np.asarray(corner).reshape(4, 2))
+    return found
+
+# named surfaces and the id -> (surface, role) index
+# inputs:
+# 1 surfaces: optional dict (or list of pairs) of name -> TL, TR, BR, BL tag ids
+class SurfaceLayout:
+    def __init__(self, surfaces=None):
+        self.surfaces = OrderedDict() # name -> (TL, TR, BR, BL) ids
+        self.index = {}               # id -> (name, role index)
+        for (name, tagIDs) in (dict(surfaces) if surfaces is not None else {}).items():
+            self.add(name, tagIDs)
+
+    # declare a surface
+    # raises ValueError when the name is taken or a tag already belongs to a surface: one tag, one corner
+    def add(self, name, tagIDs):
+        tagIDs = tuple(int(i) for i in tagIDs)
+        if len(tagIDs) != 4:
+            raise ValueError(f"surface {name} needs 4 tag ids (TL, TR, BR, BL), got {len(tagIDs)}")
+        if name in self.surfaces:
+            raise ValueError(f"surface {name} is already declared")
+        if len(set(tagIDs)) != 4:
+            raise ValueError(f"surface {name} uses the same tag twice")
+        for i in tagIDs:
+            if i in self.index:
+                raise ValueError(f"tag {i} of surface {name} already belongs to surface {self.index[i][0]}")
+        self.surfaces[name] = tagIDs
+        for (role, i) in enumerate(tagIDs):
+            self.index[i] = (name, role)
+
+    def remove(self, name):
+        for i in self.surfaces.pop(name):
+            del self.index[i]
+
+    def names(self):
+        return list(self.surfaces.keys())
+
+    def __len__(self):
+        return len(self.surfaces)
+
+    # sort the detections of a frame into surfaces
+    # inputs:
+    # 1 corners, ids: detectMarkers output
+    # returns: dict of surface name -> (4, 2) float32 destination points (TL, TR, BR, BL) for every surface whose
+    # four tags were all found. Tags that do not belong to the layout are ignored
+    def locate(self, corners, ids):
+        partial = {}
+        if ids is None:
+            return {}
+        for (corner, i) in zip(corners, np.asarray(ids).ravel()):
+            entry = self.index.get(int(i))
+            if entry is None:
+                continue
+            (name, role) = entry
+            points = partial.setdefault(name, [None] * 4)
+            if points[role] is None:
+                points[role] = np.asarray(corner).reshape(4, 2)[role]
+        return {name: np.array(points, dtype="float32") for (name, points) in partial.items() if all(p is not None for p in points)}
+
+# load a layout from JSON:
+# {"surfaces": {"left": {"tags": [TL, TR, BR, BL], "source": "optional/path.jpg"}, "right": [TL, TR, BR, BL], ...}}
+# returns: (SurfaceLayout, dict of surface name -> source path for the surfaces that name one)
+def load_layout(path):
+    with open(path) as f:
+        data = json.load(f)
+    layout = SurfaceLayout()
+    sources = {}
+    for (name, surface) in data["surfaces"].items():
+        if isinstance(surface, dict):
+            layout.add(name, surface["tags"])
+            if surface.get("source"):
+                sources[name] = surface["source"]
+        else:
+            layout.add(name, surface)
+    return (layout, sources)
+
+# composites every visible surface of a layout onto frames of one stream
+# Like a StreamSession, it owns per-stream state (the last destination points of every surface and the scratch
+# buffers), so one renderer serves one stream from one thread at a time.
+# inputs:
+# 1 layout: the SurfaceLayout
+# 2 detector: anything with detectMarkers, e.g. aruco_registry.get_detector(...)
+# 3 useCache: whether or not a surface whose tags are not all visible is drawn at its last known position
+# 4 useROI: composite straight into the frame instead of into a copy of it
+# 5 blend, feather: compositing mode, see compositing.MODES
+# 6 stats: optional StageStats
+# 7 memo: optional WarpMemo shared by the surfaces. Give it at least one entry per surface, so that a static
+#   layout never evicts its own surfaces
+class SurfaceRenderer:
+    def __init__(self, layout, detector, useCache=True, useROI=False, blend="hard", feather=8, stats=None, memo=None):
+        self.layout = layout
+        self.detector = detector
+        self.useCache = useCache
+        self.useROI = useROI
+        self.blend = blend
+        self.feather = feather
+        self.stats = NULL_STATS if stats is None else stats
+        self.buffers = WarpBuffers()
+        self.memo = memo
+        self.cachedPoints = {} # surface name -> last destination points
+
+    # inputs:
+    # 1 frame: the input frame
+    # 2 sources: dict of surface name -> source image. Surfaces without a source are skipped
+    # 3 detections: optional precomputed (corners, ids) of the frame, e.g. from a DetectionLog
+    # returns: (output frame, list of the names of the surfaces drawn)
+    def render(self, frame, sources, detections=None):
+        stats = self.stats
+        with stats.stage("detect"):
+            if detections is None:
+                (corners, ids, rejected) = self.detector.detectMarkers(frame)
+            else:
+                (corners, ids) = detections
+        located = self.layout.locate(corners, ids)
+
+        output = frame if self.useROI else frame.copy()
+        drawn = []
+        for name in self.layout.surfaces:
+            source = sources.get(name)
+            if source is None:
+                continue
+            points = located.get(name)
+            if points is None:
+                stats.count("detection_miss")
+                if not self.useCache or name not in self.cachedPoints:
+                    continue
+                stats.count("cache_fallback")
+                points = self.cachedPoints[name]
+            elif self.useCache:
+                self.cachedPoints[name] = points
+
+            if self.memo is not None:
+                entry = self.memo.get(points, source, output.shape, mode=self.blend, feather=self.feather, stats=stats)
+                composite_memoized(output, source, entry, self.buffers, stats=stats)
+                drawn.append(name)
+                continue
+            (sourceH, sourceW) = source.shape[:2]
+            source_points = np.array([(0, 0), (sourceW, 0), (sourceW, sourceH), (0, sourceH)], dtype="float32")
+            with stats.stage("homography"):
+                H = cv2.getPerspectiveTransform(source_points, points)
+            composite(output, source, H, points, self.buffers, mode=self.blend, feather=self.feather, stats=stats)
+            drawn.append(name)
+        return (output, drawn)
+
+    # forget the cached surface positions
+    def reset(self):
+        self.cachedPoints = {}
+        if self.memo is not None:
+            self.memo.clear()
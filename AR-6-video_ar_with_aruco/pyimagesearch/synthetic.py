@@ -0,0 +1,138 @@
+from .aruco_registry import get_dictionary
+import numpy as np
+import cv2
+
+# Synthetic frames with ArUCo markers at known poses
+# Markers are generated with cv2.aruco.generateImageMarker, given a white quiet zone and warped onto a background
+# with a random rotation, scale and perspective tilt. Blur and sensor noise are applied on top. The exact corners
+# of every marker are returned along with the frame, so detection results can be checked without a camera.
+
+# make a background image
+# inputs:
+# 1 size: (width, height)
+# 2 kind: "solid", "gradient" or "noise"
+# 3 rng: numpy random Generator
+def make_background(size, kind, rng):
+    (w, h) = size
+    if kind == "solid":
+        return np.full((h, w, 3), 180, dtype="uint8")
+    if kind == "gradient":
+        x = np.linspace(90, 230, w, dtype="float32")
+        y = np.linspace(0.8, 1.0, h, dtype="float32")[:, None]
+        return np.dstack([(x * y).astype("uint8")] * 3)
+    # low frequency clutter: upscaled random noise
+    small = rng.integers(60, 230, size=(max(h // 32, 1), max(w // 32, 1), 3), dtype="uint8")
+    return cv2.resize(small, (w, h), interpolation=cv2.INTER_CUBIC)
+
+# warp a marker onto a frame in place
+# inputs:
+# 1 frame: BGR frame, modified in place
+# 2 marker: grayscale marker image, as returned by generateImageMarker
+# 3 corners: (4, 2) destination of the marker's TL, TR, BR, BL corners, in frame pixel coordinates
+# 4 quietZone: width of the white margin drawn around the marker, as a fraction of the marker's side
+def paste_marker(frame, marker, corners, quietZone=0.2):
+    side = marker.shape[0]
+    pad = int(round(side * quietZone))
+    padded = cv2.copyMakeBorder(marker, pad, pad, pad, pad, cv2.BORDER_CONSTANT, value=255)
+
+    # the marker's outer edge sits at -0.5 and side - 0.5 in pixel center coordinates
+    src = np.array([[-0.5, -0.5], [side - 0.5, -0.5], [side - 0.5, side - 0.5], [-0.5, side - 0.5]], dtype="float32") + pad
+    M = cv2.getPerspectiveTransform(src, corners.astype("float32"))
+    (frameH, frameW) = frame.shape[:2]
+
+    # only warp inside the bounding rectangle of the padded marker
+    outer = cv2.perspectiveTransform(np.array([[[-0.5, -0.5], [padded.shape[1] - 0.5, -0.5], [padded.shape[1] - 0.5, padded.shape[0] - 0.5], [-0.5, padded.shape[0] - 0.5]]], dtype="float32"), M)[0]
+    x0 = max(int(np.floor(outer[:, 0].min())), 0)
+    y0 = max(int(np.floor(outer[:, 1].min())), 0)
+    x1 = min(int(np.ceil(outer[:, 0].max())) + 1, frameW)
+    y1 = min(int(np.ceil(outer[:, 1].max())) + 1, frameH)
+    if x1 <= x0 or y1 <= y0:
+        return
+
+    T = np.array([[1, 0, -x0], [0, 1, -y0], [0, 0, 1]], dtype="float64")
+    warped = cv2.warpPerspective(padded, T @ M, (x1 - x0, y1 - y0), flags=cv2.INTER_LINEAR)
+    alpha = cv2.warpPerspective(np.full(padded.shape, 255, dtype="uint8"), T @ M, (x1 - x0, y1 - y0), flags=cv2.INTER_LINEAR)
+    roi = frame[y0:y1, x0:x1]
+    a = (alpha.astype("float32") / 255.0)[:, :, None]
+    roi[:] = (warped[:, :, None] * a + roi * (1 - a)).astype("uint8")
+
+# random quad for a marker of side `side` centred on `center`
+# inputs:
+# 1 center: (x, y)
+# 2 side: side of the marker in pixels before the tilt
+# 3 rng: numpy random Generator
+# 4 tilt: maximum perspective jitter of every corner, as a fraction of the side
+# 5 maxAngle: the marker is rotated by a random angle in [-maxAngle, maxAngle] radians
+def random_pose(center, side, rng, tilt=0.1, maxAngle=np.pi):
+    angle = rng.uniform(-maxAngle, maxAngle)
+    R = np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+    square = np.array([[-1, -1], [1, -1], [1, 1], [-1, 1]], dtype="float64") * side / 2
+    jitter = rng.uniform(-tilt, tilt, size=(4, 2)) * side
+    return (square + jitter) @ R.T + center
+
+# synthesize a frame
+# inputs:
+# 1 size: (width, height) of the frame
+# 2 markers: list of (dictionary name, marker ID) to place
+# 3 rng: numpy random Generator, or an int seed
+# 4 scale: (min, max) marker side as a fraction of the frame's shorter side
+# 5 blur: sigma of the Gaussian blur applied to the frame, 0 for none
+# 6 noise: standard deviation of the additive Gaussian noise, 0 for none
+# 7 background: "solid", "gradient" or "noise"
+# 8 tilt: maximum perspective jitter, as a fraction of the marker side
+# 9 maxAngle: maximum in-plane rotation of every marker, in radians
+# 10 cols: number of grid columns, by default picked so that the cells are roughly square
+# returns: (frame, truth) where truth is a list of dicts with "dictionary", "id" and "corners" ((4, 2) float32)
+# Markers are laid out row by row on a grid, so with 4 markers and cols=2 the order is TL, TR, BL, BR
+def synthesize_frame(size, markers, rng=0, scale=(0.08, 0.15), blur=0.0, noise=0.0, background="gradient", tilt=0.1, maxAngle=np.pi, cols=None):
+    rng = np.random.default_rng(rng)
+    (w, h) = size
+    frame = make_background(size, background, rng)
+
+    # one marker per grid cell so that markers never overlap
+    if cols is None:
+        cols = int(np.ceil(np.sqrt(len(markers) * w / h)))
+    rows = int(np.ceil(len(markers) / cols)) if len(markers) > 0 else 0
+    cellW = w / max(cols, 1)
+    cellH = h / max(rows, 1)
+
+    truth = []
+    for (k, (dictName, markerID)) in enumerate(markers):
+        (row, col) = divmod(k, cols)
+        side = rng.uniform(*scale) * min(w, h)
+        # keep the rotated, tilted marker and its quiet zone inside the cell
+        side = min(side, 0.5 * min(cellW, cellH))
+        center = ((col + 0.5) * cellW, (row + 0.5) * cellH)
+        corners = random_pose(center, side, rng, tilt, maxAngle).astype("float32")
+
+        marker = cv2.aruco.generateImageMarker(get_dictionary(dictName), markerID, max(int(side), 32))
+        paste_marker(frame, marker, corners)
+        truth.append({"dictionary": dictName, "id": markerID, "corners": corners})
+
+    if blur > 0:
+        frame = cv2.GaussianBlur(frame, (0, 0), blur)
+    if noise > 0:
+        frame = np.clip(frame + rng.normal(0, noise, frame.shape), 0, 255).astype("uint8")
+    return (frame, truth)
+
+# compare detections against the ground truth of one dictionary
+# inputs:
+# 1 corners, ids: detector output, in either the detectMarkers format or as (N, 4, 2) / (N,) arrays
+# 2 truth: ground truth list from `synthesize_frame`
+# 3 dictName: only ground truth markers of this dictionary are considered
+# returns: (found, expected, corner errors) where the errors are the max corner distances of the found markers
+def match_detections(corners, ids, truth, dictName):
+    expected = [t for t in truth if t["dictionary"] == dictName]
+    if ids is None or len(ids) == 0:
+        return (0, len(expected), [])
+    corners = np.asarray(corners, dtype="float32").reshape(-1, 4, 2)
+    ids = np.asarray(ids).flatten()
+
+    errors = []
+    for t in expected:
+        candidates = np.where(ids == t["id"])[0]
+        if len(candidates) == 0:
+            continue
+        distances = [np.linalg.norm(corners[j] - t["corners"], axis=1).max() for j in candidates]
+        errors.append(min(distances))
+    return (len(errors), len(expected), errors)
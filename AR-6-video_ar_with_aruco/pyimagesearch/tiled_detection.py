@@ -0,0 +1,199 @@
+from concurrent.futures import ThreadPoolExecutor
+from .aruco_registry import get_dictionary, get_parameters
+from .dictionary_discovery import merge_duplicates
+from collections import deque
+import numpy as np
+import threading
+import os
+import cv2
+
+# Tiled ArUCo detection for very large images
+# Detecting on a 50-100 MP image in one call is slow (one thread) and needs the whole image, plus its grayscale
+# copy, in memory; resizing it first loses the small markers. Here the image is split into overlapping tiles that
+# are detected on a pool of threads (cv2 releases the GIL while it detects), and the corners are mapped back to
+# image coordinates. As long as the overlap is larger than the largest marker, every marker lies entirely inside
+# at least one tile; markers found in two tiles are merged, keeping the detection farthest from a tile edge.
+# Uncompressed inputs (.npy, binary .pgm / .ppm and headerless .raw) are memory-mapped instead of read: each tile
+# only pages in its own rows, so peak memory follows the tile size and the number of tiles in flight rather than
+# the image size.
+
+# tile layout along one axis: start offsets of tiles of `tileSize` overlapping by `overlap`, the last one flush
+# with the end
+def tile_starts(length, tileSize, overlap):
+    if length <= tileSize:
+        return [0]
+    step = tileSize - overlap
+    count = int(np.ceil((length - overlap) / step))
+    return sorted(set(min(i * step, length - tileSize) for i in range(count)))
+
+# the tiles covering a (width, height) image
+# returns: list of (x0, y0, x1, y1) rectangles, x1 and y1 exclusive
+def tile_grid(width, height, tileSize, overlap):
+    return [(x0, y0, min(x0 + tileSize, width), min(y0 + tileSize, height))
+            for y0 in tile_starts(height, tileSize, overlap) for x0 in tile_starts(width, tileSize, overlap)]
+
+# header of a binary (P5 grayscale / P6 RGB) PGM or PPM file
+# returns: (width, height, channels, offset of the pixels)
+def read_pnm_header(path):
+    with open(path, "rb") as f:
+        data = f.read(1024)
+    fields = []
+    pos = 0
+    while len(fields) < 4:
+        # whitespace separated fields, "#" starts a comment that runs to the end of the line
+        while data[pos:pos + 1].isspace():
+            pos += 1
+        if data[pos:pos + 1] == b"#":
+            pos = data.index(b"\n", pos)
+            continue
+        end = pos
+        while end < len(data) and not data[end:end + 1].isspace():
+            end += 1
+        fields.append(data[pos:end])
+        pos = end
+    (magic, width, height, maxval) = (fields[0], int(fields[1]), int(fields[2]), int(fields[3]))
+    if magic not in (b"P5", b"P6") or maxval > 255:
+        raise ValueError(f"{path} is not an 8 bit binary PGM or PPM file")
+    # a single whitespace character separates the header from the pixels
+    return (width, height, 1 if magic == b"P5" else 3, pos + 1)
+
+# an image read tile by tile
+# inputs:
+# 1 array: (H, W) or (H, W, C) uint8 array, usually a memory map
+# 2 rgb: whether or not the channels are in RGB order (PPM) rather than OpenCV's BGR
+class TiledImage:
+    def __init__(self, array, rgb=False):
+        self.array = array
+        self.rgb = rgb
+        self.shape = array.shape
+
+    # grayscale copy of the rectangle (x0, y0, x1, y1); only this part of a memory map is read
+    def tile(self, rect):
+        (x0, y0, x1, y1) = rect
+        region = self.array[y0:y1, x0:x1]
+        if region.ndim == 2:
+            return np.ascontiguousarray(region)
+        if region.shape[2] == 1:
+            return np.ascontiguousarray(region[:, :, 0])
+        return cv2.cvtColor(np.ascontiguousarray(region), cv2.COLOR_RGB2GRAY if self.rgb else cv2.COLOR_BGR2GRAY)
+
+    # the whole image as a BGR array in memory, e.g. to draw on or composite onto
+    def to_bgr(self):
+        image = np.array(self.array)
+        if image.ndim == 2 or image.shape[2] == 1:
+            return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+        return cv2.cvtColor(image, cv2.COLOR_RGB2BGR) if self.rgb else image
+
+# open an image for tiled detection
+# .npy files, binary .pgm / .ppm files and .raw files (headerless pixels, which need `rawShape`) are memory-mapped;
+# compressed formats have to be decoded whole with cv2.imread
+# inputs:
+# 1 path: path of the image
+# 2 rawShape: (height, width, channels) of a .raw file, whose pixels are uint8 in BGR (or grayscale) order
+# raises ValueError when the file cannot be read
+def open_image(path, rawShape=None):
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".npy":
+        return TiledImage(np.load(path, mmap_mode="r"))
+    if extension in (".pgm", ".ppm"):
+        (width, height, channels, offset) = read_pnm_header(path)
+        shape = (height, width) if channels == 1 else (height, width, channels)
+        return TiledImage(np.memmap(path, dtype="uint8", mode="r", offset=offset, shape=shape), rgb=channels == 3)
+    if extension == ".raw":
+        if rawShape is None:
+            raise ValueError(f"the shape of {path} is needed to map it")
+        return TiledImage(np.memmap(path, dtype="uint8", mode="r", shape=tuple(rawShape)))
+    image = cv2.imread(path)
+    if image is None:
+        raise ValueError(f"could not read {path}")
+    return TiledImage(image)
+
+# per-thread detectors of the pools below, so no detector object is ever used by two threads at the same time
+_LOCAL = threading.local()
+_LOCK = threading.Lock()
+
+def _thread_detector(dictName, params):
+    detectors = getattr(_LOCAL, "detectors", None)
+    if detectors is None:
+        detectors = _LOCAL.detectors = {}
+    key = (dictName, repr(params))
+    if key not in detectors:
+        detectors[key] = cv2.aruco.ArucoDetector(get_dictionary(dictName), get_parameters(params))
+    return detectors[key]
+
+# shared thread pools, one per size. Their threads, and so their detectors, live as long as the process
+_POOLS = {}
+
+def _pool(workers):
+    with _LOCK:
+        if workers not in _POOLS:
+            _POOLS[workers] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tiles")
+        return _POOLS[workers]
+
+# detects markers tile by tile, with cv2.aruco.ArucoDetector's interface
+# inputs:
+# 1 dictName: name of the ArUCo dictionary
+# 2 params: DetectorParameters overrides or profile name, see aruco_registry.get_parameters
+# 3 tileSize: side of the tiles, in pixels
+# 4 overlap: overlap of neighbouring tiles, in pixels. Must be larger than the largest marker
+# 5 workers: size of the thread pool. Defaults to the number of cores
+class TiledDetector:
+    def __init__(self, dictName="DICT_ARUCO_ORIGINAL", params=None, tileSize=2048, overlap=256, workers=None):
+        if overlap >= tileSize:
+            raise ValueError(f"the tile overlap ({overlap}) must be smaller than the tile size ({tileSize})")
+        self.dictName = dictName
+        self.params = params
+        self.tileSize = tileSize
+        self.overlap = overlap
+        self.workers = workers or os.cpu_count() or 1
+
+    # detect the markers of one tile
+    # returns: (corners, ids, margins) in image coordinates, where margins is how far each marker is from the
+    # nearest tile edge that is not an image edge
+    def _detect_tile(self, image, rect):
+        (x0, y0, x1, y1) = rect
+        (corners, ids, rejected) = _thread_detector(self.dictName, self.params).detectMarkers(image.tile(rect))
+        if ids is None or len(ids) == 0:
+            return (np.zeros((0, 4, 2), dtype="float32"), np.zeros(0, dtype="int32"), np.zeros(0))
+        corners = np.asarray(corners, dtype="float32").reshape(-1, 4, 2)
+        (height, width) = image.shape[:2]
+        edges = []
+        if x0 > 0:
+            edges.append(corners[:, :, 0].min(axis=1))
+        if y0 > 0:
+            edges.append(corners[:, :, 1].min(axis=1))
+        if x1 < width:
+            edges.append((x1 - x0) - corners[:, :, 0].max(axis=1))
+        if y1 < height:
+            edges.append((y1 - y0) - corners[:, :, 1].max(axis=1))
+        margins = np.min(edges, axis=0) if edges else np.full(len(ids), np.inf)
+        return (corners + (x0, y0), ids.ravel().astype("int32"), margins)
+
+    # returns: (corners, ids): (N, 4, 2) float32 corners in image coordinates and (N,) int32 ids
+    def detect(self, image):
+        image = image if isinstance(image, TiledImage) else TiledImage(image)
+        (height, width) = image.shape[:2]
+        executor = _pool(self.workers)
+        # at most 2 tiles per worker are in flight, which bounds the memory of a mapped image
+        (pending, results) = (deque(), [])
+        for rect in tile_grid(width, height, self.tileSize, self.overlap):
+            pending.append(executor.submit(self._detect_tile, image, rect))
+            if len(pending) >= 2 * self.workers:
+                results.append(pending.popleft().result())
+        while pending:
+            results.append(pending.popleft().result())
+
+        corners = np.concatenate([r[0] for r in results])
+        if len(corners) == 0:
+            return (corners, np.zeros(0, dtype="int32"))
+        ids = np.concatenate([r[1] for r in results])
+        # the detection farthest from a tile edge comes first, so it is the one kept
+        order = np.argsort(-np.concatenate([r[2] for r in results]), kind="stable")
+        return merge_duplicates(corners[order], ids[order])
+
+    # same outputs as cv2.aruco.ArucoDetector.detectMarkers, in image coordinates. Rejected candidates are not kept
+    def detectMarkers(self, image):
+        (corners, ids) = self.detect(image)
+        if len(ids) == 0:
+            return ((), None, ())
+        return (tuple(corners.reshape(-1, 1, 4, 2)), ids.reshape(-1, 1), ())
@@ -0,0 +1,170 @@
+from .instrumentation import NULL_STATS
+from .compositing import MODES, WARP_BUFFERS, roi_rect, border_mode, draw_mask, blend_fixed_point
+from collections import OrderedDict
+import numpy as np
+import cv2
+
+# Memoized warps for static or near-static tag layouts
+# When neither the camera nor the tags move, the destination points of a surface only change by sub-pixel
+# detection noise, yet every frame still pays for findHomography, the mask (fillConvexPoly + two erosions, or the
+# feather ramp) and warpPerspective's per-pixel projective division. A WarpMemo keeps, per surface position:
+# - the homography
+# - the ROI masks, and for the blending modes the alpha and its complement
+# - the remap tables of the warp: warpPerspective computes, for every ROI pixel, the source coordinates in fixed
+#   point (INTER_BITS fractional bits) before interpolating. The memo computes the same tables once, so later
+#   frames only run cv2.remap's lookup + interpolation, with the same result as warpPerspective
+# Entries are keyed on the destination corners quantized to `tolerance` pixels, plus the source size, the frame
+# size and the compositing mode. A lookup first tries the quantized key, then any entry with the same sizes and
+# mode whose corners are all within `tolerance` of the new ones (the key alone would miss when noise crosses a
+# quantization boundary). A hit composites at the entry's corners, so the overlay also stops jittering.
+
+# fractional bits of the remap tables, as used internally by warpPerspective and cv2.remap (INTER_BITS)
+INTER_BITS = 5
+INTER_TAB_SIZE = 1 << INTER_BITS
+
+# the precomputed state of one surface position
+class MemoEntry:
+    def __init__(self, points, context, H, rect):
+        self.points = points   # (4, 2) float64 destination points the entry was built for
+        self.context = context # (source size, frame shape, mode, feather)
+        self.H = H             # source -> frame homography
+        self.rect = rect       # (x0, y0, x1, y1) ROI in the frame, None when the quad is outside of it
+        self.map1 = None       # CV_16SC2 integer source coordinates of every ROI pixel
+        self.map2 = None       # CV_16UC1 interpolation table indices
+        self.keep = None       # "hard": 255 where the frame is kept
+        self.overlay = None    # "hard": 255 where the source replaces the frame; blending modes: the alpha
+        self.inverse = None    # blending modes: 255 - alpha
+
+# fixed point remap tables equivalent to cv2.warpPerspective(src, H, (roiW, roiH)) for the ROI at (x0, y0)
+# returns: (map1, map2) for cv2.remap with INTER_LINEAR
+def perspective_maps(H, rect):
+    (x0, y0, x1, y1) = rect
+    # warpPerspective maps destination pixels back with the inverse homography
+    M = np.linalg.inv(H)
+    (xs, ys) = np.meshgrid(np.arange(x0, x1, dtype="float64"), np.arange(y0, y1, dtype="float64"))
+    W = M[2, 0] * xs + M[2, 1] * ys + M[2, 2]
+    W = np.divide(INTER_TAB_SIZE, W, out=np.zeros_like(W), where=W != 0)
+    limit = np.iinfo("int32")
+    X = np.rint(np.clip((M[0, 0] * xs + M[0, 1] * ys + M[0, 2]) * W, limit.min, limit.max)).astype("int64")
+    Y = np.rint(np.clip((M[1, 0] * xs + M[1, 1] * ys + M[1, 2]) * W, limit.min, limit.max)).astype("int64")
+    map1 = np.empty(X.shape + (2,), dtype="int16")
+    map1[..., 0] = np.clip(X >> INTER_BITS, -32768, 32767)
+    map1[..., 1] = np.clip(Y >> INTER_BITS, -32768, 32767)
+    map2 = ((Y & (INTER_TAB_SIZE - 1)) * INTER_TAB_SIZE + (X & (INTER_TAB_SIZE - 1))).astype("uint16")
+    return (map1, map2)
+
+# inputs:
+# 1 tolerance: how far, in pixels, any corner may move before the entry is rebuilt
+# 2 maxEntries: number of positions remembered, least recently used first out. One per surface is enough for a
+#   static layout; a few more let a surface that alternates between two positions hit both
+# 3 useMaps: whether or not to precompute the remap tables. They cost 6 bytes per ROI pixel
+class WarpMemo:
+    def __init__(self, tolerance=0.5, maxEntries=8, useMaps=True):
+        if tolerance <= 0:
+            raise ValueError("the tolerance of a WarpMemo must be positive")
+        self.tolerance = tolerance
+        self.maxEntries = maxEntries
+        self.useMaps = useMaps
+        self.entries = OrderedDict() # key -> MemoEntry
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def key(self, points, context):
+        return (tuple(np.floor(points / self.tolerance).astype(int).ravel().tolist()), context)
+
+    # the entry of a surface position, built on a miss
+    # inputs:
+    # 1 destination_points: (4, 2) TL, TR, BR, BL destination points
+    # 2 source: the source image (only its size is used after the entry is built)
+    # 3 frameShape: shape of the frame it is composited on
+    # 4 mode, feather: compositing mode, see compositing.MODES
+    # 5 stats: optional StageStats, which counts "memo_hit" / "memo_miss"
+    # returns: the MemoEntry
+    def get(self, destination_points, source, frameShape, mode="hard", feather=8, stats=NULL_STATS):
+        if mode not in MODES:
+            raise ValueError(f"unknown compositing mode {mode}")
+        points = np.asarray(destination_points, dtype="float64").reshape(4, 2)
+        context = (source.shape[:2], tuple(frameShape), mode, feather if mode == "feather" else 0)
+        key = self.key(points, context)
+        entry = self.entries.get(key)
+        if entry is None or np.abs(entry.points - points).max() > self.tolerance:
+            entry = None
+            for (k, candidate) in self.entries.items():
+                if candidate.context == context and np.abs(candidate.points - points).max() <= self.tolerance:
+                    (key, entry) = (k, candidate)
+                    break
+        if entry is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            stats.count("memo_hit")
+            return entry
+
+        self.misses += 1
+        stats.count("memo_miss")
+        entry = self.build(points, source, context, stats)
+        self.entries[self.key(points, context)] = entry
+        while len(self.entries) > self.maxEntries:
+            self.entries.popitem(last=False)
+        return entry
+
+    def build(self, points, source, context, stats):
+        (_, frameShape, mode, feather) = context
+        (sourceH, sourceW) = source.shape[:2]
+        source_points = np.array([(0, 0), (sourceW, 0), (sourceW, sourceH), (0, sourceH)], dtype="float64")
+        with stats.stage("homography"):
+            (H, _) = cv2.findHomography(source_points, points)
+        entry = MemoEntry(points, context, H, roi_rect(points, frameShape[1], frameShape[0]))
+        if entry.rect is None:
+            return entry
+
+        (x0, y0, x1, y1) = entry.rect
+        (roiW, roiH) = (x1 - x0, y1 - y0)
+        with stats.stage("mask"):
+            entry.keep = np.empty((roiH, roiW), dtype="uint8")
+            entry.overlay = np.empty((roiH, roiW), dtype="uint8")
+            draw_mask(mode, points - (x0, y0), entry.keep, entry.overlay, feather)
+            if mode != "hard":
+                entry.inverse = cv2.bitwise_not(entry.overlay)
+                entry.keep = None
+        if self.useMaps:
+            with stats.stage("warp"):
+                (entry.map1, entry.map2) = perspective_maps(H, entry.rect)
+        return entry
+
+    def clear(self):
+        self.entries.clear()
+
+# compositing.composite for a memoized surface position: the frame is modified in place
+# inputs:
+# 1 frame: the frame
+# 2 source: the source image, which may change between calls as long as its size does not
+# 3 entry: the MemoEntry of the position, from WarpMemo.get
+# 4 buffers: optional WarpBuffers
+# 5 stats: optional StageStats
+def composite_memoized(frame, source, entry, buffers=None, stats=NULL_STATS):
+    if entry.rect is None:
+        return frame
+    buffers = WARP_BUFFERS if buffers is None else buffers
+    (x0, y0, x1, y1) = entry.rect
+    (roiW, roiH) = (x1 - x0, y1 - y0)
+    mode = entry.context[2]
+    (warped, _, _) = buffers.views(frame, roiW, roiH)
+    with stats.stage("warp"):
+        if entry.map1 is not None:
+            warped = cv2.remap(source, entry.map1, entry.map2, cv2.INTER_LINEAR, dst=warped, borderMode=border_mode(mode))
+        else:
+            T = np.array([[1, 0, -x0], [0, 1, -y0], [0, 0, 1]], dtype="float64")
+            warped = cv2.warpPerspective(source, T @ entry.H, (roiW, roiH), dst=warped, borderMode=border_mode(mode))
+
+    roi = frame[y0:y1, x0:x1]
+    with stats.stage("composite"):
+        if mode == "hard":
+            cv2.copyTo(warped, entry.overlay, roi)
+            cv2.add(roi, warped, dst=roi, mask=entry.keep)
+        else:
+            (_, acc, tmp) = buffers.blend_views(roiW, roiH)
+            blend_fixed_point(roi, warped, entry.overlay, entry.inverse, acc, tmp)
+    return frame
@@ -0,0 +1,155 @@
+# Headless benchmark suite: no camera and no display needed
+# usage: python benchmark_ar.py
+# usage: python benchmark_ar.py --resolutions 1280x720,3840x2160 --frames 30 --blur 1.0 --noise 4 --json results.json
+from functools import partial
+import argparse
+import json
+import sys
+import os
+import numpy as np
+import cv2
+
+# the shared `pyimagesearch` package lives alongside the video AR lesson
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "AR-6-video_ar_with_aruco"))
+from pyimagesearch.aruco_registry import ARUCO_DICT, get_dictionary, get_parameters, get_detector
+from pyimagesearch.augmented_reality import find_and_warp
+from pyimagesearch.dictionary_discovery import discover
+from pyimagesearch.pyramid_detection import PyramidDetector
+from pyimagesearch.synthetic import synthesize_frame, match_detections
+from pyimagesearch.benchmarking import run_case, format_table
+from pyimagesearch.surfaces import SurfaceLayout, SurfaceRenderer
+from pyimagesearch.warp_memo import WarpMemo
+from pyimagesearch.live_discovery import LiveDiscovery
+from pyimagesearch.tiled_detection import TiledDetector
+
+ap = argparse.ArgumentParser()
+ap.add_argument("-r", "--resolutions", type=str, default="640x480,1280x720,1920x1080", help="comma separated WxH frame sizes")
+ap.add_argument("-f", "--frames", type=int, default=20, help="number of synthetic frames per resolution")
+ap.add_argument("--repeat", type=int, default=1, help="how many times every frame set is run")
+ap.add_argument("-b", "--blur", type=float, default=0.0, help="sigma of the Gaussian blur applied to the frames")
+ap.add_argument("-n", "--noise", type=float, default=0.0, help="standard deviation of the Gaussian noise added to the frames")
+ap.add_argument("-s", "--seed", type=int, default=42, help="random seed of the synthetic frames")
+ap.add_argument("-j", "--json", type=str, default="", help="path to write the full report to as JSON")
+args = vars(ap.parse_args())
+
+# the AR surface used by opencv_ar_video.py: TL, TR, BR, BL tags. The synthetic frames use a 2x2 grid that is
+# filled row by row, so they are placed in TL, TR, BL, BR order
+TAG_IDS = (923, 1001, 241, 1007)
+AR_MARKERS = [("DICT_ARUCO_ORIGINAL", i) for i in (923, 1001, 1007, 241)]
+# a mix of families for the dictionary discovery cases
+MIXED_MARKERS = [("DICT_4X4_50", 7), ("DICT_5X5_250", 120), ("DICT_6X6_1000", 777), ("DICT_7X7_100", 42), ("DICT_ARUCO_ORIGINAL", 923), ("DICT_APRILTAG_36h11", 5)]
+
+# retail-display layout: 8 surfaces of 4 tags each on an 8 x 4 grid, every surface a 2 x 2 block of cells
+SURFACE_IDS = list(range(100, 132))
+SURFACE_LAYOUT = SurfaceLayout({f"screen{k}": (SURFACE_IDS[r * 8 + c], SURFACE_IDS[r * 8 + c + 1], SURFACE_IDS[(r + 1) * 8 + c + 1], SURFACE_IDS[(r + 1) * 8 + c])
+                                for (k, (r, c)) in enumerate((r, c) for r in (0, 2) for c in (0, 2, 4, 6))})
+SURFACE_MARKERS = [("DICT_ARUCO_ORIGINAL", i) for i in SURFACE_IDS]
+
+rng = np.random.default_rng(args["seed"])
+source = cv2.resize(rng.integers(0, 255, size=(36, 64, 3), dtype="uint8"), (640, 360), interpolation=cv2.INTER_NEAREST)
+arucoDict = get_dictionary("DICT_ARUCO_ORIGINAL")
+arucoParams = get_parameters()
+detector = get_detector("DICT_ARUCO_ORIGINAL")
+
+def make_frames(size, markers, maxAngle, cols=None):
+    return [synthesize_frame(size, markers, rng=rng, blur=args["blur"], noise=args["noise"], maxAngle=maxAngle, cols=cols) for _ in range(args["frames"])]
+
+# the brute-force loop of dicern_aruco.py before single-pass discovery: a fresh dictionary,
+# parameters and full detection per dictionary
+def brute_force_discovery(frame):
+    found = {}
+    for (name, code) in ARUCO_DICT.items():
+        d = cv2.aruco.getPredefinedDictionary(code)
+        (corners, ids, rejected) = cv2.aruco.ArucoDetector(d, cv2.aruco.DetectorParameters()).detectMarkers(frame)
+        if ids is not None and len(ids) > 0:
+            found[name] = (corners, ids)
+    return found
+
+# regression check of the single-pass discovery: the fraction of the frames where it finds the same markers of the
+# same dictionaries as the per-dictionary loop
+def discovery_agreement(frames):
+    same = 0
+    for frame in frames:
+        expected = {name: sorted(ids.ravel().tolist()) for (name, (_, ids)) in brute_force_discovery(frame).items()}
+        found = {name: sorted(ids.tolist()) for (name, (_, ids)) in discover(frame).items()}
+        same += found == expected
+    return {"loop_agreement": same / max(len(frames), 1)}
+
+# detection accuracy over a frame set, so that a faster mode that stops finding markers is obvious
+def accuracy(detect, frames, dictName):
+    (found, expected, errors) = (0, 0, [])
+    for (frame, truth) in frames:
+        (corners, ids, _) = detect(frame)
+        (f, e, err) = match_detections(corners, ids, truth, dictName)
+        found += f
+        expected += e
+        errors += err
+    return {"recall": found / max(expected, 1), "corner_error_px": float(np.mean(errors)) if errors else float("nan")}
+
+reports = []
+for resolution in args["resolutions"].split(","):
+    size = tuple(int(v) for v in resolution.lower().split("x"))
+    # small in-plane rotations keep the four tags in their TL, TR, BL, BR cells for the warp cases
+    arFrames = make_frames(size, AR_MARKERS, maxAngle=0.2, cols=2)
+    mixedFrames = make_frames(size, MIXED_MARKERS, maxAngle=np.pi)
+    images = [frame for (frame, _) in arFrames]
+    mixedImages = [frame for (frame, _) in mixedFrames]
+    surfaceFrames = [frame for (frame, _) in make_frames(size, SURFACE_MARKERS, maxAngle=0.15, cols=8)]
+    renderer = SurfaceRenderer(SURFACE_LAYOUT, detector, useCache=False, useROI=True)
+    surfaceSources = {name: source for name in SURFACE_LAYOUT.names()}
+    # fixed install: the same frame over and over, detected once up front so that only the warp is timed
+    staticFrames = [images[0]] * len(images)
+    staticDetections = detector.detectMarkers(images[0])[:2]
+    memo = WarpMemo(0.5)
+    memoRenderer = SurfaceRenderer(SURFACE_LAYOUT, detector, useCache=False, useROI=True, memo=WarpMemo(0.5, maxEntries=len(SURFACE_LAYOUT)))
+    staticSurfaceFrames = [surfaceFrames[0]] * len(surfaceFrames)
+    staticSurfaceDetections = detector.detectMarkers(surfaceFrames[0])[:2]
+    # streaming discovery once locked: the sampling frames are run up front
+    live = LiveDiscovery(sampleFrames=2, probeInterval=0)
+    for frame in mixedImages[:2]:
+        live.detect(frame)
+    smallest = min(np.linalg.norm(t["corners"][1] - t["corners"][0]) for (_, truth) in arFrames for t in truth)
+    pyramid = PyramidDetector(detector, smallest)
+    # tiles of a quarter of the frame (at least 256 pixels), overlapping by the largest marker
+    largest = max(np.linalg.norm(t["corners"][1] - t["corners"][0]) for (_, truth) in arFrames for t in truth)
+    tileSize = max(256, max(size) // 2)
+    tiled = TiledDetector("DICT_ARUCO_ORIGINAL", tileSize=tileSize, overlap=min(int(largest * 1.5) + 8, tileSize - 1))
+
+    cases = [
+        ("detect", detector.detectMarkers, images, accuracy(detector.detectMarkers, arFrames, "DICT_ARUCO_ORIGINAL")),
+        (f"detect pyramid x{pyramid.scale}", pyramid.detectMarkers, images, accuracy(pyramid.detectMarkers, arFrames, "DICT_ARUCO_ORIGINAL")),
+        (f"detect tiled {tileSize}", tiled.detectMarkers, images, accuracy(tiled.detectMarkers, arFrames, "DICT_ARUCO_ORIGINAL")),
+        ("discovery brute force", brute_force_discovery, mixedImages, None),
+        ("discovery single pass", discover, mixedImages, discovery_agreement(mixedImages)),
+        ("discovery live locked", live.detect, mixedImages, None),
+        ("find_and_warp", partial(find_and_warp, source=source, tagIDs=TAG_IDS, arucoDict=arucoDict, arucoParams=arucoParams, useCache=False), images, None),
+        # the ROI path composites in place, so it gets its own copies of the frames
+        ("find_and_warp roi", lambda frame: find_and_warp(frame.copy(), source, TAG_IDS, arucoDict, arucoParams, useCache=False, useROI=True), images, None),
+        ("find_and_warp roi aa", lambda frame: find_and_warp(frame.copy(), source, TAG_IDS, arucoDict, arucoParams, useCache=False, useROI=True, blend="aa"), images, None),
+        ("find_and_warp roi feather", lambda frame: find_and_warp(frame.copy(), source, TAG_IDS, arucoDict, arucoParams, useCache=False, useROI=True, blend="feather"), images, None),
+        # 8 surfaces per frame: the pipeline once per surface against one detection pass for all of them
+        ("8 surfaces find_and_warp x8", lambda frame: [find_and_warp(frame.copy(), source, tags, arucoDict, arucoParams, useCache=False, useROI=True) for tags in SURFACE_LAYOUT.surfaces.values()], surfaceFrames, None),
+        ("8 surfaces one pass", lambda frame: renderer.render(frame.copy(), surfaceSources), surfaceFrames, None),
+        # static tags: homography, mask and warp recomputed every frame against the memoized ones
+        ("static warp", lambda frame: find_and_warp(frame.copy(), source, TAG_IDS, arucoDict, arucoParams, useCache=False, useROI=True, detections=staticDetections), staticFrames, None),
+        ("static warp memo", lambda frame: find_and_warp(frame.copy(), source, TAG_IDS, arucoDict, arucoParams, useCache=False, useROI=True, detections=staticDetections, memo=memo), staticFrames, None),
+        ("static 8 surfaces warp", lambda frame: renderer.render(frame.copy(), surfaceSources, detections=staticSurfaceDetections), staticSurfaceFrames, None),
+        ("static 8 surfaces warp memo", lambda frame: memoRenderer.render(frame.copy(), surfaceSources, detections=staticSurfaceDetections), staticSurfaceFrames, None),
+    ]
+    for (name, fn, inputs, extra) in cases:
+        report = run_case(f"{name} @ {resolution}", fn, inputs, repeat=args["repeat"])
+        report["resolution"] = resolution
+        if extra is not None:
+            report.update(extra)
+        reports.append(report)
+
+print(format_table(reports))
+for r in reports:
+    if "recall" in r:
+        print(f"{r['case']}: recall {r['recall']:.2f}, mean corner error {r['corner_error_px']:.2f} px")
+    if "loop_agreement" in r:
+        print(f"{r['case']}: same markers as the per-dictionary loop on {r['loop_agreement']:.0%} of the frames")
+
+if args["json"] != "":
+    with open(args["json"], "w") as f:
+        json.dump({"settings": args, "reports": reports}, f, indent=2)